@@ -0,0 +1,118 @@
+"""
+LRU cache bounded by estimated memory footprint of its values.
+"""
+import sys, types
+import numpy as np
+from cachetools import LRUCache
+
+# Objects shared by the whole process. They are not counted in footprints.
+_sharedTypes = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType)
+
+def memoryFootprint(obj, exclude=()):
+    """
+    Estimates bytes of memory held by obj and all objects reachable from it, like a deep
+    sys.getsizeof. NumPy arrays count their data buffers. Objects reachable more than once
+    are counted once. Objects in exclude, and everything reachable only through them, are not counted.
+    """
+    seen = set(id(item) for item in exclude)
+    (stack, retval) = ([obj], 0)
+    while stack:
+        item = stack.pop()
+        if id(item) in seen or isinstance(item, _sharedTypes):
+            continue
+        seen.add(id(item))
+
+        # Arrays owning their data include it in getsizeof. Views count the object owning the data.
+        retval += sys.getsizeof(item, 0)
+        if isinstance(item, np.ndarray):
+            if item.base is not None:
+                stack.append(item.base)
+            continue
+        if isinstance(item, (str, bytes, bytearray, int, float, complex, bool, np.generic)):
+            continue
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            stack.extend(item)
+        if hasattr(item, "__dict__"):
+            stack.append(vars(item))
+        for slot in getattr(type(item), "__slots__", ()):
+            if isinstance(slot, str) and hasattr(item, slot):
+                stack.append(getattr(item, slot))
+    return retval
+
+class BudgetedLRUCache(LRUCache):
+    """
+    LRUCache, whose maxsize is a budget of bytes. Size of each value is estimated by
+    getsizeof(value) once, when it is inserted. Callers, which synchronize access with a lock,
+    can estimate the size before taking the lock and pass it to insert().
+    Least recently used values are evicted to stay within the budget. A single value larger
+    than the budget is still kept, after evicting all others, so that it isn't reloaded
+    on every use.
+    Not thread safe. Callers must synchronize access.
+    """
+    def __init__(self, maxBytes, getsizeof=memoryFootprint):
+        super().__init__(maxsize=maxBytes)
+        self.footprintOf = getsizeof
+        # Estimated bytes of each cached value, which may exceed the budget.
+        self.footprints = {}
+        self.pendingFootprint = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def getsizeof(self, value):
+        # Called by LRUCache.__setitem__ for the value being inserted.
+        return min(self.pendingFootprint, self.maxsize)
+
+    def __setitem__(self, key, value):
+        self.insert(key, value, self.footprintOf(value))
+
+    def insert(self, key, value, footprint):
+        """
+        Caches value at key, with its already estimated footprint in bytes.
+        """
+        self.pendingFootprint = footprint
+        super().__setitem__(key, value)
+        self.footprints[key] = footprint
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.footprints.pop(key, None)
+
+    def popitem(self):
+        # LRUCache evicts through popitem.
+        retval = super().popitem()
+        self.evictions += 1
+        return retval
+
+    def lookup(self, key, isValid=None):
+        """
+        Returns the value cached for key, or None. Counts a hit or a miss.
+        Values for which isValid(value) is False are removed and count as misses.
+        """
+        value = self.get(key)
+        if value is not None and isValid is not None and not isValid(value):
+            del self[key]
+            value = None
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def stats(self):
+        """
+        Returns counters and memory accounting of the cache.
+        """
+        return {
+            "hits" : self.hits,
+            "misses" : self.misses,
+            "evictions" : self.evictions,
+            "entries" : len(self),
+            "residentBytes" : sum(self.footprints.values()),
+            "maxBytes" : self.maxsize,
+            "footprints" : {str(key):footprint for (key, footprint) in self.footprints.items()},
+        }
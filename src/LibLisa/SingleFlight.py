@@ -0,0 +1,79 @@
+"""
+Coalescing of concurrent identical calls.
+"""
+import threading
+
+class _Call(object):
+    """
+    A call in flight. Threads waiting for it wait on done.
+    """
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight(object):
+    """
+    Runs at most one call per key at a time, within a process.
+    Threads calling do() with a key, whose call is already in flight, wait for that call and
+    share its result(or exception), instead of running the function again.
+
+    searchFlight = SingleFlight()
+    results = searchFlight.do(queryKey, lambda: rankQuery(query))
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+        # Count of calls, which ran the function.
+        self.executed = 0
+        # Count of calls, which waited for a call in flight and shared its result.
+        self.coalesced = 0
+        # Count of calls, which ran the function and raised an exception.
+        self.failed = 0
+
+    def do(self, key, function):
+        """
+        Returns function(), or the result of the call of function in flight for key.
+        """
+        with self.lock:
+            call = self.calls.get(key)
+            isLeader = call is None
+            if isLeader:
+                call = _Call()
+                self.calls[key] = call
+                self.executed += 1
+            else:
+                self.coalesced += 1
+
+        if not isLeader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function()
+        except BaseException as e:
+            call.error = e
+            with self.lock:
+                self.failed += 1
+            raise
+        finally:
+            # Later calls for the key start a new flight.
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+        return call.result
+
+    def stats(self):
+        """
+        Returns counters of calls.
+        """
+        with self.lock:
+            return {
+                "executed" : self.executed,
+                "coalesced" : self.coalesced,
+                "failed" : self.failed,
+                "inFlight" : len(self.calls),
+            }
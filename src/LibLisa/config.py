@@ -73,12 +73,30 @@ def LisaConfig():
     slideSearchConfig.Username = "test"
     slideSearchConfig.Password = "test"
     slideSearchConfig.isDjangoModel = True
+    # Count of queries, whose construct level features are cached by each search index.
+    slideSearchConfig.constructFeatureCacheSize = 256
+    # Count of best results ranked, when a query is made. Rest are ranked when paged into.
+    slideSearchConfig.resultTopK = 100
+    # Threads used to score large permitted slide sets. Sets smaller than the threshold are scored serially.
+    slideSearchConfig.predictThreadCount = os.cpu_count() or 1
+    slideSearchConfig.parallelPredictThreshold = 50000
+    # Count of best BM25 matches ranked by LambdaMART, unless a query sets CandidateCount. 0 ranks all slides.
+    slideSearchConfig.candidateCount = 0
+    # Search results are cached in memory of each ZenCentral process, for these many seconds and up to these many bytes.
+    slideSearchConfig.resultCacheTimeout = 3600
+    slideSearchConfig.resultCacheMaxBytes = 64 * 1024 * 1024
+    # Loaded search indices are kept in memory of each ZenCentral process, up to these many bytes.
+    slideSearchConfig.indexCacheMaxBytes = 4 * 1024 * 1024 * 1024
     retval.slideSearch = slideSearchConfig
 
     # Build and set SlideIndexer config.
     slideIndexerConfig = AttrDict()
     slideIndexerConfig.isDjangoModel = False
     slideIndexerConfig.IterationPeriod = 9000
+    # Most frequent query words, whose vectors are kept in the pruned word2vec model.
+    slideIndexerConfig.word2vecQueryWordCount = 5000
+    # Precompute float16 similarities of all tag pairs, when building seed training sets.
+    slideIndexerConfig.materializeTagSimilarities = True
     retval.slideIndexer = slideIndexerConfig
 
     # Build and set ZenCentral config.
@@ -113,10 +131,26 @@ def LisaConfig():
 
     retval.word2vecModelPath = repoRoot + "word2vec-slim/GoogleNews-vectors-negative300-SLIM.bin"
     # retval.word2vecModelPath = repoRoot + "word2vec/GoogleNews-vectors-negative300.bin"
+
+    # Memory mappable copy of the word2vec model. Built using "manage.py convertWord2vecModel".
+    retval.word2vecStorePath = repoRoot + "word2vec-slim/GoogleNews-vectors-negative300-SLIM"
+
+    # Count of out of vocabulary word vectors cached by a pruned word2vec model.
+    retval.word2vecFallbackCacheSize = 10000
+
+    # Memory budget for cached query word to tag similarities of each slide index.
+    retval.word2vecSimilarityCacheBytes = 64 * 1024 * 1024
     retval.dataFolderPath = retval.appRoot + "data/"
     if not os.path.exists(retval.dataFolderPath):
         os.makedirs(retval.dataFolderPath)
 
+    # Word2vec store pruned to the words slide search compares. Saved by SlideIndexer, loaded when serving.
+    retval.word2vecPrunedStorePath = retval.dataFolderPath + "word2vecPruned"
+    # Look up words missing in the pruned store from the complete model, loading it on first such lookup.
+    # Without it, rare query words missing in the pruned store have no vector and are not expanded.
+    # Disable only where the memory of the complete model can't be afforded.
+    retval.word2vecPrunedFallback = True
+
     # Set these file paths to save/cache results.
     retval.slideRatingsDataFilePath = retval.dataFolderPath + "slideRatings.json"
     if retval.hostname in ["lisa-dev"]:
@@ -2,6 +2,7 @@
 Slide search client is a REST API client which can make search queries to ZenCentral REST API for slide search.
 """
 import tempfile, pickle, json
+from collections import Counter
 from LibLisa.behaviors import Behavior
 from LibLisa.CoreApiRestClient import CoreApiRestClient
 from LibLisa.config import lisaConfig
@@ -56,9 +57,22 @@ class SearchClient(CoreApiRestClient):
 
         return qualifiedQueries
 
+    def getFrequentQueryWords(self, count):
+        """
+        Get the most frequent words used in search query templates.
+        """
+        wordCounts = Counter()
+        for queryTemplate in self.getModelInstances("templates"):
+            queryJson = queryTemplate["queryJson"]
+            words = set(queryJson.get("ScoreKeywords", []))
+            words.update(queryJson.get("FilterInKeywords", []))
+            wordCounts.update(words)
+
+        return [word for (word, _) in wordCounts.most_common(count)]
+
     def uploadSlideSearchIndex(self, slideSearchIndex, indexType, rankingSources, evalResults):
-        slideSearchIndexFilename = lisaConfig.dataFolderPath + "slideSearchIndex.pkl"
-        slideSearchIndex.saveTrainingResult(slideSearchIndexFilename)
+        slideSearchIndexFilename = lisaConfig.dataFolderPath + "slideSearchIndex.lisaidx"
+        slideSearchIndex.saveTrainingResult(slideSearchIndexFilename, curSchemaVersion)
 
         with open(slideSearchIndexFilename, "rb") as fp:
             retval = self.client.action(
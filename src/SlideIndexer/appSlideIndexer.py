@@ -10,7 +10,8 @@ from SlideIndexer.SearchClient import SearchClient
 from SlideIndexer.SlideDbClient import SlideDbClient
 from SlideIndexer.LisaZeptoClient import LisaZeptoClient
 
-from SlideSearch import SlideSearchW2V, SlideSearchLambdaMart, getSlideRatingVecs
+from SlideSearch import SlideSearchW2V, SlideSearchLambdaMart, getSlideRatingVecs, slideCatalogFromHierarchy
+from SlideSearch.Word2VecDistanceModel import buildPrunedWord2vecModel
 
 # Instantiate REST clients.
 slideDbClient = SlideDbClient()
@@ -31,9 +32,19 @@ def searchIndexCreatorThreadFunc():
     while True:
         # Get all changes made since last update.
         dataForIndexing = slideDbClient.getSlideHierarchy()
+        catalog = slideCatalogFromHierarchy(dataForIndexing)
 
         # Slide search using LambdaMART.
-        slideSearchIndex = SlideSearchLambdaMart(dataForIndexing, lisaConfig.slideIndexer)
+        slideSearchIndex = SlideSearchLambdaMart(catalog, lisaConfig.slideIndexer)
+
+        # Slide search only compares query words with slide tags. So, word2vec vectors are only
+        # needed for the tag vocabulary and for frequent query words. The pruned model is saved,
+        # so that serving never loads the complete model.
+        queryWords = searchClient.getFrequentQueryWords(lisaConfig.slideIndexer.word2vecQueryWordCount)
+        word2vecModel = buildPrunedWord2vecModel(slideSearchIndex.dictionary, queryWords)
+
+        # Query expansion index is saved with the slide search index, and loaded with it when serving.
+        slideSearchIndex.buildTagExpansionIndex(word2vecModel)
 
         # Collate slides rating data from the server.
         slideRatingsData = searchClient.getSlideRatingsData(dataForIndexing)
@@ -47,7 +58,10 @@ def searchIndexCreatorThreadFunc():
             # Generate slide ratings data, unless available from cached file.
             cachedFilePath = lisaConfig.simulatedSlideRatingsDataFilePath
             if cachedFilePath is None or not os.path.exists(cachedFilePath):
-                slideSearchIndexSeed = SlideSearchW2V(dataForIndexing, lisaConfig.slideIndexer)
+                slideSearchIndexSeed = SlideSearchW2V(catalog, lisaConfig.slideIndexer, word2vecModel)
+                if lisaConfig.slideIndexer.materializeTagSimilarities:
+                    # Seed training queries are tags. Their similarities become lookups.
+                    slideSearchIndexSeed.getTagsetMatrix().materializeTagSimilarities()
                 slideRatingsData = slideSearchIndex.buildSeedTrainingSet(slideSearchIndexSeed)
                 if cachedFilePath is not None:
                     with open(cachedFilePath, "w") as fp:
@@ -61,7 +75,7 @@ def searchIndexCreatorThreadFunc():
             rankingSources = [queryObj["id"] for queryObj in slideRatingsData]
 
         # Convert ratings data into (Tx, Ty, Tqids and TresultIds)
-        slideRatingVecs = getSlideRatingVecs(slideSearchIndex, slideRatingsData, dataForIndexing)
+        slideRatingVecs = getSlideRatingVecs(slideSearchIndex, slideRatingsData)
 
         # Now train LambdaMART index using the ratings data.
         evalResults = slideSearchIndex.fit(slideRatingVecs)
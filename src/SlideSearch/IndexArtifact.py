@@ -0,0 +1,120 @@
+"""
+Binary container for search index artifacts.
+    An artifact is a JSON header followed by raw NumPy arrays. Arrays are aligned at
+    ALIGNMENT bytes, so that they can be memory mapped in place, without any parsing.
+    Unlike pickles, loading an artifact never executes code stored in the file.
+
+Layout
+    MAGIC(8 bytes) | header length(uint64, little endian) | header JSON(utf-8) | padding | arrays
+    Header JSON has the fields
+        "schemaVersion" : Schema version of the index.
+        "arrays" : {name : {"dtype" : dtype string, "shape" : [...], "offset" : byte offset in file}}
+    and any other fields given by the writer.
+"""
+import json, os, struct
+import numpy as np
+
+from LibLisa import blockProfiler
+
+MAGIC = b"LISAIDX\0"
+ALIGNMENT = 64
+
+def alignedOffset(offset):
+    """
+    Smallest multiple of ALIGNMENT, which is not less than offset.
+    """
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+def writeArtifact(filename, header, arrays):
+    """
+    Writes the header(JSON serializable dict) and arrays({name : ndarray}) into filename.
+    """
+    with blockProfiler("IndexArtifact.writeArtifact"):
+        arrays = {name:np.ascontiguousarray(array) for (name, array) in arrays.items()}
+        for array in arrays.values():
+            if array.dtype.hasobject:
+                raise ValueError("Object arrays can't be stored in an artifact.")
+
+        # Array offsets depend on the header length, which depends on the offsets.
+        # Offsets are therefore computed relative to the end of the header, padded to
+        # a reserve, which is grown until the header fits.
+        reserve = ALIGNMENT
+        while True:
+            (arrayInfo, offset) = ({}, alignedOffset(len(MAGIC) + 8 + reserve))
+            for (name, array) in arrays.items():
+                arrayInfo[name] = {
+                    "dtype" : array.dtype.newbyteorder("<").str,
+                    "shape" : list(array.shape),
+                    "offset" : offset,
+                }
+                offset = alignedOffset(offset + array.nbytes)
+            headerBytes = json.dumps(dict(header, arrays=arrayInfo), sort_keys=True).encode("utf-8")
+            if len(headerBytes) <= reserve:
+                break
+            reserve = alignedOffset(len(headerBytes))
+
+        with open(filename, "wb") as fp:
+            fp.write(MAGIC)
+            fp.write(struct.pack("<Q", len(headerBytes)))
+            fp.write(headerBytes)
+            for (name, array) in arrays.items():
+                fp.write(b"\0" * (arrayInfo[name]["offset"] - fp.tell()))
+                fp.write(array.astype(arrayInfo[name]["dtype"], copy=False).tobytes())
+            # Pad the end as well, so that offsets of empty arrays are within the file.
+            fp.write(b"\0" * (offset - fp.tell()))
+
+def artifactPath(filePointer):
+    """
+    Path of the file behind filePointer, if it is a local file which can be memory mapped.
+    Django FieldFiles have path, regular files have name.
+    """
+    for attrName in ["path", "name"]:
+        try:
+            path = getattr(filePointer, attrName, None)
+        except (NotImplementedError, ValueError):
+            # Storages without local files raise on path.
+            continue
+        if isinstance(path, str) and os.path.isfile(path):
+            return path
+    return None
+
+def readArtifact(filePointer, schemaVersion):
+    """
+    Reads an artifact written by writeArtifact. Returns (header, arrays).
+    Arrays are read-only and memory mapped, if filePointer is a local file.
+    Raises ValueError, if the file isn't a valid artifact of schemaVersion.
+    """
+    with blockProfiler("IndexArtifact.readArtifact"):
+        path = artifactPath(filePointer)
+        if path is not None:
+            buffer = np.memmap(path, dtype=np.uint8, mode="r")
+        else:
+            if hasattr(filePointer, "seek"):
+                filePointer.seek(0)
+            buffer = np.frombuffer(filePointer.read(), dtype=np.uint8)
+
+        prefixLength = len(MAGIC) + 8
+        if len(buffer) < prefixLength or buffer[:len(MAGIC)].tobytes() != MAGIC:
+            raise ValueError("Not a search index artifact.")
+        (headerLength,) = struct.unpack("<Q", buffer[len(MAGIC):prefixLength].tobytes())
+        if prefixLength + headerLength > len(buffer):
+            raise ValueError("Truncated search index artifact.")
+        header = json.loads(buffer[prefixLength:prefixLength + headerLength].tobytes().decode("utf-8"))
+        if header.get("schemaVersion") != schemaVersion:
+            raise ValueError("Artifact has schema version {0}, expected {1}.".format(
+                header.get("schemaVersion"), schemaVersion))
+
+        arrays = {}
+        for (name, info) in header.pop("arrays").items():
+            dtype = np.dtype(info["dtype"])
+            if dtype.hasobject:
+                raise ValueError("Artifact array {0} has object dtype.".format(name))
+            shape = tuple(info["shape"])
+            (start, count) = (info["offset"], int(np.prod(shape, dtype=np.int64)))
+            end = start + count * dtype.itemsize
+            if start < prefixLength + headerLength or end > len(buffer):
+                raise ValueError("Artifact array {0} is out of bounds.".format(name))
+            array = buffer[start:end].view(dtype).reshape(shape)
+            array.flags.writeable = False
+            arrays[name] = array
+        return (header, arrays)
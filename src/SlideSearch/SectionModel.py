@@ -1,67 +1,330 @@
 """
 SectionModel is used to build a model 
 """
-import gensim
+import copy, time, tracemalloc
+import numpy as np
+import scipy.sparse
 
 from LibLisa import methodProfiler, blockProfiler, lastCallProfile
 from SlideSearch.Word2VecDistanceModel import word2vecDistanceModel
 
+# BM25 parameters. Same defaults as gensim.summarization.bm25.
+PARAM_K1 = 1.5
+PARAM_B = 0.75
+
+# Negative IDFs are replaced by EPSILON * average IDF.
+EPSILON = 0.25
+
 class SectionModel(object):
     """
     Indexes a text segment for search and provides the ability to generate features like:
         BM25, TFIDF, SemanticSimilarity, 
+    References:
+        BM25: https://en.wikipedia.org/wiki/Okapi_BM25
+
+    Term frequencies are kept in tfMatrix, a CSR matrix of (documents x terms).
+    Terms are numbered by their ids in dictionary. Terms of corpus, missing in dictionary,
+    get ids after the largest id of dictionary.
+
+    postings is the same matrix in CSC layout. Column of a term lists documents containing
+    the term(postings.indices) with the term frequencies(postings.data). Queries are
+    evaluated over postings of query terms, so that only documents containing them are visited.
+
+    Documents can be added, removed and updated after the model is built.
+        Added documents go into deltaTfMatrix and deltaPostings, which hold documents
+        starting at index deltaStart. The delta is merged into the main matrices, once it grows
+        beyond a fraction of them.
+        Removed documents are only marked in removed. They keep their index, so that indices
+        of other documents never change.
+        Document frequencies are maintained as documents come and go. IDFs follow them.
+    Documents aren't kept. Terms of a document are read back from its row of the tf matrices.
     """
-    def __init__(self, corpus, dictionary):
+    def __init__(self, corpus, dictionary, k1=PARAM_K1, b=PARAM_B):
         with blockProfiler("SectionModel.__init__"):
-            self.corpus = corpus
+            corpus = list(corpus)
+            # Count of documents, including removed ones.
+            self.docCount = len(corpus)
 
             # Create a word dictionary for use in vector building.
             # self.dictionary = gensim.corpora.Dictionary(self.corpus)
             self.dictionary = dictionary
 
-            # Build a TFIDF model for the corpus.
-            self.tfidfModel = gensim.models.TfidfModel(self.corpus, dictionary=self.dictionary)
+            self.k1 = k1
+            self.b = b
+
+            # Term ids. Extended with terms found only in the corpus.
+            self.termToId = dict(self.dictionary.token2id)
+            self.termCount = max(self.termToId.values(), default=-1) + 1
+
+            self.tfMatrix = self.buildTfMatrix(corpus)
+            self.postings = self.buildPostings(self.tfMatrix)
+            self.deltaStart = self.docCount
+            self.deltaTfMatrix = self.buildTfMatrix([])
+            self.deltaPostings = self.buildPostings(self.deltaTfMatrix)
+
+            self.docLengths = np.asarray(self.tfMatrix.sum(axis=1)).ravel()
+            self.removed = np.zeros(self.docCount, dtype=bool)
+            self.docFreqs = np.bincount(self.tfMatrix.indices, minlength=self.termCount)
+            self.updateIdf()
+
+    def buildTfMatrix(self, docs):
+        """
+        Builds CSR term frequency matrix of docs. New terms are assigned ids.
+        """
+        termIds = []
+        docOffsets = [0]
+        for doc in docs:
+            for term in doc:
+                termId = self.termToId.get(term)
+                if termId is None:
+                    termId = self.termToId[term] = self.termCount
+                    self.termCount += 1
+                termIds.append(termId)
+            docOffsets.append(len(termIds))
+
+        # Duplicate (doc, term) entries are summed up into term frequencies.
+        docIndices = np.repeat(np.arange(len(docs)), np.diff(docOffsets))
+        tfMatrix = scipy.sparse.csr_matrix(
+            (np.ones(len(termIds), dtype=np.float64), (docIndices, np.array(termIds, dtype=np.int64))),
+            shape=(len(docs), self.termCount))
+        tfMatrix.sum_duplicates()
+        return tfMatrix
+
+    def buildPostings(self, tfMatrix):
+        """
+        Postings(CSC layout) of a term frequency matrix.
+        """
+        postings = tfMatrix.tocsc()
+        postings.sort_indices()
+        return postings
 
-            self.bm25 = gensim.summarization.bm25.BM25(self.corpus)
+    def widened(self, tfMatrix):
+        """
+        tfMatrix with columns for all terms known now.
+        """
+        return scipy.sparse.csr_matrix((tfMatrix.data, tfMatrix.indices, tfMatrix.indptr), shape=(tfMatrix.shape[0], self.termCount))
 
-            self.average_idf = sum(float(val) for val in self.bm25.idf.values()) / len(self.bm25.idf)
+    def updateIdf(self):
+        """
+        Recomputes IDFs and average document length from document frequencies.
+        """
+        liveDocCount = self.docCount - int(np.count_nonzero(self.removed))
+
+        # IDF as in gensim.summarization.bm25. Terms not in corpus have no IDF.
+        inCorpus = self.docFreqs > 0
+        idf = np.zeros(self.termCount, dtype=np.float64)
+        idf[inCorpus] = np.log(liveDocCount - self.docFreqs[inCorpus] + 0.5) - np.log(self.docFreqs[inCorpus] + 0.5)
+        average_idf = float(np.mean(idf[inCorpus])) if inCorpus.any() else 0.0
+
+        # IDF used by features.
+        self.featureIdf = np.where(idf >= 0, idf, EPSILON * average_idf)
+        (self.idf, self.average_idf) = (idf, average_idf)
+        self.averageDocLength = float(np.mean(self.docLengths[~self.removed])) if liveDocCount else 0.0
 
     @methodProfiler
-    def get_bm25(self, queryDoc, corpusIndex):
-        return self.bm25.get_score(queryDoc, corpusIndex, self.average_idf)
+    def add_documents(self, docs):
+        """
+        Adds docs to the model. Returns an array of indices assigned to them.
+        """
+        docs = list(docs)
+        start = self.docCount
+        tfMatrix = self.buildTfMatrix(docs)
+        self.docCount += len(docs)
+
+        self.docFreqs = np.concatenate([self.docFreqs, np.zeros(self.termCount - len(self.docFreqs), dtype=self.docFreqs.dtype)])
+        self.docFreqs += np.bincount(tfMatrix.indices, minlength=self.termCount)
+        self.docLengths = np.concatenate([self.docLengths, np.asarray(tfMatrix.sum(axis=1)).ravel()])
+        self.removed = np.concatenate([self.removed, np.zeros(len(docs), dtype=bool)])
+
+        deltaTfMatrix = scipy.sparse.vstack([self.widened(self.deltaTfMatrix), tfMatrix], format="csr")
+        if deltaTfMatrix.shape[0] > max(1000, self.tfMatrix.shape[0] // 10):
+            # Merge delta into main matrices.
+            self.tfMatrix = scipy.sparse.vstack([self.widened(self.tfMatrix), deltaTfMatrix], format="csr")
+            self.postings = self.buildPostings(self.tfMatrix)
+            self.deltaStart = self.docCount
+            deltaTfMatrix = self.buildTfMatrix([])
+        self.deltaTfMatrix = deltaTfMatrix
+        self.deltaPostings = self.buildPostings(deltaTfMatrix)
+
+        self.updateIdf()
+        return np.arange(start, self.docCount)
 
     @methodProfiler
-    def get_features(self, queryDoc, ftrArray=None, permittedIndices=None):
+    def remove_documents(self, indices):
+        """
+        Removes documents at indices from the model. Indices of other documents stay the same.
+        """
+        indices = np.unique(np.asarray(indices, dtype=np.int64))
+        indices = indices[~self.removed[indices]]
+        if not len(indices):
+            return
+        np.subtract.at(self.docFreqs, self.documentTermIds(indices), 1)
+        self.removed[indices] = True
+        self.updateIdf()
+
+    def documentTermIds(self, indices):
+        """
+        Concatenated ids of distinct terms of documents at indices.
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        inDelta = indices >= self.deltaStart
+        return np.concatenate([
+            self.tfMatrix[indices[~inDelta]].indices,
+            self.deltaTfMatrix[indices[inDelta] - self.deltaStart].indices]).astype(np.int64)
+
+    def copy(self):
+        """
+        Returns a copy of the model, which can be changed by add_documents() and remove_documents()
+        without changing this model. Matrices, which are only ever replaced, and the dictionary
+        are shared.
+        """
+        retval = copy.copy(self)
+        retval.termToId = dict(self.termToId)
+        retval.docFreqs = self.docFreqs.copy()
+        retval.removed = self.removed.copy()
+        return retval
+
+    def update_document(self, index, doc):
+        """
+        Replaces document at index with doc. Returns the new index of the document.
+        """
+        self.remove_documents([index])
+        return self.add_documents([doc])[0]
+
+    def queryPostings(self, words):
+        """
+        Concatenated postings of the words. Returns (documents, term frequencies, IDFs).
+        Each word is repeated as many times as it occurs in words.
+        Words not found in corpus and removed documents are skipped.
+        """
+        termIds = [self.termToId[word] for word in words if word in self.termToId]
+        (docs, tfs, idfs) = ([], [], [])
+        for (postings, docOffset) in [(self.postings, 0), (self.deltaPostings, self.deltaStart)]:
+            for termId in termIds:
+                if termId >= postings.shape[1]:
+                    continue
+                (start, end) = (postings.indptr[termId], postings.indptr[termId + 1])
+                docs.append(postings.indices[start:end] + docOffset)
+                tfs.append(postings.data[start:end])
+                idfs.append(np.full(end - start, self.featureIdf[termId]))
+        if not docs:
+            return (np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0))
+        (docs, tfs, idfs) = (np.concatenate(docs), np.concatenate(tfs), np.concatenate(idfs))
+        live = ~self.removed[docs]
+        return (docs[live], tfs[live], idfs[live])
+
+    @methodProfiler
+    def get_bm25(self, queryDoc, corpusIndex=None, permittedIndices=None):
+        """
+        BM25 score of query words in queryDoc, for the document at corpusIndex.
+        If corpusIndex is None, returns an array of BM25 scores of documents at permittedIndices,
+        or of all documents, if permittedIndices is None.
+        """
+        (docs, tfs, idfs) = self.queryPostings(queryDoc)
+        docNorms = self.k1 * (1 - self.b + self.b * self.docLengths[docs] / max(self.averageDocLength, 1e-12))
+        weights = idfs * tfs * (self.k1 + 1) / (tfs + docNorms)
+        if corpusIndex is not None:
+            return float(weights[docs == corpusIndex].sum())
+        if permittedIndices is None:
+            return np.bincount(docs, weights=weights, minlength=self.docCount)
+
+        # Scores are summed only over matched documents, and then looked up for permitted ones.
+        permittedIndices = np.asarray(permittedIndices, dtype=np.int64)
+        scores = np.zeros(len(permittedIndices))
+        (matchedDocs, docIndices) = np.unique(docs, return_inverse=True)
+        (positions, found) = matchPositions(matchedDocs, permittedIndices)
+        scores[found] = np.bincount(docIndices, weights=weights)[positions[found]]
+        return scores
+
+    @methodProfiler
+    def get_features(self, queryDoc, permittedIndices=None, out=None):
+        """
+        Computes features sum_tf, sum_idf and sum_tfidf of query's ScoreKeywords, for each
+        permitted document. Returns a (permitted documents x 3) float32 array.
+        If out is given, features are written into it and it is returned.
+        Work done is proportional to the count of documents matched and permitted, not to the
+        size of the corpus.
+        """
         if permittedIndices is None:
-            permittedIndices = range(len(self.corpus))
-
-        if ftrArray is None:
-            ftrArray = [[] for _ in permittedIndices]
-
-        curIndex = 0
-        for corpusIndex in permittedIndices:
-            corpusDoc = self.corpus[corpusIndex]
-
-            sum_tf = 0
-            sum_idf = 0
-            sum_tfidf = 0
-            if "ScoreKeywords" in queryDoc:
-                for word in queryDoc["ScoreKeywords"]:
-                    if word not in self.bm25.f[corpusIndex]:
-                        continue
-                    tf = self.bm25.f[corpusIndex][word]
-                    idf = self.bm25.idf[word] if self.bm25.idf[word] >= 0 else EPSILON * self.average_idf
-
-                    sum_tf += tf
-                    sum_idf += idf
-                    sum_tfidf += tf * idf
-
-            # Append TF-IDF features.
-            ftrArray[curIndex].extend([sum_tf, sum_idf, sum_tfidf])
-
-            # Append word2vec distance.
-            # word2vecDistance = word2vecDistanceModel.queryPhrase2TagsetSimilarity(queryDoc["Keywords"], corpusDoc)
-            # ftrArray[curIndex].append(word2vecDistance)
-
-            curIndex += 1
-        return ftrArray
\ No newline at end of file
+            permittedIndices = np.arange(self.docCount)
+        permittedIndices = np.asarray(permittedIndices, dtype=np.int64)
+        if out is None:
+            out = np.zeros((len(permittedIndices), 3), dtype=np.float32)
+        else:
+            # Documents not containing any query term have all zero features.
+            out[...] = 0
+
+        (docs, tfs, idfs) = self.queryPostings(queryDoc.get("ScoreKeywords", []))
+        if len(docs):
+            # Each query word is counted as many times as it occurs in the query.
+            (matchedDocs, docIndices) = np.unique(docs, return_inverse=True)
+            features = np.empty((len(matchedDocs), 3), dtype=np.float32)
+            features[:, 0] = np.bincount(docIndices, weights=tfs)
+            features[:, 1] = np.bincount(docIndices, weights=idfs)
+            features[:, 2] = np.bincount(docIndices, weights=tfs * idfs)
+            (positions, found) = matchPositions(matchedDocs, permittedIndices)
+            out[found] = features[positions[found]]
+
+        # Append word2vec distance.
+        # word2vecDistance = word2vecDistanceModel.queryPhrase2TagsetSimilarity(queryDoc["Keywords"], corpusDoc)
+        # ftrArray[curIndex].append(word2vecDistance)
+
+        return out
+
+def matchPositions(matchedDocs, permittedIndices):
+    """
+    Looks up permittedIndices in matchedDocs, a sorted array of unique document indices.
+    Returns (positions, found). Where found is True, matchedDocs[positions] == permittedIndices.
+    """
+    positions = np.searchsorted(matchedDocs, permittedIndices)
+    np.minimum(positions, max(len(matchedDocs) - 1, 0), out=positions)
+    found = matchedDocs[positions] == permittedIndices if len(matchedDocs) else np.zeros(len(permittedIndices), dtype=bool)
+    return (positions, found)
+
+def benchmark(docCount=50000, vocabularySize=20000, docLength=12, queryCount=200, seed=0):
+    """
+    Compares SectionModel with gensim.summarization.bm25(available only before gensim 4) on
+    synthetic Zipf distributed corpus. Reports build time, memory allocated while building
+    and time per query.
+    """
+    randomState = np.random.RandomState(seed)
+    words = ["w{0}".format(index) for index in range(vocabularySize)]
+    def randomDoc(length):
+        return [words[index % vocabularySize] for index in randomState.zipf(1.3, size=length)]
+    corpus = [randomDoc(randomState.randint(1, 2 * docLength)) for _ in range(docCount)]
+    queries = [randomDoc(randomState.randint(1, 4)) for _ in range(queryCount)]
+
+    class Dictionary(object):
+        token2id = {word:index for (index, word) in enumerate(words)}
+
+    def measure(name, build, score):
+        tracemalloc.start()
+        startTime = time.time()
+        model = build()
+        buildTime = time.time() - startTime
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        startTime = time.time()
+        for query in queries:
+            score(model, query)
+        queryTime = (time.time() - startTime) / len(queries)
+        print("{0}: build {1:.2f}s, memory {2:.1f}MB, query {3:.2f}ms".format(
+            name, buildTime, memory / 2**20, queryTime * 1000))
+
+    measure("SectionModel",
+            lambda : SectionModel(corpus, Dictionary()),
+            lambda model, query : model.get_bm25(query))
+    try:
+        from gensim.summarization.bm25 import BM25
+    except ImportError:
+        print("gensim.summarization.bm25 is not available.")
+        return
+
+    def gensimScores(model, query):
+        averageIdf = sum(model.idf.values()) / len(model.idf)
+        return [model.get_score(query, index, averageIdf) for index in range(docCount)]
+
+    measure("gensim BM25", lambda : BM25(corpus), gensimScores)
+
+if __name__ == "__main__":
+    benchmark()
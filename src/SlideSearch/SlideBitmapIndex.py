@@ -0,0 +1,170 @@
+"""
+Bitmap index over the attributes and tags of slides in a SlideCatalog.
+Filters of a query are evaluated as AND/OR/ANDNOT over bitmaps, 64 slides per word operation.
+"""
+import numpy as np
+
+from LibLisa import methodProfiler, blockProfiler
+
+def wordCount(rowCount):
+    """
+    Count of 64 bit words in a bitmap of rowCount bits.
+    """
+    return (rowCount + 63) // 64
+
+def maskToBitmap(mask):
+    """
+    Packs a boolean array into a bitmap of uint64 words. Bit i is set if mask[i] is True.
+    """
+    mask = np.asarray(mask, dtype=bool)
+    packed = np.packbits(mask, bitorder="little")
+    words = np.zeros(wordCount(len(mask)) * 8, dtype=np.uint8)
+    words[:len(packed)] = packed
+    return words.view(np.uint64)
+
+def rowsToBitmap(rows, rowCount):
+    """
+    Bitmap of rowCount bits, with bits of given rows set.
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    bitmap = np.zeros(wordCount(rowCount), dtype=np.uint64)
+    np.bitwise_or.at(bitmap, rows >> 6, np.left_shift(np.uint64(1), (rows & 63).astype(np.uint64)))
+    return bitmap
+
+def bitmapToRows(bitmap, rowCount):
+    """
+    Sorted array of rows, whose bits are set in the bitmap.
+    """
+    bits = np.unpackbits(bitmap.view(np.uint8), bitorder="little")[:rowCount]
+    return np.flatnonzero(bits)
+
+class Postings(object):
+    """
+    Rows of each key, for keys with many distinct values, like tags and constructs.
+    Dense bitmaps for all such keys would need keys x slides bits. Postings need space
+    only for the slides having each key and are turned into a bitmap when queried.
+    """
+    def __init__(self, keys, rows):
+        """
+        keys[i] is a key of slide at rows[i].
+        """
+        keys = np.asarray(keys)
+        rows = np.asarray(rows, dtype=np.int64)
+        order = np.lexsort((rows, keys))
+        (uniqueKeys, starts) = np.unique(keys[order], return_index=True)
+        self.rows = rows[order]
+        self.offsets = np.append(starts, len(self.rows))
+        self.keyToIndex = {key:index for (index, key) in enumerate(uniqueKeys.tolist())}
+
+    def getRows(self, key):
+        """
+        Sorted rows of slides having the key.
+        """
+        index = self.keyToIndex.get(key)
+        if index is None:
+            return self.rows[:0]
+        return self.rows[self.offsets[index]:self.offsets[index + 1]]
+
+class SlideBitmapIndex(object):
+    """
+    Bitmap index of a SlideCatalog.
+        Low cardinality attributes (flags and enums) have a dense bitmap per value.
+        Tags and constructs have postings, which are turned into bitmaps on demand.
+    Rows, which are not live in the catalog, are never permitted.
+    """
+    def __init__(self, catalog):
+        with blockProfiler("SlideBitmapIndex.__init__"):
+            self.rowCount = len(catalog)
+            self.all = maskToBitmap(np.ones(self.rowCount, dtype=bool))
+            self.live = maskToBitmap(catalog.live)
+            self.enabled = maskToBitmap(catalog.enabled)
+            self.hierarchyEnabled = maskToBitmap(catalog.hierarchyEnabled)
+            self.hasIcon = maskToBitmap(catalog.hasIcon)
+            self.hasImage = maskToBitmap(catalog.hasImage)
+
+            def valueBitmaps(column):
+                return {value:maskToBitmap(column == value) for value in np.unique(column).tolist()}
+
+            self.layout = valueBitmaps(catalog.layout)
+            self.style = valueBitmaps(catalog.style)
+            self.content = valueBitmaps(catalog.content)
+            self.visualStyle = valueBitmaps(catalog.visualStyle)
+
+            self.tagPostings = Postings(catalog.tagIds, catalog.tagRows)
+            self.tagToId = catalog.tagToId
+            self.constructPostings = Postings(catalog.constructIds, np.arange(self.rowCount))
+
+    def flagBitmap(self, flagBitmap, value):
+        """
+        Bitmap of slides, whose flag is value.
+        """
+        return flagBitmap if value else (self.all & ~flagBitmap)
+
+    def valuesBitmap(self, valueBitmaps, values):
+        """
+        Bitmap of slides, having any of the values.
+        """
+        retval = np.zeros(len(self.all), dtype=np.uint64)
+        for value in values:
+            bitmap = valueBitmaps.get(value)
+            if bitmap is not None:
+                retval |= bitmap
+        return retval
+
+    def tagBitmap(self, tag):
+        """
+        Bitmap of slides, having the tag.
+        """
+        tagId = self.tagToId.get(tag)
+        rows = self.tagPostings.getRows(tagId) if tagId is not None else []
+        return rowsToBitmap(rows, self.rowCount)
+
+    def constructsBitmap(self, constructIds):
+        """
+        Bitmap of slides, belonging to any of the constructs.
+        """
+        rows = [self.constructPostings.getRows(constructId) for constructId in constructIds]
+        return rowsToBitmap(np.concatenate(rows) if rows else [], self.rowCount)
+
+    @methodProfiler
+    def permittedRows(self, queryInfo):
+        """
+        Applies filters of queryInfo. See SlideSearchBase.getPermittedSlides for the filters.
+        Returns a sorted array of rows of the permitted slides.
+        """
+        permitted = self.live.copy()
+
+        for word in queryInfo.get("FilterInKeywords", []):
+            permitted &= self.tagBitmap(word)
+
+        for word in queryInfo.get("FilterOutKeywords", []):
+            permitted &= ~self.tagBitmap(word)
+
+        if "Constructs" in queryInfo.keys():
+            permitted &= self.constructsBitmap(queryInfo["Constructs"])
+
+        if "HasIcon" in queryInfo.keys():
+            permitted &= self.flagBitmap(self.hasIcon, queryInfo["HasIcon"])
+
+        if "HasImage" in queryInfo.keys():
+            permitted &= self.flagBitmap(self.hasImage, queryInfo["HasImage"])
+
+        if "Layout" in queryInfo.keys():
+            permitted &= self.valuesBitmap(self.layout, queryInfo["Layout"])
+
+        if "Style" in queryInfo.keys():
+            permitted &= self.valuesBitmap(self.style, queryInfo["Style"])
+
+        if "Content" in queryInfo.keys():
+            permitted &= self.valuesBitmap(self.content, queryInfo["Content"])
+
+        if "VisualStyle" in queryInfo.keys():
+            permitted &= self.valuesBitmap(self.visualStyle, queryInfo["VisualStyle"])
+
+        if queryInfo.get("IsEnabled", True):
+            permitted &= self.enabled
+
+        if not (queryInfo.get("IncludeDisabledHierarchy", False)):
+            permitted &= self.hierarchyEnabled
+
+        return bitmapToRows(permitted, self.rowCount)
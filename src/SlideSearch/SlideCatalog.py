@@ -0,0 +1,356 @@
+"""
+SlideCatalog is an immutable, columnar snapshot of the slide hierarchy.
+Search engines consume slides only through a SlideCatalog, whether the slides came from
+Django models or from the SlideDB REST API.
+"""
+import copy, threading
+import numpy as np
+
+from LibLisa import methodProfiler, blockProfiler
+from SlideSearch.SlideBitmapIndex import SlideBitmapIndex
+
+# Values of the enums in SlideDB.models. Needed when slides come from the REST API, which
+# serializes enums by their names.
+layoutValues = {"Basic": 0, "Enhanced": 1}
+styleValues = {"Basic": 0, "Enhanced": 1, "Extensive": 2}
+contentValues = {"Limited": 0, "Medium": 1, "Extensive": 2}
+
+# Visual style is derived from (style, layout). See SlideDB.models.Slide.visualStyle.
+visualStyleValues = {(0, 0): 0, (0, 1): 1, (1, 0): 2, (1, 1): 3}
+
+def enumValue(value, namesToValues):
+    """
+    Converts an enum member, an enum name or an enum value into the enum value.
+    """
+    if isinstance(value, str):
+        if namesToValues is not None and value in namesToValues:
+            return namesToValues[value]
+        # Enum fields store values as strings in the DB.
+        return int(value)
+    return getattr(value, "value", value)
+
+# Columns, to which patched() appends rows. See ColumnBuffer.
+appendedColumns = [
+    "ids", "constructIds", "enabled", "hasIcon", "hasImage", "layout", "style", "content",
+    "zeptoDownloads", "visualStyle", "constructPathIndex", "hierarchyEnabled", "tagIds", "tagOffsets", "tagRows",
+]
+
+class ColumnBuffer(object):
+    """
+    Array backing a column of a catalog and catalogs patched from it, with spare capacity for
+    appended rows. Each catalog sees a prefix of the array. Rows are appended in place, if the
+    prefix being extended ends where rows appended so far do. Otherwise, another patch has
+    already appended there, and the prefix is copied into a new buffer. Prefixes seen by existing
+    catalogs are never written. So, like list.append(), appending costs proportional to the rows
+    appended, besides an occasional copy.
+    """
+    def __init__(self, array, used=None):
+        """
+        Constructor
+        """
+        self.array = array
+        self.used = len(array) if used is None else used
+        self.lock = threading.Lock()
+
+    def appended(self, length, values):
+        """
+        Appends values after the first length entries of the buffer.
+        Returns (buffer holding the result, array of the length + len(values) entries).
+        """
+        newLength = length + len(values)
+        with self.lock:
+            if self.used == length and newLength <= len(self.array):
+                self.array[length:newLength] = values
+                self.used = newLength
+                return (self, self.array[:newLength])
+
+        # Spare capacity of an eighth amortizes copies over many patches.
+        array = np.empty(newLength + newLength // 8 + 16, dtype=self.array.dtype)
+        array[:length] = self.array[:length]
+        array[length:newLength] = values
+        return (ColumnBuffer(array, newLength), array[:newLength])
+
+class SlideCatalog(object):
+    """
+    Columnar snapshot of all slides. Slides are identified by their row in the catalog.
+    Rows are sorted by slide id, except for rows appended by patched().
+
+    Columns, each a NumPy array with one entry per slide:
+        ids, constructIds, enabled, hasIcon, hasImage, layout, style, content, visualStyle,
+        hierarchyEnabled, zeptoDownloads, constructPathIndex
+    visualStyle is -1 for slides without a visual style.
+    hierarchyEnabled is True if the construct, sub concept and concept of the slide are enabled.
+
+    Tags, in CSR layout:
+        tagList : All unique tags.
+        tagIds : Concatenated indices(into tagList) of tags of all slides.
+        tagOffsets : tagIds[tagOffsets[row]:tagOffsets[row+1]] are the tags of slide at row.
+        tagRows : Row of the slide owning each entry of tagIds.
+
+    Construct paths:
+        constructPaths : Unique (construct name, sub concept name, concept name) tuples of all slides.
+        constructPathIndex : Index of the construct path of each slide.
+
+    Live rows:
+        live : False for rows of slides, which were deleted or changed by patched().
+        Rows are never reused, so that search engines can keep per row data across patches.
+
+    version identifies the state of slide DB, the catalog was built from.
+
+    Catalogs patched from a catalog share its columns and lookups, as far as they are unchanged.
+
+    getBitmapIndex() returns the SlideBitmapIndex used for filtering slides.
+    """
+    def __init__(self, slideColumns, tagsets, constructs, version=None):
+        """
+        Constructor.
+            slideColumns : Dictionary with lists "id", "constructId", "enabled", "hasIcon",
+                "hasImage", "layout", "style", "content" and "zeptoDownloads".
+            tagsets : List of tags of each slide, in the order of slideColumns.
+            constructs : Dictionary mapping construct id to (construct path, hierarchy enabled).
+        """
+        with blockProfiler("SlideCatalog.__init__"):
+            self.version = version
+
+            ids = np.array(slideColumns["id"], dtype=np.int64)
+            order = np.argsort(ids, kind="stable")
+            self.ids = ids[order]
+
+            def column(name, dtype):
+                return np.array(slideColumns[name], dtype=dtype)[order]
+
+            self.constructIds = column("constructId", np.int64)
+            self.enabled = column("enabled", bool)
+            self.hasIcon = column("hasIcon", bool)
+            self.hasImage = column("hasImage", bool)
+            self.layout = column("layout", np.int8)
+            self.style = column("style", np.int8)
+            self.content = column("content", np.int8)
+            self.zeptoDownloads = column("zeptoDownloads", np.int64)
+            self.visualStyle = np.array(
+                [visualStyleValues.get(styleAndLayout, -1) for styleAndLayout in zip(self.style.tolist(), self.layout.tolist())],
+                dtype=np.int8)
+
+            # Construct paths and hierarchy status.
+            self.constructPaths = []
+            self.constructPathToIndex = {}
+            constructPathIndex = []
+            hierarchyEnabled = []
+            for constructId in self.constructIds.tolist():
+                (constructPath, constructEnabled) = constructs[constructId]
+                if constructPath not in self.constructPathToIndex:
+                    self.constructPathToIndex[constructPath] = len(self.constructPaths)
+                    self.constructPaths.append(constructPath)
+                constructPathIndex.append(self.constructPathToIndex[constructPath])
+                hierarchyEnabled.append(constructEnabled)
+            self.constructPathIndex = np.array(constructPathIndex, dtype=np.int32)
+            self.hierarchyEnabled = np.array(hierarchyEnabled, dtype=bool)
+
+            # Tags in CSR layout.
+            self.tagToId = {}
+            tagIds = []
+            self.tagOffsets = np.zeros(len(self.ids) + 1, dtype=np.int64)
+            for (row, index) in enumerate(order.tolist()):
+                for tag in tagsets[index]:
+                    tagIds.append(self.tagToId.setdefault(tag, len(self.tagToId)))
+                self.tagOffsets[row + 1] = len(tagIds)
+            self.tagIds = np.array(tagIds, dtype=np.int32)
+            self.tagRows = np.repeat(np.arange(len(self.ids), dtype=np.int32), np.diff(self.tagOffsets))
+            self.tagList = [None] * len(self.tagToId)
+            for (tag, tagId) in self.tagToId.items():
+                self.tagList[tagId] = tag
+
+            self.live = np.ones(len(self.ids), dtype=bool)
+            self.indexLiveIds()
+
+            # Buffers of appendedColumns, created by the first patch.
+            self.columnBuffers = {}
+
+    def indexLiveIds(self):
+        """
+        Builds lookup of live rows by slide id. Also resets the bitmap index.
+        """
+        liveRows = np.flatnonzero(self.live)
+        order = np.argsort(self.ids[liveRows], kind="stable")
+        self.sortedLiveRows = liveRows[order]
+        self.sortedLiveIds = self.ids[self.sortedLiveRows]
+
+        # Built on first use.
+        self.bitmapIndex = None
+
+    @methodProfiler
+    def patched(self, slideColumns, tagsets, constructs, removedIds=(), version=None):
+        """
+        Returns a new catalog with changes to a few slides applied. Cost is proportional to the
+        count of changed slides, besides copying the live mask and merging the id lookup.
+            slideColumns, tagsets : New and changed slides, as in the constructor.
+            constructs : Construct path and hierarchy status of constructs of those slides.
+            removedIds : Ids of deleted slides.
+        Existing rows are preserved. Rows of changed and deleted slides are marked not live.
+        Changed and new slides are appended as new rows.
+        """
+        retval = copy.copy(self)
+        retval.version = version
+        (oldCount, appendedCount) = (len(self), len(slideColumns["id"]))
+        appendedRows = np.arange(oldCount, oldCount + appendedCount)
+
+        # Construct paths, reusing indices of existing ones. Copied only if a path is new.
+        constructPathIndex = []
+        hierarchyEnabled = []
+        for constructId in slideColumns["constructId"]:
+            (constructPath, constructEnabled) = constructs[constructId]
+            if constructPath not in retval.constructPathToIndex:
+                if retval.constructPathToIndex is self.constructPathToIndex:
+                    (retval.constructPathToIndex, retval.constructPaths) = (dict(self.constructPathToIndex), list(self.constructPaths))
+                retval.constructPathToIndex[constructPath] = len(retval.constructPaths)
+                retval.constructPaths.append(constructPath)
+            constructPathIndex.append(retval.constructPathToIndex[constructPath])
+            hierarchyEnabled.append(constructEnabled)
+
+        # Tags. Copied only if a tag is new.
+        tagIds = []
+        tagOffsets = []
+        for tagset in tagsets:
+            for tag in tagset:
+                if tag not in retval.tagToId:
+                    if retval.tagToId is self.tagToId:
+                        (retval.tagToId, retval.tagList) = (dict(self.tagToId), list(self.tagList))
+                    retval.tagToId[tag] = len(retval.tagList)
+                    retval.tagList.append(tag)
+                tagIds.append(retval.tagToId[tag])
+            tagOffsets.append(len(tagIds))
+        tagOffsets = self.tagOffsets[-1] + np.array(tagOffsets, dtype=np.int64)
+
+        appendedValues = {
+            "ids" : np.array(slideColumns["id"], dtype=np.int64),
+            "constructIds" : np.array(slideColumns["constructId"], dtype=np.int64),
+            "enabled" : np.array(slideColumns["enabled"], dtype=bool),
+            "hasIcon" : np.array(slideColumns["hasIcon"], dtype=bool),
+            "hasImage" : np.array(slideColumns["hasImage"], dtype=bool),
+            "layout" : np.array(slideColumns["layout"], dtype=np.int8),
+            "style" : np.array(slideColumns["style"], dtype=np.int8),
+            "content" : np.array(slideColumns["content"], dtype=np.int8),
+            "zeptoDownloads" : np.array(slideColumns["zeptoDownloads"], dtype=np.int64),
+            "visualStyle" : np.array(
+                [visualStyleValues.get((style, layout), -1) for (style, layout) in zip(slideColumns["style"], slideColumns["layout"])],
+                dtype=np.int8),
+            "constructPathIndex" : np.array(constructPathIndex, dtype=np.int32),
+            "hierarchyEnabled" : np.array(hierarchyEnabled, dtype=bool),
+            "tagIds" : np.array(tagIds, dtype=np.int32),
+            "tagOffsets" : tagOffsets,
+            "tagRows" : np.repeat(appendedRows.astype(np.int32), np.diff(np.concatenate([self.tagOffsets[-1:], tagOffsets]))),
+        }
+
+        # Append columns into buffers shared with this catalog, where possible.
+        retval.columnBuffers = {}
+        for name in appendedColumns:
+            column = getattr(self, name)
+            columnBuffer = self.columnBuffers.get(name) or ColumnBuffer(column)
+            (retval.columnBuffers[name], appendedColumn) = columnBuffer.appended(len(column), appendedValues[name])
+            setattr(retval, name, appendedColumn)
+
+        # Retire rows of changed and deleted slides.
+        retiredRows = self.rowsForIds(list(slideColumns["id"]) + list(removedIds))
+        retval.live = np.concatenate([self.live, np.ones(appendedCount, dtype=bool)])
+        retval.live[retiredRows] = False
+
+        # Merge appended rows into the id lookup, instead of sorting all ids again.
+        stillLive = retval.live[self.sortedLiveRows]
+        order = np.argsort(appendedValues["ids"], kind="stable")
+        positions = np.searchsorted(self.sortedLiveIds[stillLive], appendedValues["ids"][order])
+        retval.sortedLiveRows = np.insert(self.sortedLiveRows[stillLive], positions, appendedRows[order])
+        retval.sortedLiveIds = np.insert(self.sortedLiveIds[stillLive], positions, appendedValues["ids"][order])
+        retval.bitmapIndex = None
+        return retval
+
+    def __len__(self):
+        """
+        Count of slides in the catalog.
+        """
+        return len(self.ids)
+
+    def getBitmapIndex(self):
+        """
+        SlideBitmapIndex of the catalog.
+        """
+        if self.bitmapIndex is None:
+            self.bitmapIndex = SlideBitmapIndex(self)
+        return self.bitmapIndex
+
+    def getTags(self, row):
+        """
+        Tags of slide at the given row.
+        """
+        return [self.tagList[tagId] for tagId in self.tagIds[self.tagOffsets[row]:self.tagOffsets[row + 1]].tolist()]
+
+    def tagsets(self):
+        """
+        Tags of all slides, as a list of lists.
+        """
+        return [self.getTags(row) for row in range(len(self))]
+
+    def getPath(self, row):
+        """
+        Construct path of slide at the given row.
+        """
+        return self.constructPaths[self.constructPathIndex[row]]
+
+    def rowsWithTag(self, tag):
+        """
+        Live rows of all slides having the tag, sorted.
+        """
+        tagId = self.tagToId.get(tag)
+        if tagId is None:
+            return np.zeros(0, dtype=np.int64)
+        rows = np.unique(self.tagRows[self.tagIds == tagId])
+        return rows[self.live[rows]]
+
+    def rowsForIds(self, slideIds, returnMask=False):
+        """
+        Live rows of slides with the given ids, in the same order.
+        Ids not found in the catalog are skipped. If returnMask is True, returns (rows, found),
+        where found is a mask of slideIds found, so that data aligned with slideIds can be
+        filtered to align with rows.
+        """
+        slideIds = np.asarray(slideIds, dtype=np.int64)
+        if not len(self.sortedLiveIds):
+            (positions, found) = (np.zeros(0, dtype=np.int64), np.zeros(len(slideIds), dtype=bool))
+        else:
+            positions = np.searchsorted(self.sortedLiveIds, slideIds)
+            positions[positions == len(self.sortedLiveIds)] = 0
+            found = self.sortedLiveIds[positions] == slideIds
+            positions = positions[found]
+        rows = self.sortedLiveRows[positions]
+        return (rows, found) if returnMask else rows
+
+@methodProfiler
+def slideCatalogFromHierarchy(slideHierarchy, version=None):
+    """
+    Builds a SlideCatalog from a slide hierarchy of dictionaries. For example, the one
+    downloaded by SlideDbClient.getSlideHierarchy(), where each slide, construct and sub
+    concept has its parent dictionary under key "parent".
+    """
+    slideColumns = {key: [] for key in ["id", "constructId", "enabled", "hasIcon", "hasImage", "layout", "style", "content", "zeptoDownloads"]}
+    tagsets = []
+    constructs = {}
+    for slide in slideHierarchy["Slides"]:
+        construct = slide["parent"]
+        subConcept = construct["parent"]
+        concept = subConcept["parent"]
+        if construct["id"] not in constructs:
+            constructPath = (construct["name"], subConcept["name"], concept["name"])
+            constructEnabled = bool(construct["enabled"] and subConcept["enabled"] and concept["enabled"])
+            constructs[construct["id"]] = (constructPath, constructEnabled)
+
+        slideColumns["id"].append(slide["id"])
+        slideColumns["constructId"].append(construct["id"])
+        slideColumns["enabled"].append(slide["enabled"])
+        slideColumns["hasIcon"].append(slide["hasIcon"])
+        slideColumns["hasImage"].append(slide["hasImage"])
+        slideColumns["layout"].append(enumValue(slide.get("layout", 0), layoutValues))
+        slideColumns["style"].append(enumValue(slide.get("style", 0), styleValues))
+        slideColumns["content"].append(enumValue(slide.get("content", 0), contentValues))
+        slideColumns["zeptoDownloads"].append(slide["zeptoDownloads"])
+        tagsets.append(slide["tags"])
+
+    return SlideCatalog(slideColumns, tagsets, constructs, version)
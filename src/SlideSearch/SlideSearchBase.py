@@ -1,17 +1,19 @@
-import json
+import copy, json
+import numpy as np
 from attrdict import AttrDict
 from LibLisa import textCleanUp, methodProfiler, blockProfiler, lastCallProfile
 from LibLisa.config import lisaConfig
+from LibLisa.BudgetedCache import memoryFootprint
 
 class SlideSearchBase(object):
     """
     Base class of slide search engines.
     """
-    def __init__(self, dataForIndexing, config):
+    def __init__(self, catalog, config):
         """
-        Constructor for SlideSearchW2V takes the path of slide contents file as input.
+        Constructor for search engines takes the SlideCatalog of slides to search as input.
         """
-        self.dataForIndexing = dataForIndexing
+        self.catalog = catalog
         self.config = config
 
     @methodProfiler
@@ -21,7 +23,7 @@ class SlideSearchBase(object):
             Any change here MUST be reflected in method getPermittedSlidesDbOptimized(file ZenCentral/Search/utils.py)
             *********** IMPORTANT *********
 
-            queryJson contains filters, which are applied on slides in self.dataForIndexing["Slides"]. Remaining slides are returned.
+            queryJson contains filters, which are applied on slides in self.catalog. Remaining slides are returned.
             queryJson schema can be as below.
             {
                 # Mandatory
@@ -44,131 +46,98 @@ class SlideSearchBase(object):
 
                 # Optional
                 "VisualStyle"  : ["permittedVisualStyle1", ...],
+
+                # Optional. Not a filter. Expands each score keyword with these many closest tags.
+                "ExpandKeywords"  : 3,
+
+                # Optional. Not a filter. Only these many best BM25 matches are ranked fully.
+                "CandidateCount"  : 1000,
             }
+
+            Returns an array of catalog rows of the permitted slides, in ascending order.
+        """
+        return self.catalog.getBitmapIndex().permittedRows(queryInfo)
+
+    def patchCatalog(self, catalog):
+        """
+        Switches to catalog, obtained by SlideCatalog.patched() from the current catalog.
+        Derived classes update their data structures for the changed slides.
+        """
+        self.catalog = catalog
+
+    def copyForPatch(self):
+        """
+        Returns a shallow copy of the engine, with its own copies of all data structures,
+        which patchCatalog() modifies in place. Derived classes copy what they modify.
         """
-        for slide in self.dataForIndexing["Slides"]:
-            tags_list = self.getTags(slide)
-            doRejectSlide = False
-            if "FilterInKeywords" in queryInfo.keys():
-                for word in queryInfo["FilterInKeywords"]:
-                    if word not in tags_list:
-                        doRejectSlide = True
-                        break
-
-            if "FilterOutKeywords" in queryInfo.keys():
-                for word in queryInfo["FilterOutKeywords"]:
-                    if word in tags_list:
-                        doRejectSlide = True
-                        break
-            if doRejectSlide:
-                continue
-
-            if "Constructs" in queryInfo.keys():
-                slideConstruct = self.getAttr(slide, "parent")
-                if self.getAttr(slideConstruct, "id") not in queryInfo["Constructs"]:
-                    continue
-
-            if "HasIcon" in queryInfo.keys():
-                if self.getAttr(slide, "hasIcon") != queryInfo["HasIcon"]:
-                    # Constraints not met. No Similarity.
-                    continue
-
-            if "HasImage" in queryInfo.keys():
-                if self.getAttr(slide, "hasImage") != queryInfo["HasImage"]:
-                    # Constraints not met. No Similarity.
-                    continue
-
-            if "Layout" in queryInfo.keys():
-                if self.getAttr(slide, "layout") not in queryInfo["Layout"]:
-                    # Constraints not met. No Similarity.
-                    continue
-
-            if "Style" in queryInfo.keys():
-                if self.getAttr(slide, "Style") not in queryInfo["Style"]:
-                    # Constraints not met. No Similarity.
-                    continue
-
-            if "Content" in queryInfo.keys():
-                if self.getAttr(slide, "content") not in queryInfo["Content"]:
-                    # Constraints not met. No Similarity.
-                    continue
-
-            if "VisualStyle" in queryInfo.keys():
-                if str(self.getAttr(slide, "visualStyle")).lower() not in queryInfo["VisualStyle"]:
-                    # Constraints not met. No Similarity.
-                    continue
-
-            if queryInfo.get("IsEnabled", True):
-                if not (self.getAttr(slide, "enabled")):
-                    # Constraints not met. No Similarity.
-                    continue
-
-            if not (queryInfo.get("IncludeDisabledHierarchy", False)):
-                construct = self.getAttr(slide, "parent")
-                subConcept = self.getAttr(construct, "parent")
-                concept = self.getAttr(subConcept, "parent")
-                if not (self.getAttr(concept, "enabled")) or not (self.getAttr(subConcept, "enabled")) or not \
-                        (self.getAttr(construct, "enabled")):
-                    continue
-
-            yield slide
+        return copy.copy(self)
+
+    def patched(self, catalog):
+        """
+        Returns a copy of the engine switched to catalog, as by patchCatalog().
+        The engine itself is left untouched, so that searches running on it are not disturbed.
+        """
+        retval = self.copyForPatch()
+        retval.patchCatalog(catalog)
+        return retval
+
+    def sharedObjects(self):
+        """
+        Objects the engine shares with other engines, which memoryFootprint() doesn't count.
+        The SlideCatalog is shared by all engines built on it.
+        """
+        return [self.catalog]
+
+    def memoryFootprint(self):
+        """
+        Estimated bytes of memory held by the engine, including its models and caches.
+        Objects in sharedObjects() are excluded. Derived classes add what they share.
+        """
+        return memoryFootprint(self, exclude=self.sharedObjects())
 
     def slideSimilarity(self, queryInfo, permittedSlides):
+        """
+        Returns an array of scores, one for each of the permittedSlides(catalog rows).
+        """
         raise NotImplementedError("Derived classes must define this function.")
 
     @methodProfiler
-    def slideSearch(self, queryInfo, permittedSlideList, getIDs=False):
+    def slideSearch(self, queryInfo, permittedSlideList, getIDs=False, topK=None):
         """
         Gets a query JSON as input. Computes similarity of the query JSON with all indexed slides and 
         returns all of them sorted in the order of best match.
+        permittedSlideList is a list of catalog rows of slides to search in.
+        If topK is given, only the best topK slides are returned. They are the same as the first topK
+        slides returned without topK.
+        Result is a list of (score, row) tuples or (score, slide id) tuples, if getIDs is True.
         """
         queryInfo = textCleanUp(queryInfo)
+        permittedSlideList = np.asarray(permittedSlideList, dtype=np.int64)
 
         # Compute scores of remaining slides.
-        slideScores = self.slideSimilarity(queryInfo, permittedSlideList)
-
-        # Start building resultList
-        resultList = list(enumerate(permittedSlideList))
-
-        # Drop slides with negative score.
-        # resultList = [(index, slide) for (index, slide) in resultList if slideScores[index] > 0]
-
-        # Sort remaining permitted slides according to score.
-        resultList.sort(key = lambda tuple : -slideScores[tuple[0]])
-
-        # Append scores with items in resultList.
-        if getIDs:
-            resultList = [(slideScores[index], self.getAttr(slide, "id")) for (index, slide) in resultList]
-        else:
-            resultList = [(slideScores[index], slide) for (index, slide) in resultList]
+        slideScores = np.asarray(self.slideSimilarity(queryInfo, permittedSlideList), dtype=np.float64)
 
-        return resultList
-
-    def getParent(self, slide):
-        if self.config["isDjangoModel"]:
-            return slide.parent
-        else:
-            return slide["parent"]
-
-    def getPath(self, slide):
-        if self.config["isDjangoModel"]:
-            return (slide.parent.name,
-                    slide.parent.parent.name,
-                    slide.parent.parent.parent.name)
+        if topK is not None and topK < len(slideScores):
+            order = topKOrder(slideScores, topK)
         else:
-            return (slide["parent"]["name"],
-                    slide["parent"]["parent"]["name"],
-                    slide["parent"]["parent"]["parent"]["name"])
-
-    def getTags(self, slide):
-        if self.config["isDjangoModel"]:
+            # Sort permitted slides according to score. Stable, so that ties keep their order.
+            order = np.argsort(-slideScores, kind="stable")
 
-            return slide.tags.names()
-        else:
-            return slide["tags"]
+        # Pair scores with rows or slide ids.
+        results = self.catalog.ids[permittedSlideList[order]] if getIDs else permittedSlideList[order]
+        return list(zip(slideScores[order].tolist(), results.tolist()))
 
-    def getAttr(self, slide, attr):
-        if self.config["isDjangoModel"]:
-            return getattr(slide, attr)
-        else:
-            return slide[attr]
+def topKOrder(scores, topK):
+    """
+    Returns indices of topK highest scores, highest first. Same as the first topK indices of
+    a stable descending sort, but only the topK indices are sorted.
+    """
+    if topK <= 0:
+        return np.zeros(0, dtype=np.int64)
+    kthScore = np.partition(scores, len(scores) - topK)[len(scores) - topK]
+
+    # Among scores tied with the kth score, pick those earlier in the list, as a stable sort would.
+    above = np.flatnonzero(scores > kthScore)
+    tied = np.flatnonzero(scores == kthScore)[:topK - len(above)]
+    head = np.concatenate([above, tied])
+    return head[np.lexsort((head, -scores[head]))]
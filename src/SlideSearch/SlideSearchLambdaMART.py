@@ -7,92 +7,190 @@
         Microsoft LTR dataset: https://www.microsoft.com/en-us/research/project/mslr
 """
 
-import json, re, pickle
+import json, re, pickle, threading, time
 import gensim, pyltr
 
 import numpy as np
 from itertools import accumulate
 from attrdict import AttrDict
+from cachetools import LRUCache
 
 from LibLisa import lisaConfig, methodProfiler, blockProfiler, lastCallProfile
-from SlideSearch.SlideSearchBase import SlideSearchBase
+from SlideSearch.SlideSearchBase import SlideSearchBase, topKOrder
 from SlideSearch.SectionModel import SectionModel
+from SlideSearch.TagExpansionIndex import TagExpansionIndex
+from SlideSearch.TreeEnsemble import TreeEnsemble
+from SlideSearch.IndexArtifact import writeArtifact, readArtifact
+
+# Columns of the feature matrix built by SlideSearchLambdaMart.features().
+# Saved in index artifacts, so that a model is never used with features it wasn't trained on.
+featureSchema = [
+    "constructPathSumTf",
+    "constructPathSumIdf",
+    "constructPathSumTfidf",
+    "zeptoDownloads",
+    "slideTagSumTf",
+    "slideTagSumIdf",
+    "slideTagSumTfidf",
+]
 
 class SlideSearchLambdaMart(SlideSearchBase):
     """
     Search engine object for slides, using LambdaMART.
     """
-    def __init__(self, dataForIndexing, config):
+    def __init__(self, catalog, config):
         """
-        Constructor for SlideSearchIndex takes the path of slide contents file as input.
+        Constructor for SlideSearchIndex takes the SlideCatalog of slides to index as input.
         """
-        isDjangoModel = config["isDjangoModel"]
         with blockProfiler("SlideSearchLambdaMart.__init__"):
             # Invoke base class constructor.
-            super().__init__(dataForIndexing, config)
+            super().__init__(catalog, config)
 
             # Build the word corpus.
-            if not self.dataForIndexing["Slides"]:
-                self.dictionary = None
-                self.slideTagModel = None
-                self.constructPathList = []
-                self.constructPathToIndex = {}
-                self.constructPathModel = None
-            else:
-                allSlides = self.dataForIndexing["Slides"]
-                def extractSlideCorpus(slide):
-                    retval = []
-                    retval.extend(self.getTags(slide))
-                    return retval
-
-                completeCorpus = [extractSlideCorpus(slide) for slide in allSlides]
-
-                # Create a word dictionary for use in vector building.
-                self.dictionary = gensim.corpora.Dictionary(completeCorpus)
-
-                # Build section wise corpora and model for slide tags.
-                slideTagCorpora = [self.getTags(slide) for slide in allSlides]
-
-                self.slideTagModel = SectionModel(slideTagCorpora, self.dictionary)
-
-                # Build corpora for construct paths.
-                constructPathCorpora = set([self.getPath(slide) for slide in allSlides])
-                self.constructPathList = [list(constructPath) for constructPath in constructPathCorpora]
-                self.constructPathToIndex = { tuple(path):index for (index, path) in enumerate(self.constructPathList) }
-                self.constructPathModel = SectionModel(self.constructPathList, self.dictionary)
+            completeCorpus = self.catalog.tagsets()
+
+            # Create a word dictionary for use in vector building.
+            self.dictionary = gensim.corpora.Dictionary(completeCorpus)
+
+            # Build section wise corpora and model for slide tags.
+            # Documents of the model are the same as catalog rows. Rows, which are not live, are removed.
+            self.slideTagModel = SectionModel(completeCorpus, self.dictionary)
+            self.slideTagModel.remove_documents(np.flatnonzero(~self.catalog.live))
+
+            # Build corpora for construct paths.
+            # Catalog already assigns an index to each unique construct path.
+            self.constructPathList = [list(constructPath) for constructPath in self.catalog.constructPaths]
+            self.constructPathModel = SectionModel(self.constructPathList, self.dictionary)
+
+            # Fitted pyltr model and its summary. See fit() and json().
+            (self.LambdaMartModel, self.trainingSummary) = (None, None)
+
+            # Query expansion index over slide tags. Built at index time by buildTagExpansionIndex()
+            # and loaded from the index artifact. Without it, queries are not expanded.
+            self.tagExpansionIndex = None
+
+            # Construct level features depend only on ScoreKeywords. Cached across queries
+            # and pages of the same query.
+            self.constructFeatureCache = LRUCache(maxsize=lisaConfig.slideSearch.constructFeatureCacheSize)
+            # LRUCache reorders entries even on get. Searches on many threads share the cache.
+            self.constructFeatureCacheLock = threading.Lock()
+
+    def sharedObjects(self):
+        """
+        Word2vec model, which the expansion index looks up query words in, is shared as well.
+        """
+        retval = super().sharedObjects()
+        if self.tagExpansionIndex is not None:
+            retval.append(self.tagExpansionIndex.distanceModel)
+        return retval
+
+    @methodProfiler
+    def buildTagExpansionIndex(self, distanceModel):
+        """
+        Index time step, which builds the query expansion index over all slide tags.
+        distanceModel is the word2vec model, whose vectors are indexed.
+        """
+        self.tagExpansionIndex = TagExpansionIndex(self.dictionary.token2id.keys(), distanceModel)
+
+    @methodProfiler
+    def add_documents(self, rows):
+        """
+        Indexes slides at the given catalog rows. Rows must have been appended to the catalog
+        after the index was built. See SlideCatalog.patched().
+        """
+        tagsets = [self.catalog.getTags(row) for row in rows]
+        # Dictionary isn't extended, so that patched copies can share it. Section models assign
+        # ids to new tags themselves.
+        self.slideTagModel.add_documents(tagsets)
+
+        # Index construct paths, which are new to the catalog.
+        # The list is replaced, not extended, as patched copies share it.
+        newConstructPaths = [list(constructPath) for constructPath in self.catalog.constructPaths[len(self.constructPathList):]]
+        if newConstructPaths:
+            self.constructPathList = self.constructPathList + newConstructPaths
+            self.constructPathModel.add_documents(newConstructPaths)
+        with self.constructFeatureCacheLock:
+            self.constructFeatureCache.clear()
+
+        # Expansion index only covers tags of the last index build. Tags new to the catalog are
+        # added with the next index build.
+
+    @methodProfiler
+    def remove_documents(self, rows):
+        """
+        Removes slides at the given catalog rows from the index.
+        """
+        self.slideTagModel.remove_documents(rows)
+
+    def update_document(self, oldRow, newRow):
+        """
+        Replaces the slide at oldRow with its changed version at newRow.
+        """
+        self.remove_documents([oldRow])
+        self.add_documents([newRow])
+
+    @methodProfiler
+    def patchCatalog(self, catalog):
+        """
+        Switches to catalog, obtained by SlideCatalog.patched() from the current catalog.
+        Only the slides changed by the patch are indexed again.
+        """
+        oldCatalog = self.catalog
+        super().patchCatalog(catalog)
+        self.remove_documents(np.flatnonzero(oldCatalog.live & ~catalog.live[:len(oldCatalog)]))
+        self.add_documents(range(len(oldCatalog), len(catalog)))
+
+    def copyForPatch(self):
+        """
+        Copies the section models, which indexing modifies.
+        Dictionary, construct paths, tree ensemble and expansion index are shared.
+        Construct features are cached afresh.
+        """
+        retval = super().copyForPatch()
+        retval.slideTagModel = self.slideTagModel.copy()
+        retval.constructPathModel = self.constructPathModel.copy()
+        retval.constructFeatureCache = LRUCache(maxsize=self.constructFeatureCache.maxsize)
+        retval.constructFeatureCacheLock = threading.Lock()
+        return retval
+
+    def constructFeatures(self, queryInfo):
+        """
+        Returns construct level features, one row per construct path in the catalog.
+        """
+        # Order of query words does not matter, but their repetitions do.
+        cacheKey = tuple(sorted(queryInfo.get("ScoreKeywords", [])))
+        with self.constructFeatureCacheLock:
+            constructFtrArray = self.constructFeatureCache.get(cacheKey)
+        if constructFtrArray is None:
+            constructFtrArray = self.constructPathModel.get_features({"ScoreKeywords" : list(cacheKey)})
+            constructFtrArray.setflags(write=False)
+            with self.constructFeatureCacheLock:
+                self.constructFeatureCache[cacheKey] = constructFtrArray
+        return constructFtrArray
 
     @methodProfiler
     def features(self, queryInfo, permittedSlides=None):
         """
         Computes feature vector, one for eacg slides in DB.
         ftrVec(queryInfo, slide) will determine the rating score of slide, when querying for slide.
+        permittedSlides is a list of catalog rows. If None, all live slides are used.
+        Returns a float32 matrix with a row of features for each of the permittedSlides. Columns are
+            construct features(3), zeptoDownloads, slide tag features(3)
         """
-        allSlides = self.dataForIndexing["Slides"]
         if permittedSlides is None:
-            permittedSlides = allSlides
-            permittedIndices = range(len(allSlides))
-        else:
-            slideToIndexMap = { self.getAttr(slide, "id"):index for (index, slide) in enumerate(allSlides) }
-            permittedIndices = [slideToIndexMap[self.getAttr(slide, "id")] for slide in permittedSlides]
+            permittedSlides = np.flatnonzero(self.catalog.live)
+        permittedSlides = np.asarray(permittedSlides, dtype=np.int64)
 
-        # Create construct feature array from path model.
-        constructFtrArray = self.constructPathModel.get_features(queryInfo)
+        slideFtrArray = np.empty((len(permittedSlides), len(featureSchema)), dtype=np.float32)
 
         # Use construct level features as initial slide level features.
-        slideFtrArray = []
-        for slide in permittedSlides:
-            toAppend = []
-            # Get construct level features for the current slide.
-            toAppend.extend(constructFtrArray[self.constructPathToIndex[self.getPath(slide)]])
-
-            # Add zeptoDownloads count as a feature.
-            toAppend.append(self.getAttr(slide, "zeptoDownloads"))
+        slideFtrArray[:, 0:3] = self.constructFeatures(queryInfo)[self.catalog.constructPathIndex[permittedSlides]]
 
-            # Append a copy of features into the slide feature array.
-            slideFtrArray.append(toAppend)
+        # Add zeptoDownloads count as a feature.
+        slideFtrArray[:, 3] = self.catalog.zeptoDownloads[permittedSlides]
 
         # To the features already built, append features corresponding to slide tag model.
-        slideFtrArray = self.slideTagModel.get_features(queryInfo, slideFtrArray, permittedIndices)
+        self.slideTagModel.get_features(queryInfo, permittedSlides, slideFtrArray[:, 4:7])
 
         return slideFtrArray
 
@@ -102,17 +200,18 @@ class SlideSearchLambdaMart(SlideSearchBase):
         To train LambdaMART model, we need to first build a basic training set.
         This training set should work for the case when true rating data is not available.
         """
-        # Build a word occurence dictionary mapping words to slides where they occur.
+        # Build a word occurence dictionary mapping words to slides(catalog rows) where they occur.
+        catalog = self.catalog
         wordToMatchingSlides = {}
-        for slide in self.dataForIndexing["Slides"]:
-            for tag in self.getTags(slide):
+        for row in range(len(catalog)):
+            for tag in catalog.getTags(row):
                 if re.search("[0-9]", tag):
                     # Tags with digits are not interesting for search.
                     continue
                 if tag in wordToMatchingSlides:
-                    wordToMatchingSlides[tag].append(slide)
+                    wordToMatchingSlides[tag].append(row)
                 else:
-                    wordToMatchingSlides[tag] = [slide]
+                    wordToMatchingSlides[tag] = [row]
         wordToMatchingSlides = list(wordToMatchingSlides.items())
 
         # Sort words according to the # of slides they occur in.
@@ -121,12 +220,12 @@ class SlideSearchLambdaMart(SlideSearchBase):
         with open(lisaConfig.dataFolderPath + "trainingWords.json", "w") as fp:
             wordToMatchingSlideIds = {}
             for (word, matchingSlides) in wordToMatchingSlides:
-                wordToMatchingSlideIds[word] = list(map(lambda slide:slide["id"], matchingSlides))
+                wordToMatchingSlideIds[word] = [int(catalog.ids[row]) for row in matchingSlides]
             json.dump(wordToMatchingSlideIds, fp, indent=4)
 
         # Only retain words with frequency less than 1% of total slides.
-        freqThreshold = int(0.02 * len(self.dataForIndexing["Slides"]))
-        nonMatchingSlideCount = int(0.02 * len(self.dataForIndexing["Slides"]))
+        freqThreshold = int(0.02 * len(catalog))
+        nonMatchingSlideCount = int(0.02 * len(catalog))
         wordToMatchingSlides = [(word, matchingSlides) for (word, matchingSlides) in wordToMatchingSlides if len(matchingSlides) < freqThreshold]
 
         retval = []
@@ -137,33 +236,34 @@ class SlideSearchLambdaMart(SlideSearchBase):
 
                 # Now, find slides, which are close but are not matching.
                 closeButNotMatchingSlides = []
+                matchingSlideSet = set(matchingSlides)
                 i = 0
-                permittedSlideList = list(seedDataBuilder.getPermittedSlides(simulatedQuery["queryJson"]))
+                permittedSlideList = seedDataBuilder.getPermittedSlides(simulatedQuery["queryJson"])
                 results = seedDataBuilder.slideSearch(simulatedQuery["queryJson"], permittedSlideList)
-                while len(closeButNotMatchingSlides) < nonMatchingSlideCount:
-                    if results[i][1] not in matchingSlides:
+                while len(closeButNotMatchingSlides) < nonMatchingSlideCount and i < len(results):
+                    if results[i][1] not in matchingSlideSet:
                         closeButNotMatchingSlides.append(results[i][1])
                     i += 1
 
                 simulatedQueryResults = []
                 simulatedQuery["results"] = simulatedQueryResults
 
-                maxDownloads1 = max([slide["zeptoDownloads"] for slide in matchingSlides])
-                maxDownloads2 = max([slide["zeptoDownloads"] for slide in closeButNotMatchingSlides])
+                maxDownloads1 = max([catalog.zeptoDownloads[row] for row in matchingSlides])
+                maxDownloads2 = max([catalog.zeptoDownloads[row] for row in closeButNotMatchingSlides], default=0)
                 maxDownloads = float(max(maxDownloads1, maxDownloads2) + 0.0001)
                 # Build positive results.
-                for slide in matchingSlides:
+                for row in matchingSlides:
                     simulatedQueryResult = {
-                            "avgRating" : 5 + int(10 * slide["zeptoDownloads"]/maxDownloads),
-                            "slide" : slide["id"],
+                            "avgRating" : 5 + int(10 * catalog.zeptoDownloads[row]/maxDownloads),
+                            "slide" : int(catalog.ids[row]),
                         }
                     simulatedQueryResults.append(simulatedQueryResult)
 
                 # Build negative results.
-                for slide in closeButNotMatchingSlides:
+                for row in closeButNotMatchingSlides:
                     simulatedQueryResult = {
-                        "avgRating": -15 + int(10 * slide["zeptoDownloads"] / maxDownloads),
-                        "slide": slide["id"],
+                        "avgRating": -15 + int(10 * catalog.zeptoDownloads[row] / maxDownloads),
+                        "slide": int(catalog.ids[row]),
                     }
                     simulatedQueryResults.append(simulatedQueryResult)
 
@@ -217,6 +317,7 @@ class SlideSearchLambdaMart(SlideSearchBase):
             slideRatingVecs["T"]["y"],
             slideRatingVecs["T"]["qids"],
             monitor=self.LambdaMartMonitor)
+        self.treeEnsemble = TreeEnsemble.fromLambdaMart(self.LambdaMartModel)
 
         Epred = self.LambdaMartModel.predict(slideRatingVecs["E"]["X"])
         randomRankingMetric = self.LambdaMartMetric.calc_mean_random(
@@ -234,6 +335,16 @@ class SlideSearchLambdaMart(SlideSearchBase):
                }
 
     def json(self):
+        """
+        Summary of the fitted LambdaMART model.
+        Indices loaded from schema version 2 have no pyltr model. Their summary is the one saved
+        with them, or only the count of trees, if none was saved.
+        """
+        if self.LambdaMartModel is None:
+            if self.trainingSummary is not None:
+                return {key:(np.array(value) if isinstance(value, list) else value) for (key, value) in self.trainingSummary.items()}
+            return {"estimators_fitted_" : len(self.treeEnsemble.roots)}
+
         retval = {}
         retval["feature_importances_"] = self.LambdaMartModel.feature_importances_
         retval["oob_improvement_"] = self.LambdaMartModel.oob_improvement_
@@ -242,41 +353,137 @@ class SlideSearchLambdaMart(SlideSearchBase):
         retval["estimators_fitted_"] = self.LambdaMartModel.estimators_fitted_
         return retval
 
+    @methodProfiler
+    def candidateSlides(self, queryInfo, permittedSlides, candidateCount):
+        """
+        First stage of two stage ranking. Picks candidateCount of the permittedSlides, with the
+        best BM25 scores of ScoreKeywords against slide tags. BM25 only needs the postings of
+        the query words, which is much cheaper than features and trees of all slides.
+        Returns (indices into permittedSlides of candidates, BM25 scores of all permittedSlides).
+        """
+        bm25Scores = self.slideTagModel.get_bm25(queryInfo.get("ScoreKeywords", []), permittedIndices=permittedSlides)
+        return (topKOrder(bm25Scores, candidateCount), bm25Scores)
+
     @methodProfiler
     def slideSimilarity(self, queryInfo, permittedSlides):
         """
         This method computes similarity scores for all slides in permittedSlides.
         Query made in queryInfo.
+        If queryInfo["CandidateCount"](or lisaConfig.slideSearch.candidateCount) is set, only that many BM25
+        candidates are scored by LambdaMART. Other slides are scored below all candidates,
+        in the order of their BM25 scores. Queries without ScoreKeywords, or whose ScoreKeywords
+        match no permitted slide, have no BM25 order. All their slides are scored by LambdaMART.
+        """
+        # Expand score keywords with their closest tags, if asked for.
+        if queryInfo.get("ExpandKeywords") and self.tagExpansionIndex is not None:
+            queryInfo = self.tagExpansionIndex.expandQuery(queryInfo, queryInfo["ExpandKeywords"])
+
+        permittedSlides = np.asarray(permittedSlides, dtype=np.int64)
+        candidateCount = queryInfo.get("CandidateCount", lisaConfig.slideSearch.candidateCount)
+        if candidateCount and candidateCount < len(permittedSlides) and queryInfo.get("ScoreKeywords"):
+            (candidates, bm25Scores) = self.candidateSlides(queryInfo, permittedSlides, candidateCount)
+            if bm25Scores.max() <= 0:
+                # Candidates would be arbitrary.
+                return self.treeScores(queryInfo, permittedSlides)
+            candidateScores = self.treeScores(queryInfo, permittedSlides[candidates])
+
+            # Tail scores decrease with BM25 score and stay below the lowest candidate score.
+            floor = candidateScores.min() if len(candidateScores) else 0.0
+            retval = floor - 1.0 - (bm25Scores.max() - bm25Scores)
+            retval[candidates] = candidateScores
+            return retval
+
+        return self.treeScores(queryInfo, permittedSlides)
+
+    def treeScores(self, queryInfo, permittedSlides):
+        """
+        LambdaMART scores of permittedSlides, from their full feature vectors.
         """
         # Calculate feature vector for all slides in the DB.
         ftrVec = self.features(queryInfo, permittedSlides)
 
         # Use LambdaMART model to calculate the scores of each slide in DB.
-        # Retval is a dictionary from "original index" of a slide to its score.
-        retval = {}
-        if ftrVec:
-            for (index, score) in enumerate(self.LambdaMartModel.predict(ftrVec)):
-                slide = permittedSlides[index]
-                retval[index] = score
+        # Large sets, like those of broad queries, are scored on multiple threads.
+        # Retval is an array of scores, in the order of permittedSlides.
+        threadCount = 1
+        if len(ftrVec) >= lisaConfig.slideSearch.parallelPredictThreshold:
+            threadCount = lisaConfig.slideSearch.predictThreadCount
+        return self.treeEnsemble.predict(ftrVec, threadCount=threadCount)
 
-        # Return the result.
-        return retval
+    @methodProfiler
+    def evaluateCandidateCount(self, queryInfos, candidateCount, k=10):
+        """
+        Compares two stage ranking, with candidateCount BM25 candidates, against scoring all
+        permitted slides, over the queries in queryInfos.
+        Returns mean recall of exhaustive top k in two stage top k, the fraction of queries
+        with identical top k, and total time taken by either way.
+        """
+        (recalls, identical, exhaustiveTime, twoStageTime) = ([], 0, 0.0, 0.0)
+        for queryInfo in queryInfos:
+            queryInfo = {key:value for (key, value) in queryInfo.items() if key != "CandidateCount"}
+            permittedSlides = self.getPermittedSlides(queryInfo)
+            if not len(permittedSlides):
+                continue
+
+            startTime = time.time()
+            exhaustiveResults = self.slideSearch(queryInfo, permittedSlides, topK=k)
+            exhaustiveTime += time.time() - startTime
+
+            startTime = time.time()
+            twoStageResults = self.slideSearch(dict(queryInfo, CandidateCount=candidateCount), permittedSlides, topK=k)
+            twoStageTime += time.time() - startTime
+
+            exhaustiveRows = [row for (_, row) in exhaustiveResults]
+            twoStageRows = [row for (_, row) in twoStageResults]
+            recalls.append(len(set(exhaustiveRows) & set(twoStageRows)) / len(exhaustiveRows))
+            identical += exhaustiveRows == twoStageRows
+
+        return {
+                    "queryCount": len(recalls),
+                    "candidateCount": candidateCount,
+                    "recallAtK": float(np.mean(recalls)) if recalls else 1.0,
+                    "identicalTopK": identical / len(recalls) if recalls else 1.0,
+                    "exhaustiveTime": exhaustiveTime,
+                    "twoStageTime": twoStageTime,
+               }
 
     @methodProfiler
-    def saveTrainingResult(self, filename):
+    def saveTrainingResult(self, filename, schemaVersion=2):
         """
         Pre Conditions:
             fit has already been called.
             We have already called fit. We are only interested in the result of fit().
             Nothing else is really important.
         Things to save:
-            1) self.LambdaMartMetric.
-            2) self.LambdaMartMonitor.
-            3) self.LambdaMartModel.
+            Schema version 1 pickles
+                1) self.LambdaMartMetric.
+                2) self.LambdaMartMonitor.
+                3) self.LambdaMartModel.
+            Schema version 2 saves only what inference needs, in an IndexArtifact.
+                1) Flattened tree arrays of self.treeEnsemble.
+                2) Feature schema.
+                3) Tags and arrays of self.tagExpansionIndex, if built.
+                4) Summary of the fitted model, as returned by json().
         """
-        tupleToSave = (self.LambdaMartMetric, self.LambdaMartMonitor, self.LambdaMartModel)
-        with open(filename, "wb") as fp:
-            pickle.dump(tupleToSave, fp)
+        if schemaVersion == 1:
+            tupleToSave = (self.LambdaMartMetric, self.LambdaMartMonitor, self.LambdaMartModel)
+            with open(filename, "wb") as fp:
+                pickle.dump(tupleToSave, fp)
+        elif schemaVersion == 2:
+            header = {
+                "schemaVersion" : schemaVersion,
+                "featureSchema" : featureSchema,
+                "maxDepth" : self.treeEnsemble.maxDepth,
+                "featureCount" : self.treeEnsemble.featureCount,
+                "trainingSummary" : {key:np.asarray(value).tolist() for (key, value) in self.json().items()},
+            }
+            arrays = self.treeEnsemble.arrays()
+            if self.tagExpansionIndex is not None:
+                header["tagExpansionTags"] = self.tagExpansionIndex.tags
+                arrays.update({"tagExpansion." + name:array for (name, array) in self.tagExpansionIndex.arrays().items()})
+            writeArtifact(filename, header, arrays)
+        else:
+            raise NotImplementedError("Incorrect schema version.")
 
     @methodProfiler
     def loadTrainingResult(self, filePointer, schemaVersion):
@@ -286,8 +493,20 @@ class SlideSearchLambdaMart(SlideSearchBase):
         if schemaVersion == 1:
             savedTuple = pickle.load(filePointer)
             (self.LambdaMartMetric, self.LambdaMartMonitor, self.LambdaMartModel) = savedTuple
+            self.treeEnsemble = TreeEnsemble.fromLambdaMart(self.LambdaMartModel)
+        elif schemaVersion == 2:
+            (header, arrays) = readArtifact(filePointer, schemaVersion)
+            if header["featureSchema"] != featureSchema:
+                raise ValueError("Index was trained on features {0}, but features are {1}.".format(
+                    header["featureSchema"], featureSchema))
+            self.treeEnsemble = TreeEnsemble.fromArrays(arrays, header["maxDepth"], header["featureCount"])
+            (self.LambdaMartModel, self.trainingSummary) = (None, header.get("trainingSummary"))
+            if "tagExpansionTags" in header:
+                prefix = "tagExpansion."
+                expansionArrays = {name[len(prefix):]:array for (name, array) in arrays.items() if name.startswith(prefix)}
+                self.tagExpansionIndex = TagExpansionIndex.fromArrays(header["tagExpansionTags"], expansionArrays)
         else:
-            raise NotImplemented("Incorrect schema version.")
+            raise NotImplementedError("Incorrect schema version.")
 
 @methodProfiler
 def extractCorpus(slideComponent):
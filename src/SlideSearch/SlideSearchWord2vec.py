@@ -14,29 +14,57 @@ import gensim
 
 from LibLisa import lisaConfig, methodProfiler, blockProfiler, lastCallProfile
 from SlideSearch.SlideSearchBase import SlideSearchBase
-from SlideSearch.Word2VecDistanceModel import word2vecDistanceModel
+from SlideSearch.Word2VecDistanceModel import word2vecDistanceModel, TagsetMatrix
 
 class SlideSearchW2V(SlideSearchBase):
     """
     Search engine object for slides.
     The similarity is measured by simply taking a dot product between the two word vectors.
     """
-    def __init__(self, dataForIndexing, config):
+    def __init__(self, catalog, config, distanceModel=None):
         """
-        Constructor for SlideSearchIndex takes the path of slide contents file as input.
+        Constructor for SlideSearchIndex takes the SlideCatalog of slides to index as input.
+        distanceModel, if given, is used instead of the complete word2vec model.
         """
         # Invoke base class constructor.
-        super().__init__(dataForIndexing, config)
+        super().__init__(catalog, config)
+
+        self.distanceModel = word2vecDistanceModel if distanceModel is None else distanceModel
+
+        # Tagsets of all slides, built on first search.
+        self.tagsetMatrix = None
+
+    def getTagsetMatrix(self):
+        """
+        Returns the TagsetMatrix of all slides, building it if required.
+        """
+        if self.tagsetMatrix is None:
+            self.tagsetMatrix = TagsetMatrix(self.distanceModel, self.catalog.tagsets())
+        return self.tagsetMatrix
+
+    def patchCatalog(self, catalog):
+        """
+        Switches to a patched catalog. Tagsets of all slides are built again on next search.
+        """
+        super().patchCatalog(catalog)
+        self.tagsetMatrix = None
+
+    def sharedObjects(self):
+        """
+        Word2vec model is shared by all engines as well.
+        """
+        return super().sharedObjects() + [self.distanceModel]
 
     @methodProfiler
     def slideSimilarity(self, queryInfo, permittedSlides):
         """
         Method to compute similarity score for all slides listed in the permittedSlides.
+        permittedSlides is a list of catalog rows.
         """
-        retval = {}
-        for (index, slide) in enumerate(permittedSlides):
-            slideScore = word2vecDistanceModel.queryPhrase2TagsetSimilarity(queryInfo["RatingKeywords"], self.getTags(slide))
-            retval[index] = slideScore
+        self.getTagsetMatrix()
 
-        return retval
+        # Score all permitted slides in one vectorized pass.
+        # Rows of the tagset matrix are the same as catalog rows.
+        slideScores = self.distanceModel.queryPhrase2TagsetsSimilarity(queryInfo["RatingKeywords"], self.tagsetMatrix, permittedSlides)
 
+        return slideScores
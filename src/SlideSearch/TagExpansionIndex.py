@@ -0,0 +1,154 @@
+"""
+Approximate nearest neighbour index over word2vec vectors of slide tags.
+Used to expand query words into semantically close tags.
+The index is built at index time and saved within the index artifact. See arrays() and fromArrays().
+    References:
+        Random projection LSH: https://en.wikipedia.org/wiki/Locality-sensitive_hashing#Random_projection
+"""
+import numpy as np
+
+from LibLisa import methodProfiler, blockProfiler
+from SlideSearch.Word2VecDistanceModel import word2vecDistanceModel, prunedWord2vecModel, LazyWord2vecDistanceModel
+
+class TagExpansionIndex(object):
+    """
+    Random projection LSH index of tag vectors.
+
+    Each of the tableCount hash tables hashes a vector into bitCount bits, one bit per random
+    hyperplane, telling the side of the hyperplane the vector lies on. Vectors with small
+    angles between them are likely to share a hash code in at least one table.
+    Candidates found in the matching buckets of all tables are then ranked exactly.
+
+    Vectors of query words, which are tags, come from the index itself. Only other query words
+    are looked up from distanceModel.
+    """
+    def __init__(self, tags, distanceModel=None, tableCount=8, bitCount=None, seed=0):
+        """
+        Constructor. Builds the index over the given tags.
+        If bitCount is None, it is chosen so that each bucket has about 16 tags.
+        """
+        with blockProfiler("TagExpansionIndex.__init__"):
+            self.distanceModel = word2vecDistanceModel if distanceModel is None else distanceModel
+
+            # Only tags known to word2vec can be indexed.
+            tags = sorted(set(tags))
+            (tagVectors, tagKnown) = self.distanceModel.getVectors(tags)
+            self.tags = [tag for (tag, known) in zip(tags, tagKnown) if known]
+            self.tagToIndex = {tag:index for (index, tag) in enumerate(self.tags)}
+            self.tagVectors = np.ascontiguousarray(tagVectors[tagKnown])
+
+            if bitCount is None:
+                bitCount = int(np.clip(np.log2(max(len(self.tags), 1) / 16.0), 1, 62))
+            randomState = np.random.RandomState(seed)
+            self.planes = randomState.normal(size=(tableCount, bitCount, self.tagVectors.shape[1])).astype(np.float32)
+            self.bitWeights = np.left_shift(np.int64(1), np.arange(bitCount, dtype=np.int64))
+
+            # For each table, tags sorted by their hash code. A bucket is then a contiguous range.
+            codes = self.hashCodes(self.tagVectors)
+            self.order = np.argsort(codes, axis=0, kind="stable")
+            self.sortedCodes = np.take_along_axis(codes, self.order, axis=0)
+
+    def arrays(self):
+        """
+        Arrays of the index, for saving into an IndexArtifact. Tags are saved separately.
+        """
+        return {
+            "tagVectors" : self.tagVectors,
+            "planes" : self.planes,
+            "order" : self.order,
+            "sortedCodes" : self.sortedCodes,
+        }
+
+    @staticmethod
+    def fromArrays(tags, arrays, distanceModel=None):
+        """
+        Inverse of arrays(). Rebuilds the index from saved tags and arrays, without word2vec.
+        Query words, which aren't tags, are looked up from distanceModel, which defaults to
+        the pruned word2vec model.
+        """
+        (tagCount, tableCount) = (len(tags), len(arrays["planes"]))
+        if not (len(arrays["tagVectors"]) == tagCount and arrays["order"].shape == arrays["sortedCodes"].shape == (tagCount, tableCount)):
+            raise ValueError("Tag expansion arrays have inconsistent shapes.")
+        if arrays["order"].size and not (0 <= arrays["order"].min() and arrays["order"].max() < tagCount):
+            raise ValueError("Tag expansion array order has invalid tag indices.")
+        retval = TagExpansionIndex.__new__(TagExpansionIndex)
+        retval.distanceModel = prunedWord2vecModel if distanceModel is None else distanceModel
+        retval.tags = list(tags)
+        retval.tagToIndex = {tag:index for (index, tag) in enumerate(retval.tags)}
+        (retval.tagVectors, retval.planes) = (arrays["tagVectors"], arrays["planes"])
+        (retval.order, retval.sortedCodes) = (arrays["order"], arrays["sortedCodes"])
+        retval.bitWeights = np.left_shift(np.int64(1), np.arange(retval.planes.shape[1], dtype=np.int64))
+        return retval
+
+    def wordVector(self, word):
+        """
+        Returns unit length vector of word, or None if it is unknown.
+        """
+        index = self.tagToIndex.get(word)
+        if index is not None:
+            return self.tagVectors[index]
+        distanceModel = self.distanceModel
+        if isinstance(distanceModel, LazyWord2vecDistanceModel):
+            # Loads the model, which may not be available at all.
+            distanceModel = distanceModel.load()
+        return None if distanceModel is None else distanceModel.getVector(word)
+
+    def hashCodes(self, vectors):
+        """
+        Computes hash codes of vectors in all tables. Returns a (vectors x tables) array.
+        """
+        bits = np.einsum("tbd,nd->ntb", self.planes, vectors) > 0
+        return bits.dot(self.bitWeights)
+
+    @methodProfiler
+    def neighbours(self, word, topK, minSimilarity=0.5):
+        """
+        Finds up to topK tags closest to word, having similarity at least minSimilarity.
+        Returns a list of (tag, similarity) tuples, the most similar first.
+        The word itself is never returned.
+        """
+        vector = self.wordVector(word)
+        if vector is None or not self.tags:
+            return []
+
+        # Collect candidates from the matching bucket of each table.
+        codes = self.hashCodes(vector[np.newaxis, :])[0]
+        candidates = []
+        for (table, code) in enumerate(codes):
+            sortedCodes = self.sortedCodes[:, table]
+            start = np.searchsorted(sortedCodes, code, side="left")
+            end = np.searchsorted(sortedCodes, code, side="right")
+            candidates.append(self.order[start:end, table])
+        candidates = np.unique(np.concatenate(candidates))
+        selfIndex = self.tagToIndex.get(word)
+        if selfIndex is not None:
+            candidates = candidates[candidates != selfIndex]
+
+        # Rank candidates exactly.
+        similarities = self.tagVectors[candidates].dot(vector)
+        keep = similarities >= minSimilarity
+        (candidates, similarities) = (candidates[keep], similarities[keep])
+        if len(candidates) > topK:
+            top = np.argpartition(-similarities, topK - 1)[:topK]
+            (candidates, similarities) = (candidates[top], similarities[top])
+        order = np.argsort(-similarities, kind="stable")
+        return [(self.tags[index], float(similarity)) for (index, similarity) in zip(candidates[order], similarities[order])]
+
+    def expandQuery(self, queryInfo, topK, minSimilarity=0.5):
+        """
+        Returns a copy of queryInfo with neighbouring tags of each ScoreKeywords word added
+        to ScoreKeywords.
+        FilterInKeywords are not expanded, as all of them must match a slide.
+        """
+        if not queryInfo.get("ScoreKeywords"):
+            return queryInfo
+
+        scoreKeywords = list(queryInfo["ScoreKeywords"])
+        for word in queryInfo["ScoreKeywords"]:
+            for (tag, _) in self.neighbours(word, topK, minSimilarity):
+                if tag not in scoreKeywords:
+                    scoreKeywords.append(tag)
+
+        retval = dict(queryInfo)
+        retval["ScoreKeywords"] = scoreKeywords
+        return retval
@@ -0,0 +1,208 @@
+"""
+Array based inference for tree ensembles fitted by pyltr LambdaMART.
+    pyltr scores rows by walking sklearn tree objects, one tree at a time.
+    TreeEnsemble flattens all trees into contiguous NumPy arrays and advances all rows
+    through all trees together, one level at a time.
+"""
+import time, threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+from LibLisa import methodProfiler, blockProfiler
+
+# Child index of leaves in sklearn trees.
+TREE_LEAF = -1
+
+# Thread pools used by TreeEnsemble.predict(), by count of threads. Shared by all ensembles.
+predictionPools = {}
+predictionPoolsLock = threading.Lock()
+
+def getPredictionPool(threadCount):
+    """
+    Returns the shared pool of threadCount threads, creating it if required.
+    """
+    with predictionPoolsLock:
+        pool = predictionPools.get(threadCount)
+        if pool is None:
+            pool = ThreadPoolExecutor(max_workers=threadCount, thread_name_prefix="TreeEnsemble")
+            predictionPools[threadCount] = pool
+        return pool
+
+class TreeEnsemble(object):
+    """
+    Nodes of all trees are stored in flat arrays, indexed by global node index.
+        feature, threshold : Split of the node. Rows with X[feature] <= threshold go left.
+        children : Global indices of right and left child of node i at 2i and 2i+1.
+            Leaves point to themselves.
+        value : Learning rate times the output of the node.
+        roots : Global index of root node of each tree.
+    Scores are the same, bit for bit, as pyltr.models.LambdaMART.predict(), which adds
+    learningRate * leaf value of each tree, in tree order, to a float64 score starting at 0.
+    """
+    def __init__(self, feature, threshold, children, value, roots, maxDepth, featureCount):
+        # Indices are kept as intp, so that NumPy does not convert them on every lookup.
+        self.feature = np.asarray(feature, dtype=np.intp)
+        self.threshold = np.asarray(threshold, dtype=np.float64)
+        self.children = np.asarray(children, dtype=np.intp)
+        self.value = np.asarray(value, dtype=np.float64)
+        self.roots = np.asarray(roots, dtype=np.intp)
+        self.maxDepth = maxDepth
+        self.featureCount = featureCount
+
+    @staticmethod
+    def fromLambdaMart(lambdaMartModel):
+        """
+        Flattens the fitted trees of a pyltr LambdaMART model.
+        """
+        estimators = lambdaMartModel.estimators_[:lambdaMartModel.estimators_fitted_]
+        trees = [estimator.tree_ for estimator in np.asarray(estimators).ravel()]
+        return TreeEnsemble.fromTrees(trees, lambdaMartModel.learning_rate)
+
+    @staticmethod
+    def fromTrees(trees, learningRate):
+        """
+        Flattens sklearn tree structures(DecisionTreeRegressor.tree_).
+        """
+        with blockProfiler("TreeEnsemble.fromTrees"):
+            (features, thresholds, lefts, rights, values, roots) = ([], [], [], [], [], [])
+            (nodeCount, maxDepth, featureCount) = (0, 0, 0)
+            for tree in trees:
+                isLeaf = tree.children_left == TREE_LEAF
+                localIndices = np.arange(tree.node_count)
+                roots.append(nodeCount)
+
+                # Leaves compare against +inf on feature 0 and point to themselves either way.
+                features.append(np.where(isLeaf, 0, tree.feature).astype(np.int32))
+                thresholds.append(np.where(isLeaf, np.inf, tree.threshold).astype(np.float64))
+                lefts.append((np.where(isLeaf, localIndices, tree.children_left) + nodeCount).astype(np.int32))
+                rights.append((np.where(isLeaf, localIndices, tree.children_right) + nodeCount).astype(np.int32))
+                values.append(learningRate * tree.value[:, 0, 0].astype(np.float64))
+
+                nodeCount += tree.node_count
+                maxDepth = max(maxDepth, int(tree.max_depth))
+                featureCount = max(featureCount, int(tree.n_features))
+
+            def concatenate(arrays, dtype):
+                return np.concatenate(arrays) if arrays else np.zeros(0, dtype=dtype)
+
+            children = np.stack([concatenate(rights, np.int32), concatenate(lefts, np.int32)], axis=1).ravel()
+            return TreeEnsemble(
+                concatenate(features, np.int32),
+                concatenate(thresholds, np.float64),
+                children,
+                concatenate(values, np.float64),
+                np.array(roots, dtype=np.int32),
+                maxDepth,
+                featureCount)
+
+    def arrays(self):
+        """
+        Node arrays, to be saved by IndexArtifact.writeArtifact. Indices are saved as int32.
+        """
+        return {
+            "feature" : self.feature.astype(np.int32),
+            "threshold" : self.threshold,
+            "children" : self.children.astype(np.int32),
+            "value" : self.value,
+            "roots" : self.roots.astype(np.int32),
+        }
+
+    @staticmethod
+    def fromArrays(arrays, maxDepth, featureCount):
+        """
+        Inverse of arrays().
+        """
+        nodeCount = len(arrays["value"])
+        if not (len(arrays["feature"]) == len(arrays["threshold"]) == nodeCount
+                and len(arrays["children"]) == 2 * nodeCount):
+            raise ValueError("Tree arrays have inconsistent lengths.")
+        for name in ["children", "roots"]:
+            if len(arrays[name]) and not (0 <= arrays[name].min() and arrays[name].max() < nodeCount):
+                raise ValueError("Tree array {0} has invalid node indices.".format(name))
+        if len(arrays["feature"]) and not (0 <= arrays["feature"].min() and arrays["feature"].max() < featureCount):
+            raise ValueError("Tree array feature has invalid feature indices.")
+        return TreeEnsemble(
+            arrays["feature"],
+            arrays["threshold"],
+            arrays["children"],
+            arrays["value"],
+            arrays["roots"],
+            maxDepth,
+            featureCount)
+
+    def leaves(self, X):
+        """
+        Returns (rows x trees) global indices of the leaf reached by each row in each tree.
+        """
+        nodes = np.repeat(self.roots[np.newaxis, :], X.shape[0], axis=0)
+        # Offset of each row in flattened X.
+        rowOffsets = (np.arange(X.shape[0], dtype=np.intp) * X.shape[1])[:, np.newaxis]
+        X = X.ravel()
+        for _ in range(self.maxDepth):
+            goLeft = X[rowOffsets + self.feature[nodes]] <= self.threshold[nodes]
+            nodes = self.children[2 * nodes + goLeft]
+        return nodes
+
+    @methodProfiler
+    def predict(self, X, chunkSize=2048, threadCount=1):
+        """
+        Scores rows of feature matrix X. Rows are processed in chunks of chunkSize, to bound
+        the memory used for node indices.
+        If threadCount is more than 1, chunks are scored in parallel on a shared thread pool.
+        NumPy releases the GIL in the gathers and sums, which take most of the time.
+        Each row is scored the same way in either case, so scores don't depend on threadCount.
+        """
+        # Same conversion as done by sklearn trees.
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        scores = np.zeros(X.shape[0], dtype=np.float64)
+        starts = range(0, X.shape[0], chunkSize)
+        if threadCount > 1 and len(starts) > 1:
+            # Chunks write disjoint slices of scores.
+            futures = [getPredictionPool(threadCount).submit(
+                    self.predictChunk, X[start:start + chunkSize], scores[start:start + chunkSize])
+                for start in starts]
+            for future in futures:
+                future.result()
+        else:
+            for start in starts:
+                self.predictChunk(X[start:start + chunkSize], scores[start:start + chunkSize])
+        return scores
+
+    def predictChunk(self, X, scores):
+        """
+        Writes scores of rows of X into scores.
+        """
+        if not len(self.roots):
+            return
+        # Accumulation adds leaf values sequentially, in the order of trees.
+        leafValues = self.value[self.leaves(X)]
+        scores[:] = np.add.accumulate(leafValues, axis=1)[:, -1]
+
+def benchmark(lambdaMartModel, rowCounts=(10000, 100000, 1000000), seed=0):
+    """
+    Compares TreeEnsemble with pyltr LambdaMART.predict on random feature matrices.
+    Verifies that scores are identical and reports time taken by both.
+    """
+    treeEnsemble = TreeEnsemble.fromLambdaMart(lambdaMartModel)
+    randomState = np.random.RandomState(seed)
+    for rowCount in rowCounts:
+        X = randomState.exponential(scale=5.0, size=(rowCount, treeEnsemble.featureCount)).astype(np.float32)
+
+        startTime = time.time()
+        pyltrScores = lambdaMartModel.predict(X)
+        pyltrTime = time.time() - startTime
+
+        startTime = time.time()
+        ensembleScores = treeEnsemble.predict(X)
+        ensembleTime = time.time() - startTime
+
+        print("{0} rows: pyltr {1:.3f}s, TreeEnsemble {2:.3f}s, identical {3}".format(
+            rowCount, pyltrTime, ensembleTime, np.array_equal(pyltrScores, ensembleScores)))
+
+if __name__ == "__main__":
+    import pickle, sys
+
+    # Benchmark a model saved by SlideSearchLambdaMart.saveTrainingResult().
+    with open(sys.argv[1], "rb") as fp:
+        (_, _, lambdaMartModel) = pickle.load(fp)
+    benchmark(lambdaMartModel)
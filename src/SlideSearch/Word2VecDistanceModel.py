@@ -3,32 +3,509 @@
     Using the model, we compute word distances, word to tag-set distances, and
     query phrase to tag-set distances.
 """
-import gensim, os, json, pylru
+import gensim, os, json, pylru, threading, hashlib
+import numpy as np
+from cachetools import LRUCache
 from LibLisa import lisaConfig, methodProfiler, blockProfiler, lastCallProfile
 
+def keyedVectorsToArrays(keyedVectors):
+    """
+    Converts gensim KeyedVectors into a word list and a contiguous float32 matrix of
+    unit length word vectors. Row i of the matrix is the vector of the i-th word.
+    """
+    # Attribute names differ across gensim versions.
+    words = list(getattr(keyedVectors, "index_to_key", None) or keyedVectors.index2word)
+    vectors = keyedVectors.vectors if hasattr(keyedVectors, "vectors") else keyedVectors.syn0
+    vectors = np.array(vectors, dtype=np.float32)
+
+    # Normalize, so that cosine similarity is a plain dot product.
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    vectors /= norms
+    return (words, np.ascontiguousarray(vectors))
+
+def quantizeVectors(vectors, dtype):
+    """
+    Quantizes a float32 vector matrix into the given dtype("float32", "float16" or "int8").
+    int8 vectors are scaled per row, such that the largest component of each row maps to 127.
+    Returns (quantized vectors, per row scales). Scales are None, unless dtype is int8.
+    """
+    dtype = np.dtype(dtype)
+    if dtype == np.float32 or dtype == np.float16:
+        return (np.ascontiguousarray(vectors, dtype=dtype), None)
+    elif dtype == np.int8:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        scales = np.abs(vectors).max(axis=1) / 127
+        scales[scales == 0] = 1
+        quantized = np.rint(vectors / scales[:, np.newaxis]).astype(np.int8)
+        return (quantized, scales.astype(np.float32))
+    else:
+        raise ValueError("Unsupported word2vec dtype {0}.".format(dtype))
+
+def dequantizeVectors(vectors, scales):
+    """
+    Inverse of quantizeVectors. Returns float32 vectors.
+    """
+    retval = np.asarray(vectors, dtype=np.float32)
+    if scales is not None:
+        retval = retval * np.asarray(scales)[..., np.newaxis]
+    return retval
+
+def hashWord(encodedWord):
+    """
+    64 bit hash of a UTF-8 encoded word. Unlike hash(), it is the same in all processes,
+    so that it can be saved in the word2vec store.
+    """
+    return int.from_bytes(hashlib.blake2b(encodedWord, digest_size=8).digest(), "little")
+
+class Word2vecVocabulary(object):
+    """
+    Vocabulary of a word2vec model, kept in a few numpy arrays instead of a dict of Python strings.
+    So, it can be memory mapped from the word2vec store and shared by all processes, like vectors.
+        hashes : Sorted hashWord() of all words.
+        rows : rows[i] is the row of the word whose hash is hashes[i].
+               None, if rows are in hash order, as in a saved store.
+        wordBytes : UTF-8 encoded words concatenated in row order.
+        offsets : wordBytes[offsets[i]:offsets[i+1]] is the word of row i.
+
+    A word is looked up by np.searchsorted() of its hash and verified against wordBytes.
+    A lookup costs ~5 micro seconds, against ~0.1 for a dict. But loading 3M words takes ~5 milli
+    seconds and no private memory of the process, against ~7 seconds and ~420MB of Python strings
+    and dict entries built from a word list in each process.
+    The vocabulary is a sequence of words. So, it can be used wherever a word list was.
+    """
+    def __init__(self, hashes, wordBytes, offsets, rows=None):
+        """
+        Constructor
+        """
+        # Plain ndarray views of memory mapped arrays are cheaper to index.
+        (self.hashes, self.wordBytes, self.offsets) = (hashes.view(np.ndarray), wordBytes.view(np.ndarray), offsets.view(np.ndarray))
+        self.rows = rows
+
+    @staticmethod
+    def fromWords(words):
+        """
+        Builds the vocabulary of a word list. Row i is the i-th word.
+        """
+        encodedWords = [word.encode("utf-8") for word in words]
+        hashes = np.array([hashWord(word) for word in encodedWords], dtype=np.uint64)
+        rows = np.argsort(hashes, kind="stable")
+        offsets = np.zeros(len(encodedWords) + 1, dtype=np.int64)
+        np.cumsum(np.array([len(word) for word in encodedWords], dtype=np.int64), out=offsets[1:])
+        wordBytes = np.frombuffer(b"".join(encodedWords), dtype=np.uint8)
+        return Word2vecVocabulary(hashes[rows], wordBytes, offsets, rows)
+
+    @property
+    def nbytes(self):
+        """
+        Memory used by the vocabulary arrays.
+        """
+        return (self.hashes.nbytes + self.wordBytes.nbytes + self.offsets.nbytes
+                + (0 if self.rows is None else self.rows.nbytes))
+
+    def __len__(self):
+        """
+        Count of words.
+        """
+        return len(self.offsets) - 1
+
+    def __getitem__(self, row):
+        """
+        Word of the row.
+        """
+        return self.wordBytes[self.offsets.item(row):self.offsets.item(row + 1)].tobytes().decode("utf-8")
+
+    def __iter__(self):
+        """
+        Words in row order.
+        """
+        for row in range(len(self)):
+            yield self[row]
+
+    def __contains__(self, word):
+        """
+        True, if the word is in vocabulary.
+        """
+        return self.indexOf(word) is not None
+
+    def indexOf(self, word):
+        """
+        Row of the word, or None if the word is not in vocabulary.
+        """
+        encodedWord = word.encode("utf-8")
+        wordHash = hashWord(encodedWord)
+        position = int(self.hashes.searchsorted(np.uint64(wordHash)))
+        # Words with colliding hashes are adjacent.
+        while position < len(self.hashes) and self.hashes.item(position) == wordHash:
+            row = position if self.rows is None else self.rows.item(position)
+            if self.wordBytes[self.offsets.item(row):self.offsets.item(row + 1)].tobytes() == encodedWord:
+                return row
+            position += 1
+        return None
+
+    def hashOrder(self):
+        """
+        Rows in the order of their hashes.
+        """
+        return np.arange(len(self), dtype=np.int64) if self.rows is None else self.rows
+
+def saveWord2vecStore(storePath, words, vectors, scales=None):
+    """
+    Saves a word list(or a Word2vecVocabulary) and its vector matrix into the word2vec store at storePath.
+        storePath + ".vocab.hashes.npy", ".vocab.bytes.npy" and ".vocab.offsets.npy" contain the
+        vocabulary. See Word2vecVocabulary.
+        storePath + ".vectors.npy" contains the matrix, which can be memory mapped.
+        storePath + ".scales.npy" contains per row scales, only for int8 vectors.
+    Rows are saved in the order of word hashes, so that a loaded vocabulary needs no row mapping.
+    Files are first written under a temporary name, so that processes loading the store
+    never see partially written files.
+    """
+    storeDir = os.path.dirname(storePath)
+    if storeDir and not os.path.exists(storeDir):
+        os.makedirs(storeDir)
+
+    vocabulary = words if isinstance(words, Word2vecVocabulary) else Word2vecVocabulary.fromWords(words)
+    order = vocabulary.hashOrder()
+    (positions, offsets) = selectSegments(vocabulary.offsets, order)
+    arrays = [
+        ("vectors", np.ascontiguousarray(np.asarray(vectors)[order])),
+        ("vocab.offsets", offsets),
+        ("vocab.bytes", np.asarray(vocabulary.wordBytes)[positions]),
+        ("vocab.hashes", np.asarray(vocabulary.hashes)),
+    ]
+    if scales is not None:
+        arrays.insert(1, ("scales", np.ascontiguousarray(np.asarray(scales, dtype=np.float32)[order])))
+    elif os.path.exists(storePath + ".scales.npy"):
+        # Stale scales of a previously saved int8 store.
+        os.remove(storePath + ".scales.npy")
+
+    for (name, array) in arrays:
+        with open(storePath + "." + name + ".tmp.npy", "wb") as fp:
+            np.save(fp, array)
+    # Hashes are replaced last, as loaders check them for existence of the store.
+    for (name, array) in arrays:
+        os.replace(storePath + "." + name + ".tmp.npy", storePath + "." + name + ".npy")
+    if os.path.exists(storePath + ".vocab.json"):
+        # Word list of a store saved in the older format.
+        os.remove(storePath + ".vocab.json")
+
+def loadWord2vecStore(storePath):
+    """
+    Loads the word2vec store saved by saveWord2vecStore().
+    The vocabulary and the vector matrix are memory mapped read-only. So, all processes loading
+    the same store share a single page cache copy of them.
+    Stores saved in the older format, with a ".vocab.json" word list, are still loaded, but their
+    vocabulary is built in process memory. Saving them again converts them.
+    Returns (vocabulary, vectors, scales).
+    """
+    if os.path.exists(storePath + ".vocab.hashes.npy"):
+        vocabulary = Word2vecVocabulary(
+            np.load(storePath + ".vocab.hashes.npy", mmap_mode="r"),
+            np.load(storePath + ".vocab.bytes.npy", mmap_mode="r"),
+            np.load(storePath + ".vocab.offsets.npy", mmap_mode="r"))
+    else:
+        with open(storePath + ".vocab.json", "r") as fp:
+            vocabulary = Word2vecVocabulary.fromWords(json.load(fp))
+    vectors = np.load(storePath + ".vectors.npy", mmap_mode="r")
+    scales = None
+    if vectors.dtype == np.int8:
+        scales = np.load(storePath + ".scales.npy", mmap_mode="r")
+    return (vocabulary, vectors, scales)
+
+def word2vecStoreExists(storePath):
+    """
+    True, if a word2vec store has been saved at storePath.
+    """
+    return ((os.path.exists(storePath + ".vocab.hashes.npy") or os.path.exists(storePath + ".vocab.json"))
+            and os.path.exists(storePath + ".vectors.npy"))
+
+@methodProfiler
+def convertWord2vecModel(modelPath=None, storePath=None, dtype="float32"):
+    """
+    One time conversion of the binary word2vec model into the memory mappable store,
+    which is then loaded by Word2vecDistanceModel.
+    Vectors are stored quantized into dtype. See quantizeVectors().
+    Returns the float32 model, which can be used as a reference for the stored one.
+    """
+    modelPath = lisaConfig.word2vecModelPath if modelPath is None else modelPath
+    storePath = lisaConfig.word2vecStorePath if storePath is None else storePath
+
+    keyedVectors = gensim.models.KeyedVectors.load_word2vec_format(modelPath, binary=True)
+    (words, vectors) = keyedVectorsToArrays(keyedVectors)
+    referenceModel = Word2vecDistanceModel(words=words, vectors=vectors)
+    referenceModel.quantized(dtype).save(storePath)
+    return referenceModel
+
+@methodProfiler
+def compareRankings(referenceModel, candidateModel, tagsets, queries, topK=10):
+    """
+    Replays queries(lists of words) against tagsets using both models and reports how much
+    the ranking of the candidate model (a quantized one, say) differs from the reference model.
+        meanTopKOverlap : Mean fraction of top K tagsets shared by both rankings.
+        meanAbsScoreDiff : Mean absolute difference in similarity scores.
+        bytesRatio : Memory of the candidate's vectors relative to the reference.
+    """
+    referenceMatrix = TagsetMatrix(referenceModel, tagsets)
+    candidateMatrix = TagsetMatrix(candidateModel, tagsets)
+    topK = min(topK, len(tagsets))
+
+    overlaps = []
+    scoreDiffs = []
+    for words in queries:
+        referenceScores = referenceModel.queryPhrase2TagsetsSimilarity(words, referenceMatrix)
+        candidateScores = candidateModel.queryPhrase2TagsetsSimilarity(words, candidateMatrix)
+        if topK:
+            referenceTop = set(np.argsort(-referenceScores, kind="stable")[:topK].tolist())
+            candidateTop = set(np.argsort(-candidateScores, kind="stable")[:topK].tolist())
+            overlaps.append(len(referenceTop & candidateTop) / topK)
+        scoreDiffs.append(float(np.abs(referenceScores - candidateScores).mean()) if len(tagsets) else 0.0)
+
+    return {
+        "queryCount": len(queries),
+        "meanTopKOverlap": float(np.mean(overlaps)) if overlaps else 1.0,
+        "meanAbsScoreDiff": float(np.mean(scoreDiffs)) if scoreDiffs else 0.0,
+        "bytesRatio": candidateModel.nbytes / float(referenceModel.nbytes),
+    }
+
+def segmentedMax(values, offsets, emptyValue):
+    """
+    For a CSR like layout, where rows values[offsets[i]:offsets[i+1]] belong to segment i,
+    computes the row-wise maximum of each segment in one pass.
+    Empty segments get emptyValue.
+    """
+    retval = np.full((len(offsets) - 1,) + values.shape[1:], emptyValue, dtype=np.float32)
+    nonEmpty = offsets[:-1] < offsets[1:]
+    if np.any(nonEmpty):
+        # Empty segments are skipped, so each reduction ends exactly at the end of its segment.
+        retval[nonEmpty] = np.maximum.reduceat(values, offsets[:-1][nonEmpty], axis=0)
+    return retval
+
+def selectSegments(offsets, rows):
+    """
+    For a CSR like layout given by offsets, computes positions of all entries of the
+    selected rows and the offsets of the selected rows within them.
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    starts = offsets[rows]
+    lengths = offsets[rows + 1] - starts
+    selectedOffsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=selectedOffsets[1:])
+    positions = np.arange(selectedOffsets[-1]) + np.repeat(starts - selectedOffsets[:-1], lengths)
+    return (positions, selectedOffsets)
+
+class TagsetMatrix(object):
+    """
+    Tagsets of a whole slide catalog laid out for batched similarity computations.
+        tags : Unique tags of all tagsets.
+        tagVectors : Unit length word2vec vector of each unique tag. Zero for unknown tags.
+        tagKnown : True for tags found in the word2vec model.
+        tagIds : Concatenated indices(into tags) of tags of all tagsets.
+        offsets : tagIds[offsets[i]:offsets[i+1]] are the tags of i-th tagset.
+
+    Tags are fixed for the lifetime of the matrix. So, similarities of query words with all
+    tags are cached, in a LRU cache bounded by lisaConfig.word2vecSimilarityCacheBytes.
+    """
+    def __init__(self, distanceModel, tagsets):
+        """
+        Constructor
+        """
+        with blockProfiler("TagsetMatrix.__init__"):
+            self.distanceModel = distanceModel
+            self.tagToIndex = {}
+            tagIds = []
+            self.offsets = np.zeros(len(tagsets) + 1, dtype=np.int64)
+            for (index, tagset) in enumerate(tagsets):
+                for tag in tagset:
+                    tagIds.append(self.tagToIndex.setdefault(tag, len(self.tagToIndex)))
+                self.offsets[index + 1] = len(tagIds)
+            self.tagIds = np.array(tagIds, dtype=np.int32)
+
+            self.tags = [None] * len(self.tagToIndex)
+            for (tag, index) in self.tagToIndex.items():
+                self.tags[index] = tag
+            (self.tagVectors, self.tagKnown) = distanceModel.getVectors(self.tags)
+
+            # Maps a word to its similarities with all tags. Entry [tagId] of the row cached
+            # for a word is the similarity of (word, tag).
+            self.similarityCache = LRUCache(
+                maxsize=lisaConfig.word2vecSimilarityCacheBytes,
+                getsizeof=lambda similarities: similarities.nbytes)
+            # LRUCache reorders entries even on get. Searches on many threads share the cache.
+            self.similarityCacheLock = threading.Lock()
+
+            # Optional tag x tag similarities, built by materializeTagSimilarities().
+            self.tagTagSimilarities = None
+
+    def __len__(self):
+        """
+        Count of tagsets.
+        """
+        return len(self.offsets) - 1
+
+    def computeSimilarities(self, words):
+        """
+        Computes similarities of all tags with the words. Returns a (tags x words) matrix.
+        Unknown words or tags get -2, as in Word2vecDistanceModel.word2wordSemanticSimilarity.
+        """
+        (wordVectors, wordKnown) = self.distanceModel.getVectors(words)
+        retval = self.tagVectors.dot(wordVectors.T)
+        retval[~self.tagKnown, :] = -2
+        retval[:, ~wordKnown] = -2
+        return retval
+
+    @methodProfiler
+    def materializeTagSimilarities(self, blockSize=1024):
+        """
+        Precomputes similarities between all pairs of tags, quantized into float16.
+        Useful when most query words are tags, as in building seed training sets.
+        """
+        tagCount = len(self.tags)
+        self.tagTagSimilarities = np.empty((tagCount, tagCount), dtype=np.float16)
+        for start in range(0, tagCount, blockSize):
+            self.tagTagSimilarities[start:start + blockSize] = self.computeSimilarities(self.tags[start:start + blockSize]).T
+
+    def wordSimilarities(self, words):
+        """
+        Returns a (tags x words) matrix of similarities of all tags with the words.
+        Uses materialized tag similarities and cached rows, wherever possible.
+        """
+        retval = np.empty((len(self.tags), len(words)), dtype=np.float32)
+        missing = []
+        for (index, word) in enumerate(words):
+            if self.tagTagSimilarities is not None and word in self.tagToIndex:
+                retval[:, index] = self.tagTagSimilarities[self.tagToIndex[word]]
+                continue
+            with self.similarityCacheLock:
+                similarities = self.similarityCache.get(word)
+            if similarities is None:
+                missing.append(index)
+            else:
+                retval[:, index] = similarities
+
+        if missing:
+            # Compute all missing words in one matrix multiply.
+            computed = self.computeSimilarities([words[index] for index in missing])
+            for (column, index) in enumerate(missing):
+                similarities = np.ascontiguousarray(computed[:, column])
+                retval[:, index] = similarities
+                if similarities.nbytes <= self.similarityCache.maxsize:
+                    with self.similarityCacheLock:
+                        self.similarityCache[words[index]] = similarities
+        return retval
+
 class Word2vecDistanceModel(object):
     """
         Class used to encapsulate word2vec distance model.
         Using the model, we compute word distances, word to tag-set distances, and
         query phrase to tag-set distances.
     """
-    def __init__(self):
+    def __init__(self, storePath=None, words=None, vectors=None, fallbackModel=None, scales=None):
         """
         Constructor
+        If words and vectors are given, the model is built directly from them.
+        Otherwise, loads the memory mapped store built by convertWord2vecModel(), if present,
+        or falls back to parsing the binary word2vec model.
+
+        words may be a word list or a Word2vecVocabulary.
+        Vectors may be float32, float16 or int8. int8 vectors come with per row scales.
+        They are dequantized into float32 only when looked up.
+
+        fallbackModel, if given, is consulted for words missing in this model's vocabulary.
         """
+        storePath = lisaConfig.word2vecStorePath if storePath is None else storePath
         with blockProfiler("Word2vecDistanceModel.__init__"):
-            # self.word2vecModel = gensim.models.KeyedVectors.load_word2vec_format('C:/Users/NishantSharma/source/repos/word2vec-slim/GoogleNews-vectors-negative300-SLIM.bin', binary=True)
-            self.word2vecModel = gensim.models.KeyedVectors.load_word2vec_format(lisaConfig.word2vecModelPath, binary=True)
+            if words is not None:
+                (self.words, self.vectors, self.scales) = (words, vectors, scales)
+            elif word2vecStoreExists(storePath):
+                (self.words, self.vectors, self.scales) = loadWord2vecStore(storePath)
+            else:
+                keyedVectors = gensim.models.KeyedVectors.load_word2vec_format(lisaConfig.word2vecModelPath, binary=True)
+                (self.words, self.vectors) = keyedVectorsToArrays(keyedVectors)
+                self.scales = None
+            # Words are looked up in a Word2vecVocabulary. Built ones are shared by quantized copies.
+            if not isinstance(self.words, Word2vecVocabulary):
+                self.words = Word2vecVocabulary.fromWords(self.words)
+
+            # Vectors of rare out of vocabulary words, looked up from the fallback model.
+            self.fallbackModel = fallbackModel
+            self.fallbackCache = pylru.lrucache(lisaConfig.word2vecFallbackCacheSize)
+            self.fallbackCacheLock = threading.Lock()
+
+    @property
+    def nbytes(self):
+        """
+        Memory used by word vectors.
+        """
+        return self.vectors.nbytes + (0 if self.scales is None else self.scales.nbytes)
+
+    def quantized(self, dtype):
+        """
+        Builds a copy of the model with vectors quantized into dtype. See quantizeVectors().
+        """
+        (vectors, scales) = quantizeVectors(dequantizeVectors(self.vectors, self.scales), dtype)
+        return Word2vecDistanceModel(words=self.words, vectors=vectors, scales=scales, fallbackModel=self.fallbackModel)
+
+    def pruned(self, words, fallbackModel=None):
+        """
+        Builds a model which only keeps vectors of the given words.
+        Words not found in the pruned model are looked up from fallbackModel, if given.
+        The pruned model doesn't refer to this model, unless it is passed as fallbackModel.
+        """
+        wordToIndex = {word:self.words.indexOf(word) for word in set(words)}
+        keptWords = sorted(word for (word, index) in wordToIndex.items() if index is not None)
+        keptIndices = [wordToIndex[word] for word in keptWords]
+        keptVectors = np.array(self.vectors[keptIndices], dtype=self.vectors.dtype).reshape(len(keptWords), self.vectors.shape[1])
+        keptScales = None if self.scales is None else np.array(self.scales[keptIndices], dtype=np.float32)
+        return Word2vecDistanceModel(words=keptWords, vectors=keptVectors, fallbackModel=fallbackModel, scales=keptScales)
+
+    def save(self, storePath):
+        """
+        Saves the model as a memory mappable word2vec store.
+        """
+        saveWord2vecStore(storePath, self.words, self.vectors, self.scales)
+
+    def getVector(self, word):
+        """
+        Returns unit length word vector of the word, or None if the word is not in vocabulary.
+        """
+        index = self.words.indexOf(word)
+        if index is not None:
+            return dequantizeVectors(self.vectors[index], None if self.scales is None else self.scales[index])
+        if self.fallbackModel is None:
+            return None
+        with self.fallbackCacheLock:
+            if word in self.fallbackCache:
+                return self.fallbackCache[word]
+        # Looked up outside the lock, as it may load the fallback model.
+        vector = self.fallbackModel.getVector(word)
+        with self.fallbackCacheLock:
+            self.fallbackCache[word] = vector
+        return vector
+
+    def getVectors(self, words):
+        """
+        Returns a float32 matrix with unit length vectors of all words and a mask of words found.
+        Rows of words not found are zero.
+        """
+        retval = np.zeros((len(words), self.vectors.shape[1]), dtype=np.float32)
+        found = np.zeros(len(words), dtype=bool)
+        for (index, word) in enumerate(words):
+            vector = self.getVector(word)
+            if vector is not None:
+                retval[index] = vector
+                found[index] = True
+        return (retval, found)
 
     def word2wordSemanticSimilarity(self, word1, word2):
         """
         Measures semantic similarity between two words, using word2vec.
         """
-        try:
-            return self.word2vecModel.similarity(word1, word2)
-        except KeyError:
+        vector1 = self.getVector(word1)
+        vector2 = self.getVector(word2)
+        if vector1 is None or vector2 is None:
             # print("Key not found: {0} or {1}".format(word1, word2))
             return -2
+        return float(np.dot(vector1, vector2))
 
     @methodProfiler
     def word2TagsetSemanticSimilarity(self, word, tagset):
@@ -57,6 +534,118 @@ class Word2vecDistanceModel(object):
         # Return result.
         return semanticSimilarity
 
-word2vecDistanceModel = Word2vecDistanceModel()
-print("Profiling data for building Word2vecDistanceModel:\n {0}".format(json.dumps(lastCallProfile(), indent=4)))
+    @methodProfiler
+    def queryPhrase2TagsetsSimilarity(self, words, tagsetMatrix, rows=None):
+        """
+        Batched version of queryPhrase2TagsetSimilarity.
+        Measures semantic similarity between a query phrase and each tagset of a TagsetMatrix.
+        If rows is given, only those tagsets are scored.
+        Returns an array of similarities, one per scored tagset.
+        """
+        # Similarity of every query word with every unique tag.
+        tagSimilarities = tagsetMatrix.wordSimilarities(list(words))
+
+        if rows is None:
+            (tagIds, offsets) = (tagsetMatrix.tagIds, tagsetMatrix.offsets)
+        else:
+            (positions, offsets) = selectSegments(tagsetMatrix.offsets, rows)
+            tagIds = tagsetMatrix.tagIds[positions]
+
+        # Max pool similarities of each word over tags of each tagset.
+        # A word's similarity with a tagset is never below -1, as in word2TagsetSemanticSimilarity.
+        wordSimilarities = segmentedMax(tagSimilarities[tagIds], offsets, -1)
+        np.maximum(wordSimilarities, -1, out=wordSimilarities)
+        return wordSimilarities.sum(axis=1)
+
+@methodProfiler
+def buildPrunedWord2vecModel(dictionary, queryWords=(), storePath=None):
+    """
+    Index time step, which builds a word2vec model only for the words which slide search
+    compares. These are the tag vocabulary of the index (a gensim Dictionary) and frequent
+    query words. The pruned model is saved at storePath, to be loaded by loadPrunedWord2vecModel()
+    when serving.
+    The complete model is unloaded afterwards, unless it was already loaded before.
+    """
+    storePath = lisaConfig.word2vecPrunedStorePath if storePath is None else storePath
+    words = set(dictionary.token2id.keys())
+    words.update(queryWords)
+
+    wasLoaded = word2vecDistanceModel.isLoaded
+    prunedModel = word2vecDistanceModel.pruned(words)
+    if not wasLoaded:
+        word2vecDistanceModel.unload()
+
+    prunedModel.save(storePath)
+    return prunedModel
+
+def loadPrunedWord2vecModel(storePath=None):
+    """
+    Serving side counterpart of buildPrunedWord2vecModel(). Loads the pruned store.
+    If lisaConfig.word2vecPrunedFallback is set, words missing in the pruned store are looked
+    up from the complete model, which is loaded on the first such lookup. It is also used
+    instead of a missing pruned store.
+    Returns None, if there is no pruned store and the fallback isn't enabled.
+    """
+    storePath = lisaConfig.word2vecPrunedStorePath if storePath is None else storePath
+    fallbackModel = word2vecDistanceModel if lisaConfig.word2vecPrunedFallback else None
+    if word2vecStoreExists(storePath):
+        return Word2vecDistanceModel(storePath=storePath, fallbackModel=fallbackModel)
+    print("Pruned word2vec store not found at {0}.".format(storePath))
+    return fallbackModel
+
+class LazyWord2vecDistanceModel(object):
+    """
+        Handle to a Word2vecDistanceModel, which is built on its first real use.
+
+        Loading the word2vec model takes a long time and a lot of memory. Most processes
+        importing SlideSearch (LambdaMART serving, Django management commands) never use it.
+        Attribute accesses on the handle are forwarded to the model, loading it if required.
+    """
+    def __init__(self, loader=None):
+        """
+        Constructor
+        loader builds the model. By default, the complete word2vec model is loaded.
+        """
+        self._loader = Word2vecDistanceModel if loader is None else loader
+        self._model = None
+        self._isLoaded = False
+        self._lock = threading.Lock()
+
+    @property
+    def isLoaded(self):
+        """
+        True, if the word2vec model has already been loaded.
+        """
+        return self._isLoaded
+
+    def load(self):
+        """
+        Loads the word2vec model, unless already loaded, and returns it.
+        """
+        if not self._isLoaded:
+            with self._lock:
+                # Another thread may have loaded the model while we waited for the lock.
+                if not self._isLoaded:
+                    self._model = self._loader()
+                    self._isLoaded = True
+                    print("Profiling data for building Word2vecDistanceModel:\n {0}".format(json.dumps(lastCallProfile(), indent=4)))
+        return self._model
+
+    def unload(self):
+        """
+        Drops the loaded model. It is loaded again on next use.
+        """
+        with self._lock:
+            (self._model, self._isLoaded) = (None, False)
+
+    def __getattr__(self, name):
+        """
+        Called only for attributes not found on the handle itself. Forwards them to the model.
+        """
+        return getattr(self.load(), name)
+
+# Complete word2vec model.
+word2vecDistanceModel = LazyWord2vecDistanceModel()
 
+# Word2vec model pruned at index time. Used when serving. May be None. See loadPrunedWord2vecModel().
+prunedWord2vecModel = LazyWord2vecDistanceModel(loadPrunedWord2vecModel)
@@ -2,7 +2,7 @@
 SlideSearch is a python module which focus purely on ML algorithm aspects of searching for
 slides.
 """
-import json, os, re, sys
+import json, os, re, sys, pickle
 import numpy as np
 
 from LibLisa import lastCallProfile, lisaConfig, blockProfiler, methodProfiler
@@ -10,32 +10,32 @@ from LibLisa import lastCallProfile, lisaConfig, blockProfiler, methodProfiler
 from SlideIndexer.LisaZeptoClient import LisaZeptoClient
 from SlideSearch.SlideSearchWord2vec import SlideSearchW2V
 from SlideSearch.SlideSearchLambdaMART import SlideSearchLambdaMart
+from SlideSearch.SlideCatalog import SlideCatalog, slideCatalogFromHierarchy
 
 # Index file schema versions:
 #   0 Direct pickling of the model.
 #   1 Only save items which are generated by fit(). Everything else is picked from DB.
-curSchemaVersion = 1
+#   2 Only save what inference needs(tree arrays, feature schema) in an IndexArtifact. No pickling.
+curSchemaVersion = 2
 
 @methodProfiler
-def slideSearchIndexLoad(filePointer, dataForIndexing, config, schemaVersion):
+def slideSearchIndexLoad(filePointer, catalog, config, schemaVersion):
     if schemaVersion == 0:
         return pickle.load(filePointer)
-    elif schemaVersion == 1:
-        slideSearchIndex = SlideSearchLambdaMart(dataForIndexing, config)
+    elif schemaVersion in [1, 2]:
+        slideSearchIndex = SlideSearchLambdaMart(catalog, config)
         slideSearchIndex.loadTrainingResult(filePointer, schemaVersion)
         return slideSearchIndex
     else:
         raise NotImplemented
 
-def getSlideRatingVecs(slideSearchIndex, slideRatingsData, slideHierarchy):
+def getSlideRatingVecs(slideSearchIndex, slideRatingsData):
     """
     Converts all the downloaded slide rating data into vectors which can
     then be fed into pyltr to train a local PYLTR model for slide rankings.
     """
     retval = {}
 
-    slidesDict = {slide["id"]:slide for slide in slideHierarchy["Slides"]}
-
     for label in ["T", "V", "E"]: # Training, Validatoin and Evaluation.
         retval[label] = {"X" : [], "y" : [], "qids" : [], "resultIds": []}
 
@@ -50,12 +50,22 @@ def getSlideRatingVecs(slideSearchIndex, slideRatingsData, slideHierarchy):
             label)
 
         # Build Ty and Tqids. Also build selectedSlides array to build Tx later.
-        selectedSlides = []
+        (selectedSlides, ratings) = ([], [])
         for queryResult in ratedQuery["results"]:
-            retval[label]["y"].append(queryResult["avgRating"])
-            retval[label]["qids"].append(ratedQuery["id"])
+            ratings.append(queryResult["avgRating"])
             slideId = queryResult["slide"]
-            selectedSlides.append(slidesDict[slideId])
+            if isinstance(slideId, dict):
+                # SearchClient.getSlideRatingsData() replaces slide ids with slides.
+                slideId = slideId["id"]
+            selectedSlides.append(slideId)
+
+        # Rated slides, which are no longer in the catalog, are dropped along with their ratings,
+        # so that rows of Tx stay aligned with Ty and Tqids.
+        (selectedSlides, found) = slideSearchIndex.catalog.rowsForIds(selectedSlides, returnMask=True)
+        if not found.all():
+            print("Skipping {0} rated slides missing in catalog.".format(int(np.count_nonzero(~found))))
+        retval[label]["y"].extend(rating for (rating, isFound) in zip(ratings, found) if isFound)
+        retval[label]["qids"].extend([ratedQuery["id"]] * len(selectedSlides))
         with blockProfiler("buildSeedTrainingSet.FeatureComputation"):
             retval[label]["X"].extend(slideSearchIndex.features(ratedQuery["queryJson"], selectedSlides))
 
@@ -88,8 +98,8 @@ if __name__ == "__main__":
         slide.id = index
 
     # Slide search using LambdaMART.
-    lisaConfig["slideSearch"].isDjangoModel = False
-    slideSearchIndex = SlideSearchLambdaMart(latestZeptoDataTransformed, lisaConfig.slideSearch)
+    catalog = slideCatalogFromHierarchy(latestZeptoDataTransformed)
+    slideSearchIndex = SlideSearchLambdaMart(catalog, lisaConfig.slideSearch)
 
     # See if we have already created training data.
     slideRatingsDataFilePath = lisaConfig.dataFolderPath + "slideRatingsData.json"
@@ -99,13 +109,13 @@ if __name__ == "__main__":
     #        (Tx, Ty, Tqids) = (slideRatingsData["Tx"], slideRatingsData["Ty"], slideRatingsData["Tqids"])
     #else:
     # Training requires seed data. Seed data is created by applying SlideSearchW2V.
-    slideSearchIndexSeed = SlideSearchW2V(latestZeptoDataTransformed, lisaConfig.slideSearch)
+    slideSearchIndexSeed = SlideSearchW2V(catalog, lisaConfig.slideSearch)
     slideRatingsData = slideSearchIndex.buildSeedTrainingSet(slideSearchIndexSeed)
     with open(slideRatingsDataFilePath, "w") as fp:
         json.dump(slideRatingsData, fp, indent=4)
 
     # Convert ratings data into vectors for training, validation and evaluation.
-    slideRatingVecs = getSlideRatingVecs(slideSearchIndex, slideRatingsData, latestZeptoDataTransformed)
+    slideRatingVecs = getSlideRatingVecs(slideSearchIndex, slideRatingsData)
 
     # LambdaMART index is now trained using the training data.
     slideSearchIndex.fit(slideRatingVecs)
@@ -116,7 +126,7 @@ if __name__ == "__main__":
         keywords = re.split("\W+", queryStr)
         queryInfo = {"RatingKeywords" : keywords}
         permittedSlideList = slideSearchIndex.getPermittedSlides(queryInfo)
-        result = slideSearchIndex.slideSearch(queryInfo, permittedSlideList)
+        result = slideSearchIndex.slideSearch(queryInfo, permittedSlideList, getIDs=True)
         print("Results:")
         json.dump(result[0:10], sys.stdout, indent=4)
 
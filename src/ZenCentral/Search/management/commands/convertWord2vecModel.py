@@ -0,0 +1,33 @@
+import json
+from django.core.management.base import BaseCommand
+from LibLisa.config import lisaConfig
+from SlideDB.models import Slide
+from Search.models import SearchQueryTemplate
+from SlideSearch.Word2VecDistanceModel import convertWord2vecModel, compareRankings, Word2vecDistanceModel
+
+
+class Command(BaseCommand):
+    help = "Converts the binary word2vec model into a memory mappable store, shared by all processes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--modelPath', type=str, default=lisaConfig.word2vecModelPath)
+        parser.add_argument('--storePath', type=str, default=lisaConfig.word2vecStorePath)
+        parser.add_argument('--dtype', type=str, default="float32", choices=["float32", "float16", "int8"])
+        parser.add_argument(
+            '--evaluate', action='store_true',
+            help="Replay logged search queries against slide tags and report ranking changes relative to float32.")
+
+    def handle(self, *args, **options):
+        referenceModel = convertWord2vecModel(options["modelPath"], options["storePath"], options["dtype"])
+        print("Converted {0} words of {1} dimensions into {2} as {3}.".format(
+            len(referenceModel.words), referenceModel.vectors.shape[1], options["storePath"], options["dtype"]))
+
+        if options["evaluate"]:
+            storedModel = Word2vecDistanceModel(options["storePath"])
+            tagsets = [[tag.name for tag in slide.tags.all()] for slide in Slide.objects.prefetch_related("tags")]
+            queries = []
+            for queryTemplate in SearchQueryTemplate.objects.all():
+                words = queryTemplate.queryJson.get("ScoreKeywords", [])
+                if words:
+                    queries.append(words)
+            print(json.dumps(compareRankings(referenceModel, storedModel, tagsets, queries), indent=4))
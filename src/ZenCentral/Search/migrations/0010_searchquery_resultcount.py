@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Search', '0009_auto_20180424_0736'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='searchquery',
+            name='resultCount',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
@@ -1,19 +1,23 @@
-import json, os, pickle
+import json, os, pickle, threading
 from django.contrib.postgres.fields import JSONField as PostgresJSONField
-from cachetools import LRUCache
 from jsonfield import JSONField
 from enumfields import Enum, EnumField
 from django.utils import timezone
-from django.db import models
+from django.db import models, transaction
+from django.core.cache import caches
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.contrib.auth import get_user_model
-from django.db.models.signals import post_save, post_delete, pre_save
+from django.db.models.signals import post_save, post_delete, pre_save, m2m_changed
 from SlideDB.models import Slide, Concept, SubConcept, Construct
 from SlideSearch import slideSearchIndexLoad
 from LibLisa import lastCallProfile, lisaConfig, methodProfiler, blockProfiler
 from LibLisa.config import lisaConfig
+from LibLisa.SingleFlight import SingleFlight
+from LibLisa.BudgetedCache import BudgetedLRUCache
 from ZenCentral.middleware import get_current_user
 from Search.utils import getPermittedSlidesDbOptimized, getDefaultUser
+from Search.utils import buildSlideCatalog, patchSlideCatalog, getCatalogVersion, bumpCatalogVersion
+from Search.utils import searchResultCacheAlias, searchResultCacheKey
 
 UserModel = get_user_model()
 
@@ -230,6 +234,10 @@ class SearchQuery(models.Model):
     # A list of results and their scores.
     resultJson = JSONField(default=[])
 
+    # Count of all results. resultJson may hold only the best of them.
+    # None for queries, whose resultJson holds all results.
+    resultCount = models.IntegerField(null=True, blank=True)
+
     # TimeStamps
     created = models.DateTimeField(editable=False)
 
@@ -250,6 +258,47 @@ class IndexTypeChoices(Enum):
     UserRatings = 1
 
 
+class SlidePatch(object):
+    """
+    Slides changed by a transaction, which are patched into the SlideCatalog and cached search
+    indices together, once it commits. See SearchIndex.patchSlides().
+    The first slide changed in a transaction bumps the catalog version, within the transaction.
+    Slides changed later join the same patch. A savepoint rolled back drops the bump and the
+    patch registered in it together. Slides, whose changes are rolled back, are still patched,
+    which is harmless, as they are read afresh from slide DB.
+    """
+    def __init__(self, newVersion):
+        """
+        Constructor
+        """
+        (self.slideIds, self.newVersion) = (set(), newVersion)
+
+    @staticmethod
+    def queue(slideId):
+        """
+        Adds the slide to the patch of the current transaction, starting one if required.
+        Outside a transaction, the slide is patched right away.
+        """
+        # Django keeps callbacks of the current transaction in run_on_commit, as tuples starting
+        # with (savepoint ids, callback).
+        slidePatch = next(
+            (entry[1] for entry in transaction.get_connection().run_on_commit if isinstance(entry[1], SlidePatch)),
+            None)
+        if slidePatch is not None:
+            slidePatch.slideIds.add(slideId)
+        else:
+            slidePatch = SlidePatch(bumpCatalogVersion())
+            slidePatch.slideIds.add(slideId)
+            # Called right away, outside a transaction.
+            transaction.on_commit(slidePatch)
+
+    def __call__(self):
+        """
+        Patches the slides, once the transaction commits.
+        """
+        SearchIndex.patchSlides(self.slideIds, self.newVersion)
+
+
 class SearchIndex(models.Model):
     """
     Database model for slide search index.
@@ -265,11 +314,13 @@ class SearchIndex(models.Model):
     evalResults = JSONField(default={})
 
     def pickFilename(instance, filename):
-        filename = "Type_{0}.Compat_{1}.ID_{2}.Create_{3}.pkl".format(
+        # Schema version 2 onwards, index files are IndexArtifacts, not pickles.
+        filename = "Type_{0}.Compat_{1}.ID_{2}.Create_{3}.{4}".format(
             instance.indexType,
             instance.schemaVersion,
             instance.id,
-            instance.created)
+            instance.created,
+            "pkl" if instance.schemaVersion < 2 else "lisaidx")
         return os.path.join(lisaConfig.uploadsFolder, filename)
 
     pickledModelFile = models.FileField(upload_to=pickFilename)
@@ -277,8 +328,120 @@ class SearchIndex(models.Model):
     schemaVersion = models.IntegerField()
 
     # Cache object is used to select which search index data structures to
-    # keep in memory. A maximum of 3 are kept in memory at a time.
-    searchIndexCache = LRUCache(maxsize=3)
+    # keep in memory. Least recently used ones are evicted, when their estimated memory
+    # footprint exceeds the budget.
+    # LRUCache reorders entries even on lookups. All access must hold searchIndexCacheLock.
+    # Footprints are estimated before taking the lock, and passed to insert().
+    searchIndexCache = BudgetedLRUCache(
+        lisaConfig.slideSearch.indexCacheMaxBytes,
+        getsizeof=lambda modelInstance: modelInstance.memoryFootprint())
+    searchIndexCacheLock = threading.RLock()
+
+    # Makes concurrent requests for an index, which isn't loaded, wait for a single load.
+    backendFlight = SingleFlight()
+
+    # Coalesces concurrent identical searches in this process. See slideSearch().
+    searchFlight = SingleFlight()
+
+    # Latest snapshot of slide DB. Shared by all cached search indices.
+    # Catalogs and patched indices are built outside slideCatalogLock. It only guards replacing them.
+    slideCatalog = None
+    slideCatalogLock = threading.RLock()
+
+    # Makes searches needing a newer catalog wait for the patch or rebuild, which builds it.
+    catalogFlight = SingleFlight()
+
+    @classmethod
+    def getSlideCatalog(cls, catalogVersion=None):
+        """
+        Returns the SlideCatalog for catalogVersion, by default the current version of slide DB,
+        or a newer one.
+        The catalog is rebuilt only when slide DB has changed since it was last built, unless
+        a patch to the current version is in progress. Then, the patched catalog is waited for.
+        """
+        if catalogVersion is None:
+            catalogVersion = getCatalogVersion()
+        slideCatalog = cls.slideCatalog
+        if slideCatalog is not None and slideCatalog.version >= catalogVersion:
+            # A newer catalog is only patched after catalogVersion was read.
+            return slideCatalog
+        return cls.catalogFlight.do(catalogVersion, lambda: cls.rebuildSlideCatalog(catalogVersion))
+
+    @classmethod
+    def rebuildSlideCatalog(cls, catalogVersion):
+        """
+        Builds the SlideCatalog of catalogVersion from slide DB. It replaces the current catalog,
+        unless that is newer.
+        """
+        slideCatalog = buildSlideCatalog(catalogVersion)
+        with cls.slideCatalogLock:
+            if cls.slideCatalog is None or cls.slideCatalog.version < catalogVersion:
+                cls.slideCatalog = slideCatalog
+        return slideCatalog
+
+    @classmethod
+    def patchSlides(cls, slideIds, newVersion):
+        """
+        Applies changes of a few slides to the SlideCatalog and to all cached search indices,
+        instead of rebuilding them on next use.
+        newVersion is the catalog version, which the transaction changing the slides bumped to.
+        Cached search indices are never modified, as other threads may be searching them.
+        Patched copies replace them in the cache.
+        Other processes see the catalog version change and rebuild their catalog.
+        Must only be called after the changes are committed. See SlidePatch.
+        """
+        slideCatalog = cls.slideCatalog
+        if slideCatalog is None or slideCatalog.version != newVersion - 1:
+            # Nothing up to date to patch, or slide DB has also changed elsewhere.
+            # Everything is rebuilt on next use.
+            return
+        cls.catalogFlight.do(newVersion, lambda: cls.buildPatchedCatalog(slideCatalog, slideIds, newVersion))
+
+    @classmethod
+    def buildPatchedCatalog(cls, slideCatalog, slideIds, newVersion):
+        """
+        Builds the catalog patched from slideCatalog, and patched copies of search indices cached
+        on slideCatalog, without blocking searches. They replace the current ones, unless the
+        current catalog has changed meanwhile. Returns the patched catalog.
+        """
+        newCatalog = patchSlideCatalog(slideCatalog, slideIds, version=newVersion)
+        with cls.searchIndexCacheLock:
+            cachedItems = list(cls.searchIndexCache.items())
+        patchedItems = []
+        for (indexId, modelInstance) in cachedItems:
+            if modelInstance.catalog is slideCatalog:
+                patchedInstance = modelInstance.patched(newCatalog)
+                patchedItems.append((indexId, modelInstance, patchedInstance, patchedInstance.memoryFootprint()))
+
+        with cls.slideCatalogLock:
+            if cls.slideCatalog is not slideCatalog:
+                return newCatalog
+            with cls.searchIndexCacheLock:
+                for (indexId, modelInstance, patchedInstance, footprint) in patchedItems:
+                    # The index may have been evicted or reloaded meanwhile.
+                    if cls.searchIndexCache.get(indexId) is modelInstance:
+                        cls.searchIndexCache.insert(indexId, patchedInstance, footprint)
+            # Indices are replaced first, so that searches on the new catalog find them.
+            cls.slideCatalog = newCatalog
+        return newCatalog
+
+    @staticmethod
+    def onSlideSaved(sender, instance, **kwargs):
+        SlidePatch.queue(instance.id)
+
+    @staticmethod
+    def onSlideDeleted(sender, instance, **kwargs):
+        SlidePatch.queue(instance.id)
+
+    @staticmethod
+    def onSlideTagsChanged(sender, instance, action, reverse, **kwargs):
+        if action not in ["post_add", "post_remove", "post_clear"]:
+            return
+        if reverse:
+            # Slides of a tag changed.
+            bumpCatalogVersion()
+        else:
+            SlidePatch.queue(instance.id)
 
     @property
     @methodProfiler
@@ -304,26 +467,55 @@ class SearchIndex(models.Model):
 
         And searchIndexModelObj.backend returns the per-index-unique dictionary object
         with all necessary data structures required for the search index.
+
+        A cached backend is reloaded, if slide DB has changed after it was loaded.
+        Only one thread loads an index. Other threads needing the same index wait for its load.
+        """
+        return self.getBackend()
+
+    @methodProfiler
+    def getBackend(self, catalogVersion=None):
+        """
+        Returns the backend for catalogVersion of slide DB, by default the current one.
+        See backend.
         """
-        modelInstance = SearchIndex.searchIndexCache.get(self.id)
+        slideCatalog = SearchIndex.getSlideCatalog(catalogVersion)
+        modelInstance = self.cachedBackend(slideCatalog)
+        if modelInstance is None:
+            modelInstance = SearchIndex.backendFlight.do(
+                (self.id, slideCatalog.version),
+                lambda: self.loadBackend(slideCatalog))
+        return modelInstance
+
+    def cachedBackend(self, slideCatalog):
+        """
+        Returns the cached backend of this index, if it is built on slideCatalog's version, or on
+        a newer one patched meanwhile.
+        """
+        with SearchIndex.searchIndexCacheLock:
+            # Stale backends are dropped, so that they don't hold memory while the index reloads.
+            return SearchIndex.searchIndexCache.lookup(
+                self.id,
+                lambda modelInstance: modelInstance.catalog.version >= slideCatalog.version)
+
+    def loadBackend(self, slideCatalog):
+        """
+        Loads the backend of this index on slideCatalog and caches it.
+        """
+        # A load, which just finished, may have already cached it.
+        modelInstance = self.cachedBackend(slideCatalog)
         if modelInstance is None:
-            # Build data to index.
-            dataForIndexing = {}
-            print("Starting preparation of dataForIndexing")
-            for model in [Concept, SubConcept, Construct, Slide]:
-                # serializedData = serializer(model.objects.all(), many=True, context={'request': request}).data
-                modelArray = []
-                dataForIndexing[model.__name__ + "s"] = model.objects.all()
-
-            lisaConfig["slideSearch"].isDjangoModel = True
             print("Starting slideSearchIndexLoad")
             # Load and cache model instance.
             modelInstance = slideSearchIndexLoad(
                 self.pickledModelFile,
-                dataForIndexing,
+                slideCatalog,
                 lisaConfig.slideSearch,
                 self.schemaVersion)
-            SearchIndex.searchIndexCache[self.id] = modelInstance
+            # Walking the object graph of a large index is slow. Searches must not wait for it.
+            footprint = modelInstance.memoryFootprint()
+            with SearchIndex.searchIndexCacheLock:
+                SearchIndex.searchIndexCache.insert(self.id, modelInstance, footprint)
         return modelInstance
 
     def save(self, *args, **kwargs):
@@ -335,13 +527,52 @@ class SearchIndex(models.Model):
         return super().save(*args, **kwargs)
 
     @methodProfiler
-    def slideSearch(self, queryObj):
-        searchIndexBackend = queryObj.index.backend
-        permittedSlideList = getPermittedSlidesDbOptimized(queryObj.queryTemplate.queryJson)
-        retval = searchIndexBackend.slideSearch(queryObj.queryTemplate.queryJson, permittedSlideList, getIDs=True)
-
-        return retval
+    def slideSearch(self, queryObj, topK=None, excludeIds=()):
+        """
+        Returns (results, count of all results) for queryObj.
+        If topK is given, only the best topK results are ranked and returned.
+        Slides with ids in excludeIds are neither ranked nor counted. Used to rank more results
+        of a query, without changing the ones already ranked.
+        Results are cached by index, slide DB version and query. Repeated queries don't rank again.
+        Concurrent identical queries wait for a single ranking and share its results.
+        """
+        queryJson = queryObj.queryTemplate.queryJson
+        resultCache = caches[searchResultCacheAlias]
+        # Read once, so that the cached results are of the catalog they are cached for.
+        catalogVersion = getCatalogVersion()
+        cacheKey = searchResultCacheKey(queryObj.index, queryJson, topK, excludeIds, catalogVersion)
+        retval = resultCache.get(cacheKey)
+        if retval is not None:
+            return retval
+
+        def rankQuery():
+            # A flight for the key may have just finished and cached its results.
+            retval = resultCache.get(cacheKey)
+            if retval is None:
+                searchIndexBackend = queryObj.index.getBackend(catalogVersion)
+                permittedSlideIds = getPermittedSlidesDbOptimized(queryJson)
+                if excludeIds:
+                    excludedIds = set(excludeIds)
+                    permittedSlideIds = [slideId for slideId in permittedSlideIds if slideId not in excludedIds]
+                permittedSlideList = searchIndexBackend.catalog.rowsForIds(permittedSlideIds)
+                results = searchIndexBackend.slideSearch(queryJson, permittedSlideList, getIDs=True, topK=topK)
+
+                retval = (results, len(permittedSlideList))
+                resultCache.set(cacheKey, retval)
+            return retval
+
+        return SearchIndex.searchFlight.do(cacheKey, rankQuery)
 
 # Connects pre_save signal of SearchQuery.
 pre_save.connect(SearchQuery.pre_save, sender=SearchQuery)
 pre_save.connect(SearchResult.pre_save, sender=SearchResult)
+
+# Changes to slides are patched into the live SlideCatalog and search indices.
+post_save.connect(SearchIndex.onSlideSaved, sender=Slide)
+post_delete.connect(SearchIndex.onSlideDeleted, sender=Slide)
+m2m_changed.connect(SearchIndex.onSlideTagsChanged, sender=Slide.tags.through)
+
+# Changes to the hierarchy can affect many slides. SlideCatalog and search indices are rebuilt.
+for slideDbModel in [Concept, SubConcept, Construct]:
+    post_save.connect(bumpCatalogVersion, sender=slideDbModel)
+    post_delete.connect(bumpCatalogVersion, sender=slideDbModel)
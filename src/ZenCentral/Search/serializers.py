@@ -3,6 +3,7 @@ from rest_framework import serializers, pagination
 from rest_framework.reverse import reverse
 from ZenCentral.middleware import get_current_request
 from LibLisa import methodProfiler
+from LibLisa.config import lisaConfig
 from SlideDB.models import Slide
 from Search.models import SearchResult, SearchResultRating, SearchQuery, SearchIndex
 from Search.models import IndexTypeChoices, SearchQueryTemplate
@@ -170,6 +171,10 @@ class QueryResultsIteratorWithAutoInsertion(object):
     """
     For a query object, there can be large number of search results.
     We want to insert results on demand, as the DB insertion is slow.
+
+    When the query was made, only the best results may have been ranked into resultJson.
+    Rest of the results are ranked, when a page beyond them is requested. Results already in
+    resultJson are never ranked again, so that ranks seen by users don't change.
     """
     def __init__(self, queryObj):
         """
@@ -178,7 +183,7 @@ class QueryResultsIteratorWithAutoInsertion(object):
         self.queryObj = queryObj
 
         # Needed for old queries. Build resultJson, if it doesn't exist.
-        if not self.queryObj.resultJson:
+        if not self.queryObj.resultJson and not self.queryObj.resultCount:
             results = SearchResult.objects.filter(query=self.queryObj)
             self.queryObj.resultJson = [(result.score, result.slide.id) for result in results]
             self.queryObj.save()
@@ -187,7 +192,27 @@ class QueryResultsIteratorWithAutoInsertion(object):
         """
         Returns complete length of the results list.
         """
-        return len(self.queryObj.resultJson)
+        if self.queryObj.resultCount is None:
+            return len(self.queryObj.resultJson)
+        return self.queryObj.resultCount
+
+    @methodProfiler
+    def extendResults(self, stop=None):
+        """
+        Ranks results of the query into resultJson, at least up to rank stop, or all of them if
+        stop is None. Results are appended after the ones already in resultJson, whose ranks do
+        not change. More results are ranked at a time, at least resultTopK, so that paging
+        through results doesn't rank on every page.
+        """
+        rankedResults = list(self.queryObj.resultJson)
+        rankedIds = [slideId for (_, slideId) in rankedResults]
+        topK = None
+        if stop is not None:
+            topK = max(stop - len(rankedResults), lisaConfig.slideSearch.resultTopK)
+        (results, remainingCount) = self.queryObj.index.slideSearch(self.queryObj, topK, excludeIds=rankedIds)
+        self.queryObj.resultJson = rankedResults + list(results)
+        self.queryObj.resultCount = len(rankedResults) + remainingCount
+        self.queryObj.save()
 
     def __getitem__(self, key):
         """
@@ -198,6 +223,10 @@ class QueryResultsIteratorWithAutoInsertion(object):
             if key < 0:
                 key += len(self)
 
+            # Rank rest of the results, if key is beyond the ones ranked.
+            if len(self.queryObj.resultJson) <= key < len(self):
+                self.extendResults(key + 1)
+
             # Handle out of range access.
             if key < 0 or key >= len(self.queryObj.resultJson) :
                 raise IndexError("The index (%d) is out of range." % key)
@@ -214,7 +243,11 @@ class QueryResultsIteratorWithAutoInsertion(object):
         elif isinstance(key, slice):
             start = 0 if key.start is None else key.start
             step = 1 if key.step is None else key.step
-            return [self[index] for index in range(start, key.stop, step)]
+            stop = len(self) if key.stop is None else min(key.stop, len(self))
+            if len(self.queryObj.resultJson) < stop:
+                self.extendResults(stop)
+            stop = min(stop, len(self))
+            return [self[index] for index in range(start, stop, step)]
 
 
 class SearchQueryTemplateSerializer(serializers.HyperlinkedModelSerializer):
@@ -252,11 +285,15 @@ class SearchQuerySerializer(serializers.HyperlinkedModelSerializer):
                 data = dict(data)
                 data["index"] = indexUrl
 
-        if "queryJson" not in data.keys():
-            data["queryTemplate"]["queryJson"] = normalizeQueryJson(data["queryTemplate"]["queryJson"])
-        else:
-            data["queryTemplate"] = {}
-            data["queryTemplate"]["queryJson"] = normalizeQueryJson(data["queryJson"])
+        try:
+            if "queryJson" not in data.keys():
+                data["queryTemplate"]["queryJson"] = normalizeQueryJson(data["queryTemplate"]["queryJson"])
+            else:
+                data["queryTemplate"] = {}
+                data["queryTemplate"]["queryJson"] = normalizeQueryJson(data["queryJson"])
+        except ValueError as e:
+            # Invalid values in query JSON are client errors.
+            raise serializers.ValidationError({"queryJson": str(e)})
 
         instance = super(SearchQuerySerializer, self).to_internal_value(data)
         return instance
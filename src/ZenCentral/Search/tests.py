@@ -2,11 +2,36 @@
 This file demonstrates writing tests using the unittest module. These will pass
 when you run "manage.py test".
 
-Replace this with more appropriate tests for your application.
+Tests of slide search building blocks check them against the implementations they replaced
+(pyltr prediction, gensim BM25), where those are installed.
 """
 
+import os, json, shutil, tempfile, threading, time, unittest
+import numpy as np
 import django
-from django.test import TestCase
+from django.test import TestCase, SimpleTestCase
+
+from LibLisa import lisaConfig
+from LibLisa.BudgetedCache import BudgetedLRUCache
+from LibLisa.SingleFlight import SingleFlight
+from SlideSearch.SectionModel import SectionModel
+from SlideSearch.TreeEnsemble import TreeEnsemble
+from SlideSearch.Word2VecDistanceModel import (
+    Word2vecDistanceModel, quantizeVectors, dequantizeVectors, loadPrunedWord2vecModel, word2vecDistanceModel
+)
+
+try:
+    import pyltr
+except ImportError:
+    pyltr = None
+
+try:
+    from gensim.summarization.bm25 import BM25
+    # Older gensim used the corpus size in place of document length. Only compare with fixed ones.
+    if not hasattr(BM25([["word"]]), "doc_len"):
+        BM25 = None
+except ImportError:
+    BM25 = None
 
 # TODO: Configure your database in settings.py and sync before running tests.
 
@@ -23,3 +48,336 @@ class SimpleTest(TestCase):
         Tests that 1 + 1 always equals 2.
         """
         self.assertEqual(1 + 1, 2)
+
+def waitUntil(condition, timeout=10):
+    """
+    Polls condition() until it is True. Fails after timeout seconds.
+    """
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            raise AssertionError("Timed out waiting for condition.")
+        time.sleep(0.001)
+
+@unittest.skipUnless(pyltr is not None, "pyltr is not installed.")
+class TreeEnsembleTest(SimpleTestCase):
+    """Tests that TreeEnsemble scores are the same as those of pyltr."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        randomState = np.random.RandomState(0)
+        (queryCount, resultCount, featureCount) = (40, 20, 5)
+        X = randomState.exponential(scale=5.0, size=(queryCount * resultCount, featureCount)).astype(np.float32)
+        y = np.clip(np.rint(X[:, 0] / 3 + randomState.normal(size=len(X))), 0, 4)
+        qids = np.repeat(np.arange(queryCount), resultCount)
+        cls.model = pyltr.models.LambdaMART(metric=pyltr.metrics.NDCG(k=10), n_estimators=20, max_depth=4, learning_rate=0.1)
+        cls.model.fit(X, y, qids)
+        cls.X = randomState.exponential(scale=5.0, size=(5000, featureCount)).astype(np.float32)
+
+    def test_predict_matches_pyltr(self):
+        treeEnsemble = TreeEnsemble.fromLambdaMart(self.model)
+        self.assertTrue(np.array_equal(treeEnsemble.predict(self.X), self.model.predict(self.X)))
+
+    def test_predict_is_independent_of_chunks_and_threads(self):
+        treeEnsemble = TreeEnsemble.fromLambdaMart(self.model)
+        expected = self.model.predict(self.X)
+        self.assertTrue(np.array_equal(treeEnsemble.predict(self.X, chunkSize=333, threadCount=3), expected))
+        self.assertTrue(np.array_equal(treeEnsemble.predict(self.X[:1]), expected[:1]))
+        self.assertEqual(len(treeEnsemble.predict(self.X[:0])), 0)
+
+class SectionModelTest(SimpleTestCase):
+    """Tests BM25 scores of SectionModel, as documents are added and removed."""
+
+    class Dictionary(object):
+        """Stand in for a gensim Dictionary, of which SectionModel only uses token2id."""
+        def __init__(self, corpus):
+            self.token2id = {}
+            for doc in corpus:
+                for word in doc:
+                    self.token2id.setdefault(word, len(self.token2id))
+
+    @staticmethod
+    def randomCorpus(randomState, docCount, words):
+        # "common" is in most documents, so that it has a negative IDF.
+        return [["common"] * (index % 3 != 0) + list(randomState.choice(words, size=randomState.randint(1, 8)))
+                for index in range(docCount)]
+
+    def setUp(self):
+        self.randomState = np.random.RandomState(0)
+        self.words = ["w{0}".format(index) for index in range(30)]
+        self.docs = self.randomCorpus(self.randomState, 200, self.words)
+        self.model = SectionModel(self.docs, self.Dictionary(self.docs))
+        # Queries repeat words and include words not in corpus.
+        self.queries = [["common"], ["w1", "w2", "w1"], ["w3", "common", "missing"], ["new0", "w4"], ["missing"]]
+
+    def assertMatchesFreshModel(self, liveIndices):
+        """
+        Scores of live documents are the same as those of a model built from them alone.
+        """
+        liveDocs = [self.docs[index] for index in liveIndices]
+        freshModel = SectionModel(liveDocs, self.Dictionary(self.docs[:200]))
+        for query in self.queries:
+            np.testing.assert_allclose(
+                self.model.get_bm25(query, permittedIndices=liveIndices), freshModel.get_bm25(query), rtol=1e-12, atol=1e-12)
+            for (position, index) in enumerate(liveIndices[:10]):
+                self.assertAlmostEqual(self.model.get_bm25(query, corpusIndex=index), freshModel.get_bm25(query, corpusIndex=position), places=12)
+        if BM25 is not None:
+            self.assertMatchesGensim(self.model, liveDocs, liveIndices)
+
+    def assertMatchesGensim(self, model, docs, indices):
+        """
+        IDFs and BM25 scores of docs, at indices in model, are the same as those of gensim.
+        """
+        bm25 = BM25(docs)
+        averageIdf = getattr(bm25, "average_idf", sum(bm25.idf.values()) / len(bm25.idf))
+        for (word, idf) in bm25.idf.items():
+            # Older gensim replaces negative IDFs when scoring, newer ones when building.
+            expectedIdf = idf if idf >= 0 else 0.25 * averageIdf
+            self.assertAlmostEqual(model.featureIdf[model.termToId[word]], expectedIdf, places=10)
+        for query in self.queries:
+            scores = model.get_bm25(query, permittedIndices=indices)
+            for position in range(len(docs)):
+                try:
+                    expected = bm25.get_score(query, position)
+                except TypeError:
+                    expected = bm25.get_score(query, position, averageIdf)
+                self.assertAlmostEqual(scores[position], expected, places=10)
+
+    @unittest.skipUnless(BM25 is not None, "gensim.summarization.bm25 is not available.")
+    def test_bm25_matches_gensim(self):
+        self.assertMatchesGensim(self.model, self.docs, np.arange(len(self.docs)))
+        self.assertTrue(np.array_equal(self.model.get_bm25(["w1"]), self.model.get_bm25(["w1"], permittedIndices=np.arange(len(self.docs)))))
+
+    def test_add_and_remove_documents(self):
+        liveIndices = list(range(len(self.docs)))
+
+        addedDocs = self.randomCorpus(self.randomState, 50, self.words + ["new0", "new1"])
+        addedIndices = self.model.add_documents(addedDocs)
+        self.docs.extend(addedDocs)
+        self.assertEqual(list(addedIndices), list(range(200, 250)))
+        liveIndices.extend(addedIndices)
+        self.assertMatchesFreshModel(liveIndices)
+
+        # Documents are removed from both the main matrices and the delta.
+        removedIndices = [0, 3, 4, 99, 201, 249]
+        self.model.remove_documents(removedIndices + [3])
+        liveIndices = [index for index in liveIndices if index not in removedIndices]
+        self.assertMatchesFreshModel(liveIndices)
+        self.assertEqual(self.model.get_bm25(["w1", "common"], corpusIndex=3), 0)
+
+        newIndex = self.model.update_document(10, ["new1", "w5"])
+        self.docs.append(["new1", "w5"])
+        liveIndices = [index for index in liveIndices if index != 10] + [newIndex]
+        self.assertMatchesFreshModel(liveIndices)
+
+    def test_delta_merge(self):
+        liveIndices = list(range(len(self.docs)))
+        for _ in range(2):
+            addedDocs = self.randomCorpus(self.randomState, 600, self.words)
+            liveIndices.extend(self.model.add_documents(addedDocs))
+            self.docs.extend(addedDocs)
+        # Delta outgrew its limit and was merged into the main matrices.
+        self.assertEqual(self.model.deltaStart, len(self.docs))
+        self.assertEqual(self.model.tfMatrix.shape[0], len(self.docs))
+
+        removedIndices = list(range(0, len(self.docs), 7))
+        self.model.remove_documents(removedIndices)
+        liveIndices = sorted(set(liveIndices) - set(removedIndices))
+        self.assertMatchesFreshModel(liveIndices)
+
+    def test_copy_is_independent(self):
+        copiedModel = self.model.copy()
+        copiedModel.remove_documents([1, 2])
+        copiedModel.add_documents([["new0", "w1"]])
+        self.assertEqual(self.model.docCount, 200)
+        self.assertFalse(self.model.removed.any())
+        self.assertNotIn("new0", self.model.termToId)
+        self.assertMatchesFreshModel(list(range(200)))
+
+class QuantizationTest(SimpleTestCase):
+    """Tests quantization of word vectors and the word2vec store."""
+
+    def setUp(self):
+        randomState = np.random.RandomState(0)
+        self.words = ["word{0}".format(index) for index in range(500)] + ["naïve", "日本", ""]
+        vectors = randomState.normal(size=(len(self.words), 16)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors[1] = 0
+        self.vectors = vectors
+        self.storeDir = tempfile.mkdtemp()
+        self.storePath = os.path.join(self.storeDir, "store")
+
+    def tearDown(self):
+        shutil.rmtree(self.storeDir)
+
+    def test_round_trip(self):
+        (vectors, scales) = quantizeVectors(self.vectors, "float32")
+        self.assertIsNone(scales)
+        self.assertTrue(np.array_equal(dequantizeVectors(vectors, scales), self.vectors))
+
+        (vectors, scales) = quantizeVectors(self.vectors, "float16")
+        self.assertEqual(vectors.dtype, np.float16)
+        np.testing.assert_allclose(dequantizeVectors(vectors, scales), self.vectors, atol=1e-3)
+
+        (vectors, scales) = quantizeVectors(self.vectors, "int8")
+        self.assertEqual(vectors.dtype, np.int8)
+        self.assertEqual(np.abs(vectors).max(axis=1)[0], 127)
+        # Rounding error is at most half a quantization step of each row.
+        maxErrors = np.abs(dequantizeVectors(vectors, scales) - self.vectors).max(axis=1)
+        self.assertTrue(np.all(maxErrors <= scales / 2 + 1e-7))
+        self.assertTrue(np.array_equal(dequantizeVectors(vectors[1], scales[1]), np.zeros(16)))
+
+        with self.assertRaises(ValueError):
+            quantizeVectors(self.vectors, "int16")
+
+    def test_store_round_trip(self):
+        model = Word2vecDistanceModel(words=self.words, vectors=self.vectors)
+        for dtype in ["float32", "float16", "int8"]:
+            quantizedModel = model.quantized(dtype)
+            quantizedModel.save(self.storePath)
+            loadedModel = Word2vecDistanceModel(storePath=self.storePath)
+            self.assertEqual(loadedModel.vectors.dtype, np.dtype(dtype))
+            self.assertEqual(len(loadedModel.words), len(self.words))
+            self.assertEqual(sorted(loadedModel.words), sorted(self.words))
+            for word in self.words:
+                self.assertTrue(np.array_equal(loadedModel.getVector(word), quantizedModel.getVector(word)))
+            self.assertIsNone(loadedModel.getVector("missing"))
+            self.assertNotIn("missing", loadedModel.words)
+        # Scales of the int8 store are removed, when a float store replaces it.
+        model.save(self.storePath)
+        self.assertFalse(os.path.exists(self.storePath + ".scales.npy"))
+
+    def test_legacy_store(self):
+        with open(self.storePath + ".vocab.json", "w") as fp:
+            json.dump(self.words, fp)
+        np.save(self.storePath + ".vectors.npy", self.vectors)
+        loadedModel = Word2vecDistanceModel(storePath=self.storePath)
+        for (index, word) in enumerate(self.words):
+            self.assertTrue(np.array_equal(loadedModel.getVector(word), self.vectors[index]))
+
+        # Saving again converts the store.
+        loadedModel.save(self.storePath)
+        self.assertFalse(os.path.exists(self.storePath + ".vocab.json"))
+        convertedModel = Word2vecDistanceModel(storePath=self.storePath)
+        self.assertTrue(np.array_equal(convertedModel.getVector("naïve"), self.vectors[self.words.index("naïve")]))
+
+    def test_pruned_fallback(self):
+        self.assertTrue(lisaConfig.word2vecPrunedFallback)
+        model = Word2vecDistanceModel(words=self.words, vectors=self.vectors)
+        prunedModel = model.pruned(["word0", "word2", "unknown"], fallbackModel=model)
+        self.assertEqual(sorted(prunedModel.words), ["word0", "word2"])
+        self.assertTrue(np.array_equal(prunedModel.getVector("word2"), self.vectors[2]))
+        # Words missing in the pruned model are looked up from the fallback model and cached.
+        self.assertTrue(np.array_equal(prunedModel.getVector("word7"), self.vectors[7]))
+        self.assertIn("word7", prunedModel.fallbackCache)
+        self.assertIsNone(prunedModel.getVector("unknown"))
+        self.assertIsNone(model.pruned(["word0"]).getVector("word7"))
+
+        # Serving loads the pruned store with the complete model as fallback, without loading it.
+        prunedModel.save(self.storePath)
+        loadedModel = loadPrunedWord2vecModel(self.storePath)
+        self.assertIs(loadedModel.fallbackModel, word2vecDistanceModel)
+        self.assertIs(loadPrunedWord2vecModel(os.path.join(self.storeDir, "missing")), word2vecDistanceModel)
+
+class SingleFlightTest(SimpleTestCase):
+    """Tests coalescing of concurrent calls by SingleFlight."""
+
+    def runConcurrently(self, flight, function, threadCount):
+        """
+        Calls flight.do() from threadCount threads, while the first call is in flight.
+        Returns outcomes of all calls, as (result, exception) pairs.
+        """
+        release = threading.Event()
+        def blockedFunction():
+            release.wait()
+            return function()
+
+        outcomes = []
+        def call():
+            try:
+                outcomes.append((flight.do("key", blockedFunction), None))
+            except Exception as e:
+                outcomes.append((None, e))
+
+        threads = [threading.Thread(target=call) for _ in range(threadCount)]
+        threads[0].start()
+        waitUntil(lambda : flight.stats()["inFlight"] == 1)
+        for thread in threads[1:]:
+            thread.start()
+        waitUntil(lambda : flight.stats()["coalesced"] == threadCount - 1)
+        release.set()
+        for thread in threads:
+            thread.join()
+        return outcomes
+
+    def test_coalescing(self):
+        flight = SingleFlight()
+        calls = []
+        def function():
+            calls.append(None)
+            return object()
+        outcomes = self.runConcurrently(flight, function, 8)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(set(id(result) for (result, _) in outcomes)), 1)
+        self.assertEqual(flight.stats(), {"executed" : 1, "coalesced" : 7, "failed" : 0, "inFlight" : 0})
+
+        # Later calls start a new flight. Other keys are never coalesced.
+        self.assertEqual(flight.do("key", lambda : 1), 1)
+        self.assertEqual(flight.do("other", lambda : 2), 2)
+        self.assertEqual(flight.stats()["executed"], 3)
+
+    def test_failure_propagation(self):
+        flight = SingleFlight()
+        error = ValueError("failed")
+        def function():
+            raise error
+        outcomes = self.runConcurrently(flight, function, 5)
+        self.assertEqual([e for (_, e) in outcomes], [error] * 5)
+        self.assertEqual(flight.stats(), {"executed" : 1, "coalesced" : 4, "failed" : 1, "inFlight" : 0})
+
+        # A failed flight isn't remembered.
+        self.assertEqual(flight.do("key", lambda : 1), 1)
+
+class BudgetedLRUCacheTest(SimpleTestCase):
+    """Tests that BudgetedLRUCache stays within its budget of bytes."""
+
+    def test_eviction_budget(self):
+        cache = BudgetedLRUCache(100, getsizeof=len)
+        for index in range(10):
+            cache[index] = bytes(30)
+            if index == 5:
+                # Recently used values are evicted last.
+                self.assertIsNotNone(cache.lookup(3))
+            if index == 6:
+                self.assertEqual(sorted(cache.keys()), [3, 5, 6])
+            self.assertLessEqual(cache.stats()["residentBytes"], 100)
+        self.assertEqual(sorted(cache.keys()), [7, 8, 9])
+        self.assertEqual(cache.stats()["evictions"], 7)
+
+        cache.insert("estimated", bytes(10), 60)
+        self.assertEqual(sorted(cache.keys(), key=str), [9, "estimated"])
+        self.assertEqual(cache.stats()["residentBytes"], 90)
+
+    def test_oversized_value(self):
+        cache = BudgetedLRUCache(100, getsizeof=len)
+        cache["small"] = bytes(30)
+        cache["large"] = bytes(150)
+        # A value larger than the budget is kept alone.
+        self.assertEqual(list(cache.keys()), ["large"])
+        self.assertEqual(cache.stats()["residentBytes"], 150)
+        self.assertIsNotNone(cache.lookup("large"))
+        cache["small"] = bytes(30)
+        self.assertEqual(list(cache.keys()), ["small"])
+        self.assertEqual(cache.stats()["footprints"], {"small" : 30})
+
+    def test_lookup(self):
+        cache = BudgetedLRUCache(100, getsizeof=len)
+        cache["key"] = bytes(10)
+        self.assertIsNone(cache.lookup("missing"))
+        self.assertIsNotNone(cache.lookup("key", lambda value : True))
+        # Invalid values are dropped.
+        self.assertIsNone(cache.lookup("key", lambda value : False))
+        self.assertNotIn("key", cache)
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["entries"], stats["residentBytes"]), (1, 2, 0, 0))
@@ -1,5 +1,11 @@
+import hashlib, json
 from django.contrib.auth import get_user_model
-from SlideDB.models import Slide, LayoutChoices, StyleChoices, VisualStyleChoices, SlideContentChoices
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Count
+from SlideDB.models import (
+    Concept, SubConcept, Construct, Slide, SlideDbVersion, LayoutChoices, StyleChoices, VisualStyleChoices, SlideContentChoices
+)
+from SlideSearch.SlideCatalog import SlideCatalog, enumValue
 from LibLisa import methodProfiler
 
 UserModel = get_user_model()
@@ -43,6 +49,21 @@ def normalizeQueryJson(queryJson):
 
     del queryJson["Keywords"]
 
+    if "ExpandKeywords" in queryJson:
+        # Count of closest tags, each score keyword is expanded into.
+        if queryJson["ExpandKeywords"]:
+            queryJson["ExpandKeywords"] = int(queryJson["ExpandKeywords"])
+            if queryJson["ExpandKeywords"] < 0:
+                raise ValueError("ExpandKeywords must not be negative.")
+        else:
+            del (queryJson["ExpandKeywords"])
+
+    if "CandidateCount" in queryJson:
+        # Count of BM25 candidates ranked by the full model. All slides are ranked, if 0.
+        queryJson["CandidateCount"] = int(queryJson["CandidateCount"] or 0)
+        if queryJson["CandidateCount"] < 0:
+            raise ValueError("CandidateCount must not be negative.")
+
     if "HasIcon" in queryJson:
         queryJson["HasIcon"] = True if queryJson["HasIcon"] else False
 
@@ -83,17 +104,22 @@ def getPermittedSlidesDbOptimized(queryInfo):
     Any change here MUST be reflected in method SlideSearchBsae.getPermittedSlides(file SlideSearch/SlideSearchBase.py)
     *********** IMPORTANT *********
 
-    Method to return only permitted slide after filtering with all keys values.
+    Method to return ids of only permitted slides after filtering with all keys values.
+    All filters are compiled into a single SQL query, which returns only the slide ids.
     """
 
-    slides_qset = Slide.objects.all().distinct()
+    slides_qset = Slide.objects.all()
 
     if queryInfo.get("IsEnabled", True):
         slides_qset = slides_qset.filter(enabled=True)
 
     if "FilterInKeywords" in queryInfo.keys():
-        for tag in queryInfo["FilterInKeywords"]:
-            slides_qset=slides_qset.filter(tags__name__in=[tag])
+        # Slide must have all the tags. Match any of them and then count the matches per slide,
+        # instead of joining the tags table once per tag.
+        filterInKeywords = set(queryInfo["FilterInKeywords"])
+        slides_qset = slides_qset.filter(tags__name__in=filterInKeywords) \
+            .annotate(filterInMatchCount=Count("tags", distinct=True)) \
+            .filter(filterInMatchCount=len(filterInKeywords))
 
     if "FilterOutKeywords" in queryInfo.keys():
         slides_qset = slides_qset.exclude(tags__name__in=queryInfo["FilterOutKeywords"])
@@ -107,40 +133,132 @@ def getPermittedSlidesDbOptimized(queryInfo):
     if "HasImage" in queryInfo.keys():
         slides_qset = slides_qset.filter(hasImage=queryInfo["HasImage"])
 
-    permitted_slides = []
-    for slide in slides_qset:
-        if "Layout" in queryInfo.keys():
-            if slide.layout.value not in queryInfo["Layout"]:
-                # Constraints not met. No Similarity.
-                continue
-
-        if "Style" in queryInfo.keys():
-            if slide.style.value not in queryInfo["Style"]:
-                # Constraints not met. No Similarity.
-                continue
-
-        if "Content" in queryInfo.keys():
-            if slide.content.value not in queryInfo["Content"]:
-                # Constraints not met. No Similarity.
-                continue
-
-        if "VisualStyle" in queryInfo.keys():
-            if slide.visualStyle.value not in queryInfo["VisualStyle"]:
-                # Constraints not met. No Similarity.
-                continue
-
-        if not (queryInfo.get("IncludeDisabledHierarchy", False)):
-            construct = getattr(slide, "parent")
-            subConcept = getattr(construct, "parent")
-            concept = getattr(subConcept, "parent")
-            if not (getattr(concept, "enabled")) or not \
-                    (getattr(subConcept, "enabled")) or not \
-                    (getattr(construct, "enabled")):
-                continue
-
-        permitted_slides.append(slide)
-
-    return permitted_slides
+    if "Layout" in queryInfo.keys():
+        slides_qset = slides_qset.filter(layout__in=[LayoutChoices(value) for value in queryInfo["Layout"]])
+
+    if "Style" in queryInfo.keys():
+        slides_qset = slides_qset.filter(style__in=[StyleChoices(value) for value in queryInfo["Style"]])
+
+    if "Content" in queryInfo.keys():
+        slides_qset = slides_qset.filter(content__in=[SlideContentChoices(value) for value in queryInfo["Content"]])
+
+    if "VisualStyle" in queryInfo.keys():
+        slides_qset = slides_qset.filter(visualStyle__in=[VisualStyleChoices(value) for value in queryInfo["VisualStyle"]])
+
+    if not (queryInfo.get("IncludeDisabledHierarchy", False)):
+        slides_qset = slides_qset.filter(
+            parent__enabled=True,
+            parent__parent__enabled=True,
+            parent__parent__parent__enabled=True)
+
+    return list(slides_qset.values_list("id", flat=True))
+
+
+def getCatalogVersion():
+    """
+    Returns a number identifying the current contents of slide DB.
+    The number is incremented, whenever slide DB changes. See bumpCatalogVersion().
+    """
+    return SlideDbVersion.current()
+
+
+def bumpCatalogVersion(*args, **kwargs):
+    """
+    Marks that the contents of slide DB have changed. Returns the new version.
+    Must be called in the transaction making the change, so that the new version commits, or
+    rolls back, along with it. Can be connected directly to model signals.
+    """
+    return SlideDbVersion.increment()
+
+
+# Alias of the cache of search results. See CACHES in settings.
+searchResultCacheAlias = "searchResults"
+
+
+def searchResultCacheKey(searchIndex, queryJson, topK, excludeIds=(), catalogVersion=None):
+    """
+    Returns the cache key of results of queryJson on searchIndex, excluding slides with ids in
+    excludeIds, for catalogVersion of slide DB, by default the current one. queryJson is expected
+    to be normalized by normalizeQueryJson().
+    Keys of results change, whenever slide DB changes, or the index file is replaced. So, no
+    process ever needs to clear the cache.
+    """
+    indexVersion = [searchIndex.id, searchIndex.schemaVersion, searchIndex.pickledModelFile.name]
+    canonicalJson = json.dumps([indexVersion, queryJson, sorted(excludeIds)], sort_keys=True, separators=(",", ":"))
+    queryHash = hashlib.sha1(canonicalJson.encode("utf-8")).hexdigest()
+    if catalogVersion is None:
+        catalogVersion = getCatalogVersion()
+    return "SearchResults.{0}.{1}.{2}.{3}".format(searchIndex.id, catalogVersion, topK, queryHash)
+
+
+def queryConstructs(constructIds=None):
+    """
+    Returns a dictionary mapping construct id to (construct path, hierarchy enabled), as used
+    by SlideCatalog. If constructIds is None, all constructs are returned.
+    """
+    constructRows = Construct.objects.values_list(
+        "id", "name", "enabled",
+        "parent__name", "parent__enabled",
+        "parent__parent__name", "parent__parent__enabled")
+    if constructIds is not None:
+        constructRows = constructRows.filter(id__in=constructIds)
+
+    constructs = {}
+    for (constructId, name, enabled, subConceptName, subConceptEnabled, conceptName, conceptEnabled) in constructRows:
+        constructPath = (name, subConceptName, conceptName)
+        constructs[constructId] = (constructPath, bool(enabled and subConceptEnabled and conceptEnabled))
+    return constructs
+
+
+def querySlideColumns(slideIds=None):
+    """
+    Returns (slideColumns, tagsets) of slides, as used by SlideCatalog.
+    If slideIds is None, all slides are returned.
+    """
+    columnNames = ["id", "constructId", "enabled", "hasIcon", "hasImage", "layout", "style", "content", "zeptoDownloads"]
+    slideColumns = {columnName: [] for columnName in columnNames}
+    slideRows = Slide.objects.values_list(
+        "id", "parent_id", "enabled", "hasIcon", "hasImage", "layout", "style", "content", "zeptoDownloads")
+    if slideIds is not None:
+        slideRows = slideRows.filter(id__in=slideIds)
+    for slideRow in slideRows:
+        for (columnName, value) in zip(columnNames, slideRow):
+            slideColumns[columnName].append(value)
+    for columnName in ["layout", "style", "content"]:
+        slideColumns[columnName] = [enumValue(value, None) for value in slideColumns[columnName]]
+
+    slideTags = {slideId: [] for slideId in slideColumns["id"]}
+    taggedItems = Slide.tags.through.objects.filter(
+        content_type=ContentType.objects.get_for_model(Slide)).values_list("object_id", "tag__name")
+    if slideIds is not None:
+        taggedItems = taggedItems.filter(object_id__in=slideIds)
+    for (slideId, tagName) in taggedItems:
+        if slideId in slideTags:
+            slideTags[slideId].append(tagName)
+    tagsets = [slideTags[slideId] for slideId in slideColumns["id"]]
+
+    return (slideColumns, tagsets)
+
+
+@methodProfiler
+def buildSlideCatalog(version=None):
+    """
+    Builds a SlideCatalog of all slides in slide DB, using a handful of bulk queries.
+    """
+    (slideColumns, tagsets) = querySlideColumns()
+    return SlideCatalog(slideColumns, tagsets, queryConstructs(), version)
+
+
+@methodProfiler
+def patchSlideCatalog(catalog, changedSlideIds=(), removedSlideIds=(), version=None):
+    """
+    Returns a copy of catalog with changes of the given slides read from slide DB.
+    Changed slides, which are no longer in slide DB, are treated as removed.
+    """
+    (slideColumns, tagsets) = querySlideColumns(changedSlideIds)
+    removedSlideIds = set(removedSlideIds) | (set(changedSlideIds) - set(slideColumns["id"]))
+    constructs = queryConstructs(set(slideColumns["constructId"]))
+    return catalog.patched(slideColumns, tagsets, constructs, removedSlideIds, version)
 
 
 def getDefaultUser():
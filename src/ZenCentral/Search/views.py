@@ -1,7 +1,10 @@
 from rest_framework import viewsets
 from rest_framework import status
+from rest_framework.decorators import list_route
+from rest_framework.response import Response
 
 from django.shortcuts import get_object_or_404
+from django.core.cache import caches
 
 from Search.models import SearchResult, SearchResultRating, SearchQueryTemplate, SearchIndex, SearchQuery
 
@@ -10,7 +13,7 @@ from Search.serializers import (
     SearchIndexSerializer, UpsertingOnPostResultRatingSerializer, SearchQuerySerializer
 )
 
-from Search.utils import getDefaultUser
+from Search.utils import getDefaultUser, searchResultCacheAlias
 
 from ZenCentral.views import profiledModelViewSet
 from LibLisa import lastCallProfile, lisaConfig, methodProfiler, blockProfiler
@@ -79,7 +82,10 @@ class SearchQueryViewSet(profiledModelViewSet):
             with blockProfiler("create.GetSearchResults"):
                 queryObj = SearchQuery.objects.get(pk=retval.data["id"])
                 searchIndex = queryObj.index
-                queryObj.resultJson = searchIndex.slideSearch(queryObj)
+                # Only the first few pages are ranked now. See QueryResultsIteratorWithAutoInsertion.
+                (queryObj.resultJson, queryObj.resultCount) = searchIndex.slideSearch(
+                    queryObj,
+                    lisaConfig.slideSearch.resultTopK)
                 queryObj.save()
 
             with blockProfiler("create.SerializeSearchResults"):
@@ -99,6 +105,21 @@ class SearchQueryViewSet(profiledModelViewSet):
                     paginatedResults["previous"] = paginatedResults["previous"].replace("?", str(queryObj.id) + "/?")
             return retval
 
+    @list_route(methods=["get"])
+    def stats(self, request):
+        """
+        Returns counters of searches in this process. Executed searches were ranked.
+        Coalesced searches shared the ranking of an identical search in flight.
+        Search index cache reports loaded indices and their estimated memory footprint.
+        """
+        retval = {"searchFlight" : SearchIndex.searchFlight.stats()}
+        with SearchIndex.searchIndexCacheLock:
+            retval["searchIndexCache"] = SearchIndex.searchIndexCache.stats()
+        resultCache = caches[searchResultCacheAlias]
+        if hasattr(resultCache, "stats"):
+            retval["resultCache"] = resultCache.stats()
+        return Response(retval)
+
 
 class SearchIndexViewSet(profiledModelViewSet):
     """
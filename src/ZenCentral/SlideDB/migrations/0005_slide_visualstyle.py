@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import SlideDB.models
+from django.db import migrations
+import enumfields.fields
+
+
+# Visual style of each (style, layout) pair, as of this migration. Frozen here, so that later
+# changes to Slide.visualStyleMap don't change what this migration does.
+visualStyleMap = {
+    (SlideDB.models.StyleChoices.Basic, SlideDB.models.LayoutChoices.Basic) : SlideDB.models.VisualStyleChoices.Basic,
+    (SlideDB.models.StyleChoices.Basic, SlideDB.models.LayoutChoices.Enhanced) : SlideDB.models.VisualStyleChoices.Edgy,
+    (SlideDB.models.StyleChoices.Enhanced, SlideDB.models.LayoutChoices.Basic) : SlideDB.models.VisualStyleChoices.Slick,
+    (SlideDB.models.StyleChoices.Enhanced, SlideDB.models.LayoutChoices.Enhanced) : SlideDB.models.VisualStyleChoices.Fancy,
+}
+
+
+def populateVisualStyle(apps, schema_editor):
+    """
+    Stores the visual style of existing slides, derived from their style and layout.
+    """
+    Slide = apps.get_model("SlideDB", "Slide")
+    for ((style, layout), visualStyle) in visualStyleMap.items():
+        Slide.objects.filter(style=style, layout=layout).update(visualStyle=visualStyle)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('SlideDB', '0004_auto_20180517_1044'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='slide',
+            name='visualStyle',
+            field=enumfields.fields.EnumField(blank=True, db_index=True, editable=False, enum=SlideDB.models.VisualStyleChoices, max_length=10, null=True),
+        ),
+        migrations.RunPython(populateVisualStyle, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def createSlideDbVersion(apps, schema_editor):
+    """
+    Creates the single row of the slide DB version counter.
+    """
+    SlideDbVersion = apps.get_model("SlideDB", "SlideDbVersion")
+    SlideDbVersion.objects.get_or_create(id=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('SlideDB', '0005_slide_visualstyle'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SlideDbVersion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(createSlideDbVersion, migrations.RunPython.noop),
+    ]
@@ -1,5 +1,5 @@
-from django.db import models
-from django.db.models import Q, Max
+from django.db import models, transaction
+from django.db.models import Q, Max, F
 from enumfields import Enum, EnumField
 from taggit.managers import TaggableManager
 
@@ -54,6 +54,40 @@ class SlideContentChoices(Enum):
     Medium = 1
     Extensive = 2
 
+class SlideQuerySet(models.QuerySet):
+    """
+    QuerySet of slides, which keeps the derived visual style of slides in sync with their
+    style and layout, in bulk operations, which bypass Slide.save().
+    """
+    def update(self, **kwargs):
+        """
+        Updates slides. Visual style is derived again, if style or layout is updated.
+        """
+        if "style" not in kwargs and "layout" not in kwargs:
+            return super().update(**kwargs)
+        # Filters of the queryset may no longer match, once style or layout are updated.
+        slideIds = list(self.values_list("id", flat=True))
+        retval = super().update(**kwargs)
+        self.model.objects.filter(id__in=slideIds).deriveVisualStyles()
+        return retval
+
+    def deriveVisualStyles(self):
+        """
+        Derives visual style of all slides in the queryset again, from their style and layout.
+        """
+        super().update(visualStyle=None)
+        for ((style, layout), visualStyle) in Slide.visualStyleMap.items():
+            super(SlideQuerySet, self.filter(style=style, layout=layout)).update(visualStyle=visualStyle)
+
+    def bulk_create(self, objs, *args, **kwargs):
+        """
+        Creates slides, with visual style derived as in Slide.save().
+        """
+        objs = list(objs)
+        for obj in objs:
+            obj.visualStyle = obj.deriveVisualStyle()
+        return super().bulk_create(objs, *args, **kwargs)
+
 class Slide(models.Model):
     parent = models.ForeignKey(Construct, related_name="slides", on_delete=models.CASCADE)
     pptxFile = models.FileField(upload_to="uploads/pptx/", default="/static/pptx/default.pptx")
@@ -70,20 +104,31 @@ class Slide(models.Model):
     style = EnumField(StyleChoices, default=StyleChoices.Basic)
     content = EnumField(SlideContentChoices, default=SlideContentChoices.Limited)
 
-    @property
-    def visualStyle(self):
+    # Visual style is a derived attribute of a slide. It is stored, so that slides can be
+    # filtered on it in the DB. Kept in sync with style and layout by save(), and by
+    # update() and bulk_create() of SlideQuerySet. Raw SQL must derive it itself.
+    visualStyle = EnumField(VisualStyleChoices, max_length=10, null=True, blank=True, editable=False, db_index=True)
+
+    # Visual style of each (style, layout) pair. Other pairs have no visual style.
+    visualStyleMap = {
+        (StyleChoices.Basic, LayoutChoices.Basic) : VisualStyleChoices.Basic,
+        (StyleChoices.Basic, LayoutChoices.Enhanced) : VisualStyleChoices.Edgy,
+        (StyleChoices.Enhanced, LayoutChoices.Basic) : VisualStyleChoices.Slick,
+        (StyleChoices.Enhanced, LayoutChoices.Enhanced) : VisualStyleChoices.Fancy,
+    }
+
+    def deriveVisualStyle(self):
         """
-        Visual style is a derived attribute of a slide.
-        Defined as a property, so that it is availble to serializers.
+        Visual style for the current style and layout of the slide.
         """
-        if   self.style == StyleChoices.Basic and self.layout == LayoutChoices.Basic:
-            return VisualStyleChoices.Basic
-        elif self.style == StyleChoices.Basic and self.layout == LayoutChoices.Enhanced:
-            return VisualStyleChoices.Edgy
-        elif self.style == StyleChoices.Enhanced and self.layout == LayoutChoices.Basic:
-            return VisualStyleChoices.Slick
-        elif self.style == StyleChoices.Enhanced and self.layout == LayoutChoices.Enhanced:
-            return VisualStyleChoices.Fancy
+        return Slide.visualStyleMap.get((StyleChoices(self.style), LayoutChoices(self.layout)))
+
+    def save(self, *args, **kwargs):
+        """
+        On save, visual style is derived again from style and layout.
+        """
+        self.visualStyle = self.deriveVisualStyle()
+        super().save(*args, **kwargs)
 
     def zeptoNum():
         """
@@ -100,3 +145,43 @@ class Slide(models.Model):
 
     # Number of downloads of this slide made on Zepto site.
     zeptoDownloads = models.IntegerField(default=0)
+
+    objects = SlideQuerySet.as_manager()
+
+class SlideDbVersion(models.Model):
+    """
+    Single row counter, which is incremented whenever contents of slide DB change.
+    It is kept in the DB, so that all ZenCentral processes see the same version.
+    It is incremented in the transaction making the change. So, the new version is seen by other
+    processes exactly when the change is, and never for a change which is rolled back.
+    """
+    version = models.BigIntegerField(default=0)
+
+    # Primary key of the single row.
+    rowId = 1
+
+    @staticmethod
+    def current():
+        """
+        Returns the current version.
+        """
+        version = SlideDbVersion.objects.filter(id=SlideDbVersion.rowId).values_list("version", flat=True).first()
+        if version is None:
+            (counter, _) = SlideDbVersion.objects.get_or_create(id=SlideDbVersion.rowId)
+            version = counter.version
+        return version
+
+    @staticmethod
+    def increment():
+        """
+        Atomically increments the version. Returns the new version.
+        The row stays locked until the enclosing transaction ends. So, no other transaction can
+        increment it meanwhile, and the returned version is the one this transaction commits.
+        """
+        with transaction.atomic():
+            SlideDbVersion.objects.get_or_create(id=SlideDbVersion.rowId)
+            counter = SlideDbVersion.objects.select_for_update().get(id=SlideDbVersion.rowId)
+            counter.version = F("version") + 1
+            counter.save(update_fields=["version"])
+            counter.refresh_from_db(fields=["version"])
+            return counter.version
@@ -0,0 +1,149 @@
+"""
+Cache backends for ZenCentral.
+"""
+import pickle, threading, time
+from collections import OrderedDict
+
+from django.core.cache.backends.base import BaseCache, DEFAULT_TIMEOUT
+
+# Entries of all BoundedMemoryCache instances, by cache name.
+# Django creates a cache instance per thread. They must all share the same entries.
+_stores = {}
+_storesLock = threading.Lock()
+
+class _Store(object):
+    """
+    Entries of a BoundedMemoryCache, in least recently used first order.
+    """
+    def __init__(self):
+        # key -> (pickled value, expiry time or None)
+        self.entries = OrderedDict()
+        self.byteCount = 0
+        self.lock = threading.Lock()
+
+class BoundedMemoryCache(BaseCache):
+    """
+    In process memory cache, like LocMemCache, which is bounded by the bytes it holds
+    instead of the count of entries.
+    Least recently used entries are evicted, once the pickled values exceed OPTIONS["MAX_BYTES"].
+    Values larger than MAX_BYTES are not cached at all.
+
+    CACHES = {
+        "searchResults": {
+            "BACKEND": "ZenCentral.cache.BoundedMemoryCache",
+            "TIMEOUT": 3600,
+            "OPTIONS": {"MAX_BYTES": 64 * 1024 * 1024},
+        },
+    }
+    """
+    def __init__(self, name, params):
+        super().__init__(params)
+        options = params.get("OPTIONS", {})
+        self.maxBytes = int(options.get("MAX_BYTES", 64 * 1024 * 1024))
+        with _storesLock:
+            self.store = _stores.setdefault(name, _Store())
+
+    def liveEntry(self, key):
+        """
+        Returns (pickled value, expiry) at an already made key, or None. Expired entries are removed.
+        Caller must hold the store lock.
+        """
+        entry = self.store.entries.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= time.time():
+            self.deleteEntry(key)
+            return None
+        return entry
+
+    def setValue(self, key, value, timeout):
+        """
+        Stores value at an already made key, evicting least recently used entries to make space.
+        Caller must hold the store lock.
+        """
+        pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        self.deleteEntry(key)
+        if len(pickled) > self.maxBytes:
+            return
+        while self.store.entries and self.store.byteCount + len(pickled) > self.maxBytes:
+            self.deleteEntry(next(iter(self.store.entries)))
+        expiry = self.get_backend_timeout(timeout)
+        self.store.entries[key] = (pickled, expiry)
+        self.store.byteCount += len(pickled)
+
+    def deleteEntry(self, key):
+        """
+        Removes entry at an already made key. Returns True if it existed.
+        Caller must hold the store lock.
+        """
+        entry = self.store.entries.pop(key, None)
+        if entry is None:
+            return False
+        self.store.byteCount -= len(entry[0])
+        return True
+
+    def get_backend_timeout(self, timeout=DEFAULT_TIMEOUT):
+        """
+        Returns the expiry time for a timeout, or None if the entry never expires.
+        """
+        if timeout == DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        if timeout is None:
+            return None
+        return time.time() + timeout
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        with self.store.lock:
+            if self.liveEntry(key) is not None:
+                return False
+            self.setValue(key, value, timeout)
+            return True
+
+    def get(self, key, default=None, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        with self.store.lock:
+            entry = self.liveEntry(key)
+            if entry is None:
+                return default
+            self.store.entries.move_to_end(key)
+            return pickle.loads(entry[0])
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        with self.store.lock:
+            self.setValue(key, value, timeout)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        with self.store.lock:
+            entry = self.liveEntry(key)
+            if entry is None:
+                return False
+            self.store.entries[key] = (entry[0], self.get_backend_timeout(timeout))
+            return True
+
+    def delete(self, key, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        with self.store.lock:
+            return self.deleteEntry(key)
+
+    def has_key(self, key, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        with self.store.lock:
+            return self.liveEntry(key) is not None
+
+    def clear(self):
+        with self.store.lock:
+            self.store.entries.clear()
+            self.store.byteCount = 0
+
+    def stats(self):
+        """
+        Returns count of entries and bytes held.
+        """
+        with self.store.lock:
+            return {"entries": len(self.store.entries), "bytes": self.store.byteCount, "maxBytes": self.maxBytes}
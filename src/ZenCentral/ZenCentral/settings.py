@@ -99,6 +99,23 @@ DATABASES = {
     'default': lisaConfig.zenDbConf
 }
 
+# Caches
+# https://docs.djangoproject.com/en/1.9/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Results of search queries. Keys include slide DB and index versions, so that results are never stale.
+    'searchResults': {
+        'BACKEND': 'ZenCentral.cache.BoundedMemoryCache',
+        'TIMEOUT': lisaConfig.slideSearch.resultCacheTimeout,
+        'OPTIONS': {
+            'MAX_BYTES': lisaConfig.slideSearch.resultCacheMaxBytes,
+        },
+    },
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/1.9/ref/settings/#auth-password-validators
 